@@ -1,63 +1,260 @@
-from analysis import census_api, census_clean, child_centers_clean
-from analysis import distance_matrix_api
-from analysis import distance_cleaning, spatial_join
-from analysis import app
+from analysis import pipeline, profiling
 import click
 import warnings
 import webbrowser
 
-@click.command()
+@click.group(invoke_without_command=True)
 @click.option("--googleapi", default=False, help="Run Google Distance API", type=bool)
 @click.option("--gather_data", default=True, help="Run data clean and gather", type=bool)
 @click.option("--test", default=True, help="Run data clean and gather", type=bool)
+@click.option("--chunksize", default=0, help="Clean distances in chunks of this many rows", type=int)
+@click.option("--force", multiple=True, help="Run this stage even if it is up to date",
+              type=click.Choice(pipeline.STAGE_NAMES + ["all"]))
+@click.option("--dry_run", is_flag=True, help="Only print which stages would run")
+@click.option("--workers", default=4, help="Stages that can run at the same time", type=int)
+@click.option("--profile", is_flag=True, help="Measure each stage and save a report")
+@click.option("--cprofile", is_flag=True, help="With --profile, save cProfile stats per stage")
+@click.option("--refresh_centers", default=None, help="Csv of a new version of the clean childcare centers to patch the distances with",
+              type=click.Path(exists=True, dir_okay=False))
+@click.option("--vector_tiles", is_flag=True, help="Draw the tract map from vector tiles")
+@click.option("--serve_workers", default=0, help="Serve the dashboard with this many processes (0: development server)", type=int)
+@click.option("--host", default="127.0.0.1", help="Address the dashboard listens on")
+@click.option("--state", default=None, help="FIPS code or abbreviation of a state shard (states/<FIPS>/) to run the data steps on")
+@click.pass_context
 
 
-def main(gather_data, googleapi, test):
+def main(ctx, gather_data, googleapi, test, chunksize, force, dry_run, workers, profile,
+         cprofile, refresh_centers, vector_tiles, serve_workers, host, state):
     """
     Runs the retrieval and cleaning of the data in this order:
     1. Census Data (retreive and clean)
     2. Childcare Center (just clean)
     3. Distance w/ Google API and tract shapefiles (usually skip this step)
 
+    Stages whose inputs, code and options did not change since their last run
+    are skipped (see analysis/pipeline.py).
+
     Then the optimization function and lastly the visualization (app.py)
 
     Input:
         googleapi (bool): Option to run the distance calculator (time and money costly)
         gather_data (bool): Option to gather data (it's already saved in our data folder)
         test (str): Save data to test folder or regular
+        chunksize (int): If > 0, clean the distance data out-of-core in chunks
+            of this many rows (for inputs that do not fit in memory)
+        force (tuple): Stages to run even if they are up to date ("all" for every stage)
+        dry_run (bool): Print the stages that would run and exit
+        workers (int): Independent stages run in parallel on up to this many
+            threads (API stages) or processes (cleaning stages)
+        profile (bool): Measure time, memory, rows, bytes and API calls of
+            each stage and hot function, print a summary and save it as json
+            in profile/
+        cprofile (bool): With profile, also save cProfile stats of each stage
+            in profile/
+        refresh_centers (str): Csv of a new version of the clean childcare
+            centers. Only the census tracts whose three closest centers change
+            are joined again and only their new pairs get travel times (Google
+            API with googleapi, estimated otherwise), before the pipeline runs
+        vector_tiles (bool): Draw the census tract map from vector tiles
+            served by the dashboard (for maps with many tracts)
+        serve_workers (int): If > 0, serve the dashboard in production mode
+            with this many worker processes sharing the preloaded data,
+            instead of the development server
+        host (str): Address the dashboard listens on (e.g. 0.0.0.0 to serve
+            other computers)
+        state (str): Run the data steps (and refresh_centers) on the shard of
+            this state (see the states command) instead of the Illinois data,
+            without starting the dashboard
     
     Returns:
         Graphs
     """
+    if ctx.invoked_subcommand is not None:
+        return
     warnings.filterwarnings("ignore")
     if test:
         test = "test/"
-    if gather_data:
-        print("Retreiving Census Data")
-        census_api.retreive_census_data(test=test)
-        print("Cleaning Census Data")
-        census_clean.clean_census_data(test=test)
-        
-        print("Cleaning Child Center Data")
-        child_centers_clean.clean_child_centers(test=test)
-    
-        if googleapi:
-            print("Calculating Tract x Child Center Distance")
-            distance_matrix_api.get_distance_data(test=test)
-        # cleaning takes 3 steps
-        print("Cleaning Child Center Distance Data")
-        distance_cleaning.clean_distance_data(test=test)
-        distance_cleaning.aggregate_at_ct(test=test)
-        distance_cleaning.socioeconomic_merge(test=test)
-        
-        print("Merging Child Center and Census Data")
-        spatial_join.assign_ccc_to_ct(test=test)
+    else:
+        test = ""
+    if state is not None:
+        import os
+        from analysis.states import parse_states, shard_prefix
+        state = parse_states([state])[0]
+        test = shard_prefix(state, test)
+        os.makedirs(test + "data", exist_ok=True)
+    if profile:
+        profiling.enable()
+    if refresh_centers and not dry_run:
+        from analysis import delta_refresh
+        from analysis.google_api_request import get_google_distances
+        from analysis.travel_estimate import get_estimated_distances
+        delta_refresh.refresh_centers(
+            test, refresh_centers,
+            get_google_distances if googleapi else get_estimated_distances,
+            state=state)
+    if gather_data or dry_run:
+        stages = pipeline.build_stages(googleapi=googleapi, chunksize=chunksize,
+                                       state=state)
+        pipeline.run_pipeline(stages, test=test, force=force, dry_run=dry_run,
+                              workers=workers,
+                              cprofile_dir="profile" if cprofile else None)
+        if dry_run:
+            return
+    if profile:
+        profiling.write_report(profiling.collect(), "profile")
+    if state is not None:
+        return
+
+    # The dashboard dependencies are only loaded when it is started
+    from analysis import app, serve
 
     print("Visualizing Data (optional optimization)")
-    app_serv = app.early_education_dash()
+    app_serv = app.early_education_dash(vector_tiles=vector_tiles)
+    if serve_workers > 0:
+        serve.serve(app_serv.server, host=host, port=8000, workers=serve_workers,
+                    preload=lambda: app.preload(vector_tiles))
+        return
     url = "http://127.0.0.1:8000"
     webbrowser.open_new(url)
-    app_serv.run_server(debug=True, port=8000, use_reloader=False)
+    app_serv.run_server(debug=True, host=host, port=8000, use_reloader=False)
+
+
+@main.command()
+@click.argument("scenario_file", type=click.Path(exists=True, dir_okay=False))
+@click.option("--test", default=True, help="Read the data from the test folder if it is there", type=bool)
+@click.option("--out", default="scenario_results", help="Folder of the columnar results")
+@click.option("--workers", default=4, help="Scenarios that run at the same time", type=int)
+
+
+def scenarios(scenario_file, test, out, workers):
+    """
+    Runs the new child centers simulation for every scenario of a json file
+    (see analysis/scenarios.py) in parallel, saving one row per new child
+    center to a columnar dataset as each scenario finishes.
+
+    Input:
+        scenario_file (str): json file with the list of scenarios
+        test (bool): Read final_data_merged.csv from the test folder if it exists
+        out (str): Folder of the results
+        workers (int): Scenarios that run at the same time, each in its own
+            process
+    """
+    import pandas as pd
+    from analysis import scenarios as batch
+    from analysis.paths import data_path
+
+    warnings.filterwarnings("ignore")
+    scenario_list = batch.load_scenarios(scenario_file)
+    test = "test/" if test else ""
+    df = pd.read_csv(data_path(test, "final_data_merged.csv"))
+    print(f"Running {len(scenario_list)} scenarios on {len(df)} census tracts")
+    failed = batch.run_scenarios(scenario_list, df, out, workers, test)
+    if failed:
+        raise SystemExit("Failed scenarios: " + ", ".join(failed))
+
+
+@main.command()
+@click.option("--test", default=True, help="Read and save the data in the test folder", type=bool)
+@click.option("--draws", default=1000, help="Number of Monte Carlo draws", type=int)
+@click.option("--centers", default=5, help="New child centers of the greedy placement", type=int)
+@click.option("--optimized", default=True, help="Optimized placement", type=bool)
+@click.option("--seed", default=0, help="Random seed", type=int)
+
+
+def uncertainty(test, draws, centers, optimized, seed):
+    """
+    Monte Carlo analysis of the travel time imputation (see
+    analysis/uncertainty.py): draws perturbed travel times, recomputes the
+    accessibility and the greedy placement for each draw and saves how stable
+    each recommended census tract is.
+
+    Input:
+        test (bool): Read and save the data in the test folder
+        draws (int): Number of draws
+        centers (int): New child centers of the greedy placement
+        optimized (bool): Optimized placement (see create_several_child_centers)
+        seed (int): Random seed
+    """
+    import os
+    from analysis import uncertainty as monte_carlo
+
+    warnings.filterwarnings("ignore")
+    test = "test/" if test else ""
+    os.makedirs(test + "data", exist_ok=True)
+    stability = monte_carlo.run_uncertainty(test, draws, centers, optimized, seed)
+    print(stability[stability["baseline"]].to_string(index=False))
+
+
+@main.command()
+@click.argument("scenario_file", type=click.Path(exists=True, dir_okay=False))
+@click.option("--test", default=True, help="Read and save the data in the test folder", type=bool)
+@click.option("--out", default="closure_scenarios.csv", help="Csv of the results (in the data folder)")
+
+
+def closures(scenario_file, test, out):
+    """
+    Scores "what if these centers close" scenarios from the saved pairs of
+    closest centers, without new distance requests (see analysis/closures.py),
+    and saves one row per scenario.
+
+    Input:
+        scenario_file (str): text file with one scenario per line, the
+            objectids of its closed centers separated by commas or spaces
+        test (bool): Read and save the data in the test folder
+        out (str): Csv of the results, inside the data folder
+    """
+    import os
+    from analysis import closures as scoring
+
+    warnings.filterwarnings("ignore")
+    test = "test/" if test else ""
+    scenario_list = scoring.load_closure_scenarios(scenario_file)
+    nearest = scoring.load_nearest_centers(test)
+    unknown = {i for ids in scenario_list for i in ids} - set(nearest.all_ids.tolist())
+    if unknown:
+        print("Unknown center ids (no impact): " + ", ".join(map(str, sorted(unknown))))
+    print(f"Scoring {len(scenario_list)} closure scenarios on {len(nearest.geoids)} census tracts")
+    results = scoring.run_closure_scenarios(nearest, scenario_list)
+    results.insert(0, "centers", [" ".join(map(str, ids)) for ids in scenario_list])
+    os.makedirs(test + "data", exist_ok=True)
+    results.to_csv(test + "data/" + out, index=False)
+    print(results.to_string(index=False))
+
+
+@main.command()
+@click.argument("state_codes", nargs=-1, required=True)
+@click.option("--googleapi", default=False, help="Run Google Distance API (otherwise distances are estimated)", type=bool)
+@click.option("--test", default=True, help="Save the shards in the test folder", type=bool)
+@click.option("--chunksize", default=0, help="Clean distances in chunks of this many rows", type=int)
+@click.option("--force", multiple=True, help="Run this stage even if it is up to date",
+              type=click.Choice(pipeline.STAGE_NAMES + ["all"]))
+@click.option("--workers", default=4, help="States that run at the same time", type=int)
+
+
+def states(state_codes, googleapi, test, chunksize, force, workers):
+    """
+    Runs the pipeline for several states (FIPS codes or abbreviations, "all"
+    for every state), each one as an independent shard in its own process
+    (see analysis/states.py), and merges their outputs in data/states/.
+
+    Input:
+        state_codes (tuple): States to run, e.g. 17 IN 55
+        googleapi (bool): Get the travel times from the Google API (time and
+            money costly), otherwise they are estimated
+        test (bool): Save the shards and merged outputs in the test folder
+        chunksize (int): If > 0, clean the distance data in chunks
+        force (tuple): Stages to run even if they are up to date
+        workers (int): States that run at the same time
+    """
+    from analysis import states as shards
+
+    warnings.filterwarnings("ignore")
+    codes = shards.parse_states(state_codes)
+    print(f"Running the pipeline for {len(codes)} states")
+    failed = shards.run_states(codes, googleapi, chunksize, force, workers,
+                               "test/" if test else "")
+    if failed:
+        raise SystemExit("Failed states: " + ", ".join(failed))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -3,60 +3,511 @@
 
 import webbrowser
 import dash
-from dash import html, dcc, Input, Output, State
+from dash import html, dcc, Input, Output, State, Patch
 import plotly.graph_objects as go
-import plotly.express as px
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
+import plotly.colors
+import plotly.io
 import pandas as pd
-import geopandas as gpd
+import copy
+import functools
+import hashlib
 import json
+import os
+import re
+import flask
+from analysis import metrics
 from analysis.optimization import create_several_child_centers
+from analysis.paths import file_hash
 
 
 file_path = "data/final_data_merged.csv"
 gdf_path = "data/tl_2023_17_tract/tl_2023_17_tract.shp"
+centers_path = "data/Child_Care_Centers_clean.csv"
+cache_dir = "data/dashboard_cache"
 
-df_final = pd.read_csv(file_path)
-df_final["GEOID"] = df_final["GEOID"].astype(str)
-
-# Reads the shapefile data into a GeoDataFrame based on GEOID. 
-# Loads and merges with DataFrame to associate it with the geographic locations
-gdf = gpd.read_file(gdf_path)
-gdf["GEOID"] = gdf["GEOID"].astype(str)
-gdf = gdf.merge(
-    df_final[["GEOID", "pop_under5", "distance_min_imp", "distance_mean_imp"]],
-    on="GEOID",
-    how="left",)
-
-# Generates hover text and combines data points for each geographic unit
-gdf["hover_text"] = gdf.apply(
-    lambda row: (
-        f'Census Tract Code: {row["GEOID"]}<br>'
-        f'County Codes of Illinois: {row.get("COUNTYFP", "N/A")}<br>'
-        f'Population of Children Under 5: {row.get("pop_under5", "N/A"):.2f}<br>'
-        f'Distance to Closest ECC (min): {row.get("distance_min_imp", "N/A"):.2f}<br>'
-        f'Average Distance to Closest 3 ECC (min): {row.get("distance_mean_imp", "N/A"):.2f}'
-    ), axis=1,)
-
-geojson = json.loads(gdf.to_json())     # Converts to GEOJSON for plotting
-
-# Maps from column values to more "human-readable" category names
-race_mapping = {"majority_white": "Majority White",
-    "majority_black": "Majority Black",
-    "majority_asian": "Majority Asian",
-    "majority_hispanic": "Majority Hispanic",}
-for race_col, race_name in race_mapping.items():
-    df_final.loc[df_final[race_col] == 1, "race_category"] = race_name
-
-# Categorizes homeowner rate and education level into bins for analysis
-df_final["housing_category"] = pd.cut(df_final["homeowner_rate"],
-    bins=[-1, 0.5, 1],
-    labels=["Lower Homeownership", "Higher Homeownership"])
-df_final["education_category"] = pd.cut(
-    df_final["higher_education_rate"],
-    bins=[-1, 0.5, 1],
-    labels=["Lower Education", "Higher Education"])
+# Change when the format of the precomputed map data changes
+MAP_DATA_VERSION = 2
+
+# Map projection scale up to which each geometry detail level (see
+# geometry.ZOOM_LEVELS) is used, the Illinois map opens at a scale of ~30
+MAP_DETAIL_SCALES = [(60, "state"), (300, "county"), (float("inf"), "tract")]
+
+# Vector tiles of the tracts (see analysis/tiles.py), colored in bins of
+# distance to closest ECC
+TILE_PATH = "/tiles/{z}/{x}/{y}.pbf"
+TILE_BINS = 8
+TILE_ATTRIBUTES = ["distance_min_imp", "pop_under5"]
+
+# Columns of the census tract data used by the dashboard and their types. The
+# columns of the simulation (see optimization.py) keep their precision, the
+# others are downcast; the rest of the columns are not loaded
+TRACT_SCHEMA = {
+    "GEOID": "int64",
+    "STATEFP": "int8",
+    "COUNTYFP": "int16",
+    "centroid_lat": "float64",
+    "centroid_lon": "float64",
+    "distance_min_imp": "float64",
+    "hdistance_min": "float64",
+    "distance_mean_imp": "float32",
+    "hdistance_mean": "float32",
+    "pop_under5": "int32",
+    "homeowner_rate": "float32",
+    "mobility_rate": "float32",
+    "less_than_hs_rate": "float32",
+    "higher_education_rate": "float32",
+    "below_poverty_rate": "float32",
+    "majority_white": "int8",
+    "majority_black": "int8",
+    "majority_asian": "int8",
+    "majority_hispanic": "int8",
+}
+
+# Limits of the /nearest endpoint
+NEAREST_MAX_K = 50
+NEAREST_MAX_POINTS = 10_000
+
+
+def data_version():
+    """
+    Returns (tuple): size and modification time of the census tract data, to
+        reload the data and the cached figures when it changes
+    """
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def dashboard_data():
+    """
+    Loads the data of the dashboard the first time it is needed (and keeps it
+    for the following calls), so importing this module does not read any file.
+
+    Returns (dict): "df_final" (pandas df) with the census tract data, "map"
+        (dict) with the Illinois map data (see load_map_data) and
+        "speed_bounds" (pandas Series) of the simulation (see
+        travel_estimate.speed_bounds)
+    """
+    return load_dashboard_data(data_version())
+
+
+@functools.lru_cache(maxsize=1)
+def load_dashboard_data(version):
+    """
+    Loads the data of the dashboard for a version of the census tract data
+    (see dashboard_data).
+    """
+    from analysis.travel_estimate import load_speed_bounds
+
+    df_final = load_tract_data(file_path)
+    return {"df_final": df_final, "map": load_map_data(df_final, file_path, gdf_path),
+            "speed_bounds": load_speed_bounds()}
+
+
+def preload(vector_tiles=False):
+    """
+    Loads all the data the dashboard uses (census tract data, map geometry of
+    every zoom level and, if used, the vector tile source), e.g. before
+    starting worker processes that share it.
+    """
+    from analysis import geometry
+
+    dashboard_data()
+    for level in geometry.ZOOM_LEVELS:
+        map_geojson(level)
+    if vector_tiles:
+        tile_source()
+    center_index()
+    # plotly imports its json encoder on first use, do it before the
+    # workers start threads
+    plotly.io.json.to_json_plotly({})
+
+
+def is_ready():
+    """
+    Returns (bool): True if the data of the dashboard is loaded
+    """
+    return load_dashboard_data.cache_info().currsize > 0
+
+
+def collect_cache_metrics():
+    """
+    Copies the hits and misses of the in-memory caches (figures, map geometry
+    and vector tiles) to the cache metrics.
+    """
+    caches = {"figures": cached_figure, "map_geojson": map_geojson}
+    if tile_source.cache_info().currsize:
+        caches["tiles"] = tile_source().tile
+    for name, cache in caches.items():
+        info = cache.cache_info()
+        metrics.CACHE_REQUESTS.set(info.hits, cache=name, result="hit")
+        metrics.CACHE_REQUESTS.set(info.misses, cache=name, result="miss")
+
+
+metrics.add_collector(collect_cache_metrics)
+
+
+@functools.lru_cache(maxsize=128)
+def cached_figure(figure_function, version, *args):
+    """
+    Builds a figure once for each combination of inputs and version of the
+    data (see data_version), so the callbacks only look it up.
+
+    Inputs:
+        figure_function (function): function building the figure from args
+        version (tuple): version of the census tract data
+
+    Returns (dict): the figure as a plotly json dictionary
+    """
+    return figure_function(*args).to_plotly_json()
+
+
+def load_tract_data(file_path):
+    """
+    Reads the columns of TRACT_SCHEMA of the census tract data and adds the
+    categories used in the graphs (as categoricals).
+
+    Returns (pandas df): the census tract data
+    """
+    df_final = pd.read_csv(file_path, usecols=list(TRACT_SCHEMA), dtype=TRACT_SCHEMA)
+
+    # Maps from column values to more "human-readable" category names
+    race_mapping = {"majority_white": "Majority White",
+        "majority_black": "Majority Black",
+        "majority_asian": "Majority Asian",
+        "majority_hispanic": "Majority Hispanic",}
+    race_category = pd.Series(pd.NA, index=df_final.index, dtype=object)
+    for race_col, race_name in race_mapping.items():
+        race_category[df_final[race_col] == 1] = race_name
+    df_final["race_category"] = race_category.astype(
+        pd.CategoricalDtype(sorted(race_mapping.values())))
+
+    # Categorizes homeowner rate and education level into bins for analysis
+    df_final["housing_category"] = pd.cut(df_final["homeowner_rate"],
+        bins=[-1, 0.5, 1],
+        labels=["Lower Homeownership", "Higher Homeownership"])
+    df_final["education_category"] = pd.cut(
+        df_final["higher_education_rate"],
+        bins=[-1, 0.5, 1],
+        labels=["Lower Education", "Higher Education"])
+
+    return df_final
+
+
+def geoid_strings(geoids):
+    """
+    Returns (pandas Series): GEOIDs (integers) as the 11 character codes of
+        the shapefile
+    """
+    return geoids.astype(str).str.zfill(11)
+
+
+def map_cache_path(level=None):
+    """
+    Path of the precomputed Illinois map data in data/dashboard_cache/, named
+    after the hash of the census tract data and the shapefile. Without a
+    level, the file has the values and the "state" geometry, otherwise only the
+    geometry of that detail level.
+    """
+    key = hashlib.sha256(
+        json.dumps([MAP_DATA_VERSION, file_hash(file_path),
+                    file_hash(os.path.dirname(gdf_path))]).encode()
+    ).hexdigest()[:16]
+    name = f"map_{key}.json" if level is None else f"map_{key}_{level}.json"
+    return os.path.join(cache_dir, name)
+
+
+def load_map_data(df_final, file_path, gdf_path):
+    """
+    Loads the data of the Illinois map from the precomputed files (see
+    map_cache_path). If the data or the shapefile changed (or it is the first
+    run), the map data is built from the shapefile and saved.
+
+    Returns (dict): "geojson" with the simplified tract polygons and, for each
+        tract, "locations" (GEOID), "z" (distance to closest ECC) and
+        "hover_text"
+    """
+    cache_path = map_cache_path()
+    if os.path.exists(cache_path):
+        metrics.CACHE_REQUESTS.inc(cache="map_data", result="hit")
+        with open(cache_path, "r") as file:
+            return json.load(file)
+
+    metrics.CACHE_REQUESTS.inc(cache="map_data", result="miss")
+    map_data = build_map_data(df_final, gdf_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    for level, geojson in map_data.pop("geojson_levels").items():
+        with open(map_cache_path(level), "w") as file:
+            json.dump(geojson, file, separators=(",", ":"))
+    with open(cache_path, "w") as file:
+        json.dump(map_data, file, separators=(",", ":"))
+    return map_data
+
+
+@functools.lru_cache(maxsize=None)
+def map_geojson(level):
+    """
+    Returns (dict): GeoJSON of the Illinois tracts at a detail level of
+        geometry.ZOOM_LEVELS
+    """
+    dashboard_data()
+    with open(map_cache_path(level), "r") as file:
+        return json.load(file)
+
+
+def map_detail_level(projection_scale):
+    """
+    Returns (str): geometry detail level for a map projection scale
+    """
+    for max_scale, level in MAP_DETAIL_SCALES:
+        if projection_scale <= max_scale:
+            return level
+
+
+def build_map_data(df_final, gdf_path):
+    """
+    Builds the Illinois map data from the shapefile (see load_map_data), with
+    the tract polygons simplified for each level of geometry.ZOOM_LEVELS in
+    "geojson_levels".
+    """
+    import geopandas as gpd
+    from analysis import geometry
+
+    # Reads the shapefile data into a GeoDataFrame based on GEOID.
+    # Loads and merges with DataFrame to associate it with the geographic locations
+    gdf = gpd.read_file(gdf_path)[["GEOID", "COUNTYFP", "geometry"]]
+    gdf["GEOID"] = gdf["GEOID"].astype(str)
+    values = df_final[["GEOID", "pop_under5", "distance_min_imp", "distance_mean_imp"]]
+    gdf = gdf.merge(values.assign(GEOID=geoid_strings(values["GEOID"])),
+        on="GEOID",
+        how="left",)
+
+    # Generates hover text and combines data points for each geographic unit
+    hover_text = (
+        "Census Tract Code: " + gdf["GEOID"] + "<br>"
+        + "County Codes of Illinois: " + gdf["COUNTYFP"].astype(str) + "<br>"
+        + "Population of Children Under 5: "
+        + gdf["pop_under5"].map("{:.2f}".format) + "<br>"
+        + "Distance to Closest ECC (min): "
+        + gdf["distance_min_imp"].map("{:.2f}".format) + "<br>"
+        + "Average Distance to Closest 3 ECC (min): "
+        + gdf["distance_mean_imp"].map("{:.2f}".format))
+
+    # Simplifies the shared tract borders (no gaps between tracts) for each
+    # zoom level, only GEOID is needed as a property
+    topology = geometry.build_topology(gdf.geometry)
+    properties = [{"GEOID": geoid} for geoid in gdf["GEOID"]]
+    geojson_levels = {
+        level: geometry.to_geojson(topology, properties, tolerance)
+        for level, tolerance in geometry.ZOOM_LEVELS.items()
+    }
+
+    return {"geojson": geojson_levels["state"],
+        "geojson_levels": geojson_levels,
+        "locations": gdf["GEOID"].tolist(),
+        "z": gdf["distance_min_imp"].tolist(),
+        "hover_text": hover_text.tolist()}
+
+
+def map_center():
+    """
+    Returns (dict): latitude and longitude of the middle of the census tracts
+        of the data (the maps open there, whatever the state)
+    """
+    df = dashboard_data()["df_final"]
+    return dict(lat=round((df["centroid_lat"].min() + df["centroid_lat"].max()) / 2, 2),
+                lon=round((df["centroid_lon"].min() + df["centroid_lon"].max()) / 2, 2))
+
+
+def tile_bins():
+    """
+    Returns (lst): upper edges of the bins of distance to closest ECC (equal
+        number of tracts per bin) used to color the tract vector tiles
+    """
+    distance = dashboard_data()["df_final"]["distance_min_imp"]
+    quantiles = distance.quantile([i / TILE_BINS for i in range(1, TILE_BINS)])
+    return sorted(set(quantiles.round(2)))
+
+
+@functools.lru_cache(maxsize=None)
+def tile_source():
+    """
+    Loads the tract polygons and their attributes for the vector tiles the
+    first time a tile is requested.
+
+    Returns (tiles.TileSource): the tile source
+    """
+    import geopandas as gpd
+    from analysis import tiles
+
+    gdf = gpd.read_file(gdf_path)[["GEOID", "geometry"]]
+    gdf["GEOID"] = gdf["GEOID"].astype(str)
+    values = dashboard_data()["df_final"][["GEOID"] + TILE_ATTRIBUTES]
+    gdf = gdf.merge(values.assign(GEOID=geoid_strings(values["GEOID"])),
+        on="GEOID", how="left")
+    return tiles.TileSource(gdf, TILE_ATTRIBUTES, "distance_min_imp", tile_bins())
+
+
+@functools.lru_cache(maxsize=None)
+def center_index():
+    """
+    Loads the indexes of the childcare centers and census tracts of the
+    /nearest endpoint the first time they are needed.
+
+    Returns (lookup.CenterIndex): the indexes
+    """
+    from analysis import lookup
+
+    return lookup.load_center_index(centers_path, gdf_path)
+
+
+def parse_nearest_request(request):
+    """
+    Reads the points and number of centers of a /nearest request: GET with
+    "lat", "lon" and "k" arguments, or POST with a json body
+    {"points": [[lat, lon], ...], "k": 3}.
+
+    Inputs:
+        request (flask.Request): the request
+
+    Returns (tuple): latitudes (lst), longitudes (lst) and k (int)
+    """
+    if request.method == "POST":
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or not isinstance(body.get("points"), list):
+            raise ValueError('the body must be {"points": [[lat, lon], ...], "k": 3}')
+        points, k = body["points"], body.get("k", 3)
+        if not all(isinstance(point, list) and len(point) == 2 for point in points):
+            raise ValueError("each point must be [lat, lon]")
+    else:
+        points = [[request.args.get("lat"), request.args.get("lon")]]
+        k = request.args.get("k", 3)
+
+    if len(points) > NEAREST_MAX_POINTS:
+        raise ValueError(f"at most {NEAREST_MAX_POINTS} points per request")
+    try:
+        lat = [float(point[0]) for point in points]
+        lon = [float(point[1]) for point in points]
+        k = int(k)
+    except (TypeError, ValueError):
+        raise ValueError("lat, lon and k must be numbers") from None
+    if not all(-90 <= value <= 90 for value in lat) or not all(
+            -180 <= value <= 180 for value in lon):
+        raise ValueError("lat must be in [-90, 90] and lon in [-180, 180]")
+    if not 1 <= k <= NEAREST_MAX_K:
+        raise ValueError(f"k must be between 1 and {NEAREST_MAX_K}")
+    return lat, lon, k
+
+
+def tile_url():
+    """
+    Returns (str): absolute URL of the vector tiles on the host and port the
+        browser reached (from the Host header of the current request). The
+        map layers load the tiles in web workers, which do not resolve
+        relative URLs.
+    """
+    if not flask.has_request_context():
+        return TILE_PATH
+    return flask.request.host_url.rstrip("/") + TILE_PATH
+
+
+def create_tile_map(tile_url=TILE_PATH):
+    """
+    Generates a map of the census tracts from vector tiles, so the browser
+    only downloads the tracts in view at the detail of the current zoom. Each
+    bin of distance to the closest ECC is a map layer with its own color.
+
+    Returns:
+        fig: A Plotly graph object figure containing the configured map.
+    """
+    from analysis import tiles
+
+    bins = tile_bins()
+    colors = plotly.colors.sample_colorscale("Blues", len(bins) + 1, low=0.15)
+    edges = [0] + bins
+    names = [f"{low:.1f} - {high:.1f} min" for low, high in zip(edges, edges[1:])]
+    names.append(f"more than {edges[-1]:.1f} min")
+
+    layers = [dict(sourcetype="vector", source=[tile_url],
+        sourcelayer=f"{tiles.LAYER_PREFIX}{i}", type="fill", color=color,
+        opacity=0.8, below="traces") for i, color in enumerate(colors)]
+    layers.append(dict(sourcetype="vector", source=[tile_url],
+        sourcelayer=f"{tiles.LAYER_PREFIX}na", type="fill", color="lightgrey",
+        opacity=0.8, below="traces"))
+
+    # New ECCs of the simulation (see simulation_map_patch) and empty traces,
+    # only to show the color of each bin in the legend
+    fig = go.Figure([new_centers_trace(go.Scattermapbox)] + [go.Scattermapbox(lat=[None], lon=[None], mode="markers",
+        marker=dict(size=12, color=color), name=name)
+        for name, color in zip(names, colors)])
+
+    fig.update_layout(
+        title_text="Exploring Distances to Closest Early Childcare Centers",
+        legend_title_text="Distance to ECC",
+        mapbox=dict(style="carto-positron", center=map_center(),
+            zoom=5.5, layers=layers),
+        margin=dict(l=0, r=0, t=40, b=0))
+    return fig
+
+
+def new_centers_trace(trace_type):
+    """
+    Creates the (empty) marker trace of the new ECCs of a simulation.
+
+    Inputs:
+        trace_type (class): go.Scattergeo or go.Scattermapbox
+
+    Returns: the trace
+    """
+    return trace_type(lat=[], lon=[], mode="markers", name="New ECC",
+        marker=dict(size=12, color="#d62728", symbol="circle"),
+        hoverinfo="text", text=[], showlegend=False)
+
+
+def simulation_map_patch(df, new_centers, previous_rows, vector_tiles=False):
+    """
+    Creates a partial update of the census tract map with the result of a
+    simulation: the new ECCs as markers and, in the choropleth, the distance to
+    the closest ECC of the tracts that changed. The tracts changed by the
+    previous simulation are set back to their original values, so only those
+    values are sent to the browser.
+
+    Inputs:
+        df (pandas df): census tract data after the simulation
+        new_centers (lst): (GEOID, latitude, longitude) of the new ECCs
+        previous_rows (lst): rows of the map changed by the previous
+            simulation
+        vector_tiles (bool): the map is the vector tile map (markers only)
+
+    Returns (tuple): the Patch of the figure and the list of changed rows
+    """
+    patched_figure = Patch()
+    centers_trace = patched_figure["data"][0 if vector_tiles else 1]
+    centers_trace["lat"] = [lat for _, lat, _ in new_centers]
+    centers_trace["lon"] = [lon for _, _, lon in new_centers]
+    centers_trace["text"] = [f"New ECC in Census Tract {geoid}"
+        for geoid, _, _ in new_centers]
+    if vector_tiles:
+        return patched_figure, []
+
+    map_data = dashboard_data()["map"]
+    rows = {geoid: row for row, geoid in enumerate(map_data["locations"])}
+    original = pd.Series(map_data["z"], index=map_data["locations"], dtype=float)
+    new_distance = df.set_index(geoid_strings(df["GEOID"]))["distance_min_imp"]
+    new_distance = new_distance[new_distance.index.isin(original.index)]
+    changed = new_distance[new_distance.ne(original[new_distance.index])]
+
+    choropleth = patched_figure["data"][0]
+    for geoid, distance in changed.items():
+        row = rows[geoid]
+        choropleth["z"][row] = distance
+        choropleth["text"][row] = re.sub(r"Distance to Closest ECC \(min\): [^<]*",
+            f"Distance to Closest ECC (min): {distance:.2f}",
+            map_data["hover_text"][row])
+    changed_rows = [rows[geoid] for geoid in changed.index]
+    for row in set(previous_rows or []) - set(changed_rows):
+        choropleth["z"][row] = map_data["z"][row]
+        choropleth["text"][row] = map_data["hover_text"][row]
+    return patched_figure, changed_rows
 
 
 def create_us_map():
@@ -115,21 +566,25 @@ def create_il_map():
     Returns:
         fig_il: A Plotly graph object figure containing the configured map.
     """
+    map_data = dashboard_data()["map"]
     fig_il = go.Figure(
-        data=go.Choropleth(geojson=geojson,
+        data=go.Choropleth(geojson=map_data["geojson"],
             featureidkey="properties.GEOID",
-            locations=gdf["GEOID"],  # Uses the GEOID for mapping each tract
-            z=gdf["distance_min_imp"],  # Minimum distance for color coding
-            text=gdf["hover_text"],
+            locations=map_data["locations"],  # Uses the GEOID for mapping each tract
+            z=map_data["z"],  # Minimum distance for color coding
+            text=map_data["hover_text"],
             hoverinfo="text",
             colorscale="Blues",  
             colorbar_title="Distance to ECC<br>(min)", 
             marker_line_color="white",
             marker_line_width=0.1))
 
+    # New ECCs of the simulation (see simulation_map_patch)
+    fig_il.add_trace(new_centers_trace(go.Scattergeo))
+
     # Sets the map bounds to the extent of the GeoJSON data
     fig_il.update_geos(visible=True,projection_scale=3,  
-        center=dict(lat=39.8, lon=-89.6), fitbounds="locations")
+        center=map_center(), fitbounds="locations")
 
     fig_il.update_layout(
         title_text="Exploring Distances to Closest Early Childcare Centers",
@@ -137,14 +592,178 @@ def create_il_map():
             # Hides irrelevant features such as coast, neighbouring States, ...
             showframe=False, showcoastlines=False, showcountries=False,
             showland=False,landcolor="rgba(255, 255, 255, 0)"),
-        margin=dict(l=0, r=0, t=40, b=0))
+        margin=dict(l=0, r=0, t=40, b=0),
+        # Keeps the user's zoom when the geometry detail level changes
+        uirevision="il-map")
     return fig_il
 
 
-def early_education_dash():
+# Maximum number of outliers drawn per box of the accessibility graph
+BOX_MAX_OUTLIERS = 50
+
+# Colors of the bars of the demographic graph (matplotlib "Blues" in 8 colors)
+BAR_COLORS = ["#f7fbff", "#dbe9f6", "#bbd6eb", "#88bedc",
+              "#549ecd", "#2a7aba", "#0c56a0", "#08306b"]
+
+# Variables and their names for each option of the demographic graph
+RACE_ANALYSIS = {
+    "Race Analysis": (["majority_white", "majority_black", "majority_hispanic",
+        "majority_asian"], ["Majority White", "Majority Black",
+        "Majority Hispanic", "Majority Asian"]),
+    "Housing": (["homeowner_rate", "mobility_rate"],
+        ["Homeowner Rate", "Mobility Rate"]),
+    "Education": (["less_than_hs_rate", "higher_education_rate"],
+        ["Less Than High School Rate", "Higher Education Rate"]),
+    "Income": (["below_poverty_rate"], ["Below Poverty Rate"]),
+}
+
+
+def race_bar_figure(value):
+    """
+    Creates the demographic bar graph for an analysis category: the share of
+    tracts of each race majority ("Race Analysis") or the mean of the
+    category's rates for the tracts of each race majority.
+
+    Returns:
+        fig: A Plotly graph object figure with the bar graph.
+    """
+    if value not in RACE_ANALYSIS:
+        value = "Race Analysis"
+    current_analysis, current_analysis_labels = RACE_ANALYSIS[value]
+
+    df_final = dashboard_data()["df_final"]
+    if value != "Race Analysis":
+        # observed=True does not always return the groups sorted
+        race_percentages = df_final.groupby("race_category", observed=True)[
+            current_analysis].mean().sort_index().reset_index()
+        long_race = pd.melt(race_percentages, id_vars=['race_category'], value_vars=current_analysis)
+        variable_labels = long_race["variable"].map(
+            dict(zip(current_analysis, current_analysis_labels)))
+        custom_labels = ("Mean " + variable_labels + " for "
+            + long_race["race_category"].astype(str) + " Tracts").tolist()
+        y_val = 100*long_race["value"]
+        text_val = [f"{val:.2f}%" for val in 100*long_race["value"].astype(float)]
+    else:
+        majority_counts = df_final[current_analysis].sum()
+        total_tracts = len(df_final)
+        race_percentages = (majority_counts / total_tracts) * 100
+        custom_labels = current_analysis_labels
+        y_val = race_percentages
+        text_val = [f"{val:.2f}%" for val in race_percentages.values]
+
+    race_bar_graph_figure = go.Figure(
+        [
+            go.Bar(
+                x = custom_labels,
+                y=y_val,
+                text = text_val,
+                textposition="auto",
+                marker_color=BAR_COLORS,
+            )
+        ]
+    )
+
+    race_bar_graph_figure.update_layout(
+        title_text="Demographic Analysis Across Census Tracts",
+        xaxis_title="Demographic Factor",
+        yaxis_title="Percentage",
+        yaxis=dict(ticksuffix="%"),
+    )
+
+    return race_bar_graph_figure
+
+
+def box_statistics(df, group_col, value_col, max_outliers=BOX_MAX_OUTLIERS):
+    """
+    Computes the statistics of a box plot of value_col for each group of
+    group_col, so the browser receives a few numbers per group instead of
+    every census tract.
+
+    Inputs:
+        df (pandas df): census tract data
+        group_col (str): column with the groups (one box per group)
+        value_col (str): column with the values
+        max_outliers (int): maximum number of outliers kept per group (a
+            random sample of them)
+
+    Returns (tuple): pandas df with one row per group and columns q1, median,
+        q3, mean, lowerfence, upperfence (most extreme values within 1.5 IQR
+        of the quartiles), notchspan (1.57 IQR / sqrt(n), the confidence
+        interval of the median) and n, and pandas df with the sampled
+        outliers (group_col and value_col)
+    """
+    data = df[[group_col, value_col]].dropna()
+    groups = data.groupby(group_col, observed=True)[value_col]
+    stats = groups.quantile([0.25, 0.5, 0.75]).unstack()
+    stats.columns = ["q1", "median", "q3"]
+    stats["mean"] = groups.mean()
+    stats["n"] = groups.size()
+    iqr = stats["q3"] - stats["q1"]
+    stats["notchspan"] = 1.57 * iqr / stats["n"] ** 0.5
+
+    # whiskers go to the most extreme values inside the fences
+    low_limit = data[group_col].map(stats["q1"] - 1.5 * iqr).astype(float)
+    high_limit = data[group_col].map(stats["q3"] + 1.5 * iqr).astype(float)
+    inside = data[value_col].between(low_limit, high_limit)
+    stats["lowerfence"] = data[inside].groupby(group_col, observed=True)[value_col].min()
+    stats["upperfence"] = data[inside].groupby(group_col, observed=True)[value_col].max()
+
+    outliers = (data[~inside].sample(frac=1, random_state=0)
+        .groupby(group_col, observed=True).head(max_outliers))
+    return stats.sort_index(), outliers
+
+
+def accessibility_box_figure(selected_factor, y_col):
+    """
+    Creates the box plots of a distance to ECCs measure for the groups of a
+    socioeconomic factor, from statistics computed here (see box_statistics)
+    and a sample of the outliers.
+
+    Returns:
+        fig: A Plotly graph object figure with the box plots.
+    """
+    stats, outliers = box_statistics(dashboard_data()["df_final"],
+        selected_factor, y_col)
+    groups = stats.index.astype(str).tolist()
+
+    fig = go.Figure([
+        go.Box(
+            x=groups,
+            q1=stats["q1"], median=stats["median"], q3=stats["q3"],
+            mean=stats["mean"],
+            lowerfence=stats["lowerfence"], upperfence=stats["upperfence"],
+            notchspan=stats["notchspan"],
+            notched=True,   # Visual indication of median's confidence interval
+            marker_color="#1f77b4",
+            name=y_col,
+            showlegend=False),
+        go.Scatter(
+            x=outliers[selected_factor].astype(str),
+            y=outliers[y_col],
+            mode="markers",
+            marker_color="#1f77b4",
+            name="outliers",
+            showlegend=False),
+    ])
+
+    fig.update_layout(
+        title="""Average Distance to Nearest Childcare Centers Among Different Socioeconomic Groups""",
+        yaxis_title="Distance to Closest ECCs",
+        xaxis_title=selected_factor.replace("_", " ").title(),
+        xaxis=dict(categoryorder="array", categoryarray=groups),
+        boxmode="group")
+
+    return fig
+
+
+def early_education_dash(vector_tiles=False):
     """
     Initializes and configures the Dash app for visualizing early childhcare 
     data, focusing on Early Childcare Center (ECC) accessibility in Illinois.
+
+    Inputs:
+        vector_tiles (bool): Draw the census tract map from the vector tiles
+            served at /tiles/ instead of one GeoJSON
     
     Returns:
         A Dash app configured with the layout and callbacks necessary for the
@@ -154,264 +773,308 @@ def early_education_dash():
     external_stylesheets = ["https://codepen.io/chriddyp/pen/bWLwgP.css"]
     app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 
-    app.layout = html.Div(
-        children=[
-            html.H1(
-                children='''Bridging the Gap: Enhancing Early Childhood 
-                Education Access in Illinois''',
-                style={
-                    "font-size": "2.5em",
-                    "text-align": "center",
-                    "margin-bottom": "20px",},
-            ),
-            html.Div(
-                children="""
-            Early childhood education (ECE) is a fundamental component of young 
-            children's educational and developmental paths in the United States 
-            and, of course, across the world. Nevertheless, despite its 
-            acknowledged significance, there are still large differences in ECE 
-            enrollment and accessibility, which have an impact on a wide range 
-            of communities across the country. In this regard, Illinois stands 
-            out due to having one of the highest rates of capacity utilization 
-            and accessibility for early childhood centers (ECCs). Still, the low 
-            enrollment rate of 45 percent for children between the ages of one 
-            and five in early childhood education (ECE) programmes indicates 
-            that the state has issues, highlighting a significant disparity, 
-            even in environments with relatively advanced infrastructures. 
-            To try to address this issue, the "Bridging the Gap: Enhancing Early
-            Childhood Education Access in Illinois" project will carry out a 
-            thorough research of the ways in which the proximity of ECE centers 
-            affects the attendance rates. This study offers a paradigm for 
-            comprehending and resolving such inequities across the country in 
-            addition to mapping the accessibility of ECE facilities in Illinois 
-            as of right now. Our goal is to provide stakeholders with the 
-            resources they need to plan strategic increases in ECE access so 
-            that every kid, regardless of zip code, race, or of other 
-            demographic characteristics, may take advantage of these vital 
-            learning opportunities.
-        """,
-                style={"font-size": "1.2em", "margin-bottom": "20px"},
-            ),
-            html.H2(
-                children="Early Childcare Center Deserts in The United States",
-                style={"text-align": "center", "margin-bottom": "10px"},
-            ),
-            dcc.Graph(
-                id="us-map", config={"displayModeBar": False}, 
-                figure=create_us_map()
-            ),
-            html.Div(
-                children="""
-            Childcare deserts are regions where the demand for licenced 
-            childcare spaces cannot be met by the available capacity. The idea 
-            that certain places are known as “deserts” is a serious problem that
-            affects families all around the country. The troubling aspect is 
-            that these areas are not just desolate patches of sand; rather, they 
-            are regions characterised by extreme lack of easily accessible ECC 
-            alternatives, impacting rural, low- to middle-class, and Hispanic 
-            populations. 
-        """,
-                style={"margin-top": "20px", "font-size": "1.2em"},
-            ),
-            html.H2(
-                children="Census Tract Map of the State of Illinois",
-                style={
-                    "text-align": "center",
-                    "margin-top": "40px",
-                    "margin-bottom": "10px",},
-            ),
-            dcc.Graph(
-                id="il-map", config={"displayModeBar": False}, 
-                figure=create_il_map()
-            ),
-            html.Div(
-                children="""
-            Census tracts are statistical subdivisions of a county, small and 
-            generally permanent, with the purpose of representing neighborhoods. 
-            They are essential to resource allocation and urban planning as they 
-            offer a standardized geographic unit for statistical data display. 
-            This map of Illinois provides a detailed visual representation of 
-            childcare facility distribution across the State's census tracts. 
-            It serves for better understanding and identifying the different 
-            census tracts considered in this study where, for example, childcare 
-            services are most needed and assessing the State's capacity to meet 
-            the demand at the County level. The map color codes each tract based 
-            on the minimum distance to an ECC, providing insights into 
-            accessibility and potential childcare deserts within this State. 
-        """,
-                style={"margin-top": "20px", "font-size": "1.2em"},
-            ),
-            html.H2(
-                "Demographic Dynamics", style={"text-align": "center", 
-                                               "margin-top": "40px"}),
-            dcc.Dropdown(
-                id="socioeconomic-factor-dropdown_1",
-                options=["Race", "Housing", "Education", "Income"],
-                value="Race Analysis",
-            ),
-            dcc.Graph(id="race-bar-graph"),
-            html.P(
-                children="""
-            In order to understand child care demands and barriers, it is 
-            important to examine different demographics especially in the 
-            context of ECE accessibility. The graph clarifies the makeup of the 
-            regions that child care facilities serve, highlighting inequalities 
-            in access. When taken as a whole, the socio-economic variables of 
-            race, education, housing, and poverty rates constitute more than 
-            just data; they are the lived reality of families in Illinois 
-            and their children, determining whether or not they have easy access 
-            to early childhood education resources.
+    # the page and its figures are built once. Only the tile map changes per
+    # page load (its tile URL depends on the address the browser reached),
+    # its figure is cached for each URL and version of the data
+    us_map = create_us_map()
+
+    def page(il_map):
+        return html.Div(
+            children=[
+                html.H1(
+                    children='''Bridging the Gap: Enhancing Early Childhood 
+                    Education Access in Illinois''',
+                    style={
+                        "font-size": "2.5em",
+                        "text-align": "center",
+                        "margin-bottom": "20px",},
+                ),
+                html.Div(
+                    children="""
+                Early childhood education (ECE) is a fundamental component of young 
+                children's educational and developmental paths in the United States 
+                and, of course, across the world. Nevertheless, despite its 
+                acknowledged significance, there are still large differences in ECE 
+                enrollment and accessibility, which have an impact on a wide range 
+                of communities across the country. In this regard, Illinois stands 
+                out due to having one of the highest rates of capacity utilization 
+                and accessibility for early childhood centers (ECCs). Still, the low 
+                enrollment rate of 45 percent for children between the ages of one 
+                and five in early childhood education (ECE) programmes indicates 
+                that the state has issues, highlighting a significant disparity, 
+                even in environments with relatively advanced infrastructures. 
+                To try to address this issue, the "Bridging the Gap: Enhancing Early
+                Childhood Education Access in Illinois" project will carry out a 
+                thorough research of the ways in which the proximity of ECE centers 
+                affects the attendance rates. This study offers a paradigm for 
+                comprehending and resolving such inequities across the country in 
+                addition to mapping the accessibility of ECE facilities in Illinois 
+                as of right now. Our goal is to provide stakeholders with the 
+                resources they need to plan strategic increases in ECE access so 
+                that every kid, regardless of zip code, race, or of other 
+                demographic characteristics, may take advantage of these vital 
+                learning opportunities.
             """,
-                style={"margin-top": "20px", "font-size": "1.2em"},
-            ),
-            html.H2(
-                "Early Education Accessibility",
-                style={"text-align": "center", "margin-top": "40px"},
-            ),
-            dcc.Dropdown(
-                id="socioeconomic-factor-dropdown",
-                options=[
-                    {"label": "Race", "value": "race_category"},
-                    {"label": "Housing", "value": "housing_category"},
-                    {"label": "Education", "value": "education_category"},],
-                value="race_category",
-            ),
-            html.Br(),
-            dcc.Dropdown(
-                id="socioeconomic-factor-y-dropdown",
-                options=[
-                    {"label": "Average Distance in Time to Closest 3 ECCs", 
-                     "value": "distance_mean_imp"},
-                    {"label": "Average Haversine Distance to Closest 3 ECCs", 
-                     "value": "hdistance_mean"},
-                    {"label": "Minimum Distance in Time to Closest ECC", 
-                     "value": "distance_min_imp"},
-                    {"label": "Minimum Haversine Distance to Closest ECC", 
-                     "value": "hdistance_min"},
-                ],
-                value="distance_mean_imp",
-            ),
-            dcc.Graph(id="correlation-graph"),
-            html.P(
-                children="""
-            The graphs present a visual narrative on the disparities in early 
-            childhood education accessibility among different socioeconomic 
-            groups in Illinois. It is evident that communities with lower 
-            educational attainment and homeownership rates face greater 
-            challenges in accessing nearby childcare facilities, with 
-            significantly higher average travel times to the closest ECCs. 
-            Racial demographics also reveal disparities;  particularly those 
-            that are majority Black or Hispanic, experience greater distances to 
-            these essential services compared to majority White or Asian areas. 
-            These insights are relevant and congruent with our understanding 
-            that indeed ECE accessibility in Illinois is influenced by a complex 
-            interplay of a variety of socioeconomic factors.
+                    style={"font-size": "1.2em", "margin-bottom": "20px"},
+                ),
+                html.H2(
+                    children="Early Childcare Center Deserts in The United States",
+                    style={"text-align": "center", "margin-bottom": "10px"},
+                ),
+                dcc.Graph(
+                    id="us-map", config={"displayModeBar": False}, 
+                    figure=us_map
+                ),
+                html.Div(
+                    children="""
+                Childcare deserts are regions where the demand for licenced 
+                childcare spaces cannot be met by the available capacity. The idea 
+                that certain places are known as “deserts” is a serious problem that
+                affects families all around the country. The troubling aspect is 
+                that these areas are not just desolate patches of sand; rather, they 
+                are regions characterised by extreme lack of easily accessible ECC 
+                alternatives, impacting rural, low- to middle-class, and Hispanic 
+                populations. 
+            """,
+                    style={"margin-top": "20px", "font-size": "1.2em"},
+                ),
+                html.H2(
+                    children="Census Tract Map of the State of Illinois",
+                    style={
+                        "text-align": "center",
+                        "margin-top": "40px",
+                        "margin-bottom": "10px",},
+                ),
+                dcc.Graph(
+                    id="il-map", config={"displayModeBar": False}, 
+                    figure=il_map
+                ),
+                dcc.Store(id="il-map-level", data="state"),
+                dcc.Store(id="simulated-tracts", data=[]),
+                html.Div(
+                    children="""
+                Census tracts are statistical subdivisions of a county, small and 
+                generally permanent, with the purpose of representing neighborhoods. 
+                They are essential to resource allocation and urban planning as they 
+                offer a standardized geographic unit for statistical data display. 
+                This map of Illinois provides a detailed visual representation of 
+                childcare facility distribution across the State's census tracts. 
+                It serves for better understanding and identifying the different 
+                census tracts considered in this study where, for example, childcare 
+                services are most needed and assessing the State's capacity to meet 
+                the demand at the County level. The map color codes each tract based 
+                on the minimum distance to an ECC, providing insights into 
+                accessibility and potential childcare deserts within this State. 
             """,
-                style={"margin-top": "20px", "font-size": "1.2em"},
-            ),
-            html.H2("Model Simulation", style={"text-align": "center", 
-                                               "margin-top": "40px"}),
-            html.P(children="""
-            The proposed simulation model will enable us to forecast the effects 
-            of introducing more ECCs, particularly in underserved areas. By 
-            integrating this model, we can dynamically update our database, 
-            refining the accuracy of our accessibility metrics across different 
-            census tracts. Ultimately, the goal of our research is to shed light 
-            on the ways in which more inclusive child care infrastructures may 
-            be positioned, creating settings in which every family has a better
-            chance to prosper. It is now up to you to experiment and learn more 
-            about this through our platform!  
-            """),
-            html.Br(),
-            html.Label("Number of Child Centers"),
-            dcc.Input(id="centers_input", type="number", value=1),
-            html.Br(),
-            html.Label("Do you want to optimize?"),
-            dcc.Dropdown(
-                id="optimized_dropdown",
-                options=[
-                    {"label": "Yes", "value": "Yes"},
-                    {"label": "No", "value": "No"}
-                ],
-                value="True",
-            ),
-            html.Button('Run Simulation', id='run-simulation-button'),
-            html.Div(id="model_output"),])
+                    style={"margin-top": "20px", "font-size": "1.2em"},
+                ),
+                html.H2(
+                    "Demographic Dynamics", style={"text-align": "center", 
+                                                   "margin-top": "40px"}),
+                dcc.Dropdown(
+                    id="socioeconomic-factor-dropdown_1",
+                    options=["Race", "Housing", "Education", "Income"],
+                    value="Race Analysis",
+                ),
+                dcc.Graph(id="race-bar-graph"),
+                html.P(
+                    children="""
+                In order to understand child care demands and barriers, it is 
+                important to examine different demographics especially in the 
+                context of ECE accessibility. The graph clarifies the makeup of the 
+                regions that child care facilities serve, highlighting inequalities 
+                in access. When taken as a whole, the socio-economic variables of 
+                race, education, housing, and poverty rates constitute more than 
+                just data; they are the lived reality of families in Illinois 
+                and their children, determining whether or not they have easy access 
+                to early childhood education resources.
+                """,
+                    style={"margin-top": "20px", "font-size": "1.2em"},
+                ),
+                html.H2(
+                    "Early Education Accessibility",
+                    style={"text-align": "center", "margin-top": "40px"},
+                ),
+                dcc.Dropdown(
+                    id="socioeconomic-factor-dropdown",
+                    options=[
+                        {"label": "Race", "value": "race_category"},
+                        {"label": "Housing", "value": "housing_category"},
+                        {"label": "Education", "value": "education_category"},],
+                    value="race_category",
+                ),
+                html.Br(),
+                dcc.Dropdown(
+                    id="socioeconomic-factor-y-dropdown",
+                    options=[
+                        {"label": "Average Distance in Time to Closest 3 ECCs", 
+                         "value": "distance_mean_imp"},
+                        {"label": "Average Haversine Distance to Closest 3 ECCs", 
+                         "value": "hdistance_mean"},
+                        {"label": "Minimum Distance in Time to Closest ECC", 
+                         "value": "distance_min_imp"},
+                        {"label": "Minimum Haversine Distance to Closest ECC", 
+                         "value": "hdistance_min"},
+                    ],
+                    value="distance_mean_imp",
+                ),
+                dcc.Graph(id="correlation-graph"),
+                html.P(
+                    children="""
+                The graphs present a visual narrative on the disparities in early 
+                childhood education accessibility among different socioeconomic 
+                groups in Illinois. It is evident that communities with lower 
+                educational attainment and homeownership rates face greater 
+                challenges in accessing nearby childcare facilities, with 
+                significantly higher average travel times to the closest ECCs. 
+                Racial demographics also reveal disparities;  particularly those 
+                that are majority Black or Hispanic, experience greater distances to 
+                these essential services compared to majority White or Asian areas. 
+                These insights are relevant and congruent with our understanding 
+                that indeed ECE accessibility in Illinois is influenced by a complex 
+                interplay of a variety of socioeconomic factors.
+                """,
+                    style={"margin-top": "20px", "font-size": "1.2em"},
+                ),
+                html.H2("Model Simulation", style={"text-align": "center", 
+                                                   "margin-top": "40px"}),
+                html.P(children="""
+                The proposed simulation model will enable us to forecast the effects 
+                of introducing more ECCs, particularly in underserved areas. By 
+                integrating this model, we can dynamically update our database, 
+                refining the accuracy of our accessibility metrics across different 
+                census tracts. Ultimately, the goal of our research is to shed light 
+                on the ways in which more inclusive child care infrastructures may 
+                be positioned, creating settings in which every family has a better
+                chance to prosper. It is now up to you to experiment and learn more 
+                about this through our platform!  
+                """),
+                html.Br(),
+                html.Label("Number of Child Centers"),
+                dcc.Input(id="centers_input", type="number", value=1),
+                html.Br(),
+                html.Label("Do you want to optimize?"),
+                dcc.Dropdown(
+                    id="optimized_dropdown",
+                    options=[
+                        {"label": "Yes", "value": "Yes"},
+                        {"label": "Yes, anywhere (not only at tract centroids)",
+                         "value": "Anywhere"},
+                        {"label": "No", "value": "No"}
+                    ],
+                    value="True",
+                ),
+                html.Button('Run Simulation', id='run-simulation-button'),
+                html.Div(id="model_output"),])
+
+    if vector_tiles:
+        static_page = page(None)
+        il_map_row = next(i for i, child in enumerate(static_page.children)
+                          if getattr(child, "id", None) == "il-map")
+
+        def layout():
+            il_map = copy.copy(static_page.children[il_map_row])
+            il_map.figure = cached_figure(create_tile_map, data_version(), tile_url())
+            children = list(static_page.children)
+            children[il_map_row] = il_map
+            return html.Div(children=children)
+
+        app.layout = layout
+    else:
+        app.layout = page(create_il_map())
+
+
+    @app.server.route("/metrics")
+    def metrics_endpoint():
+        """
+        Metrics of the server (all its worker processes) in the Prometheus
+        text format.
+        """
+        return flask.Response(metrics.render(),
+            mimetype="text/plain; version=0.0.4")
+
+
+    @app.server.route("/healthz")
+    def healthz():
+        """
+        Liveness check: the server answers requests.
+        """
+        return "ok"
+
+
+    @app.server.route("/readyz")
+    def readyz():
+        """
+        Readiness check: the data is loaded and the server can answer the
+        dashboard requests.
+        """
+        if not is_ready():
+            return "loading", 503
+        return "ready"
+
+
+    @app.server.route("/tiles/<int:z>/<int:x>/<int:y>.pbf")
+    def vector_tile(z, x, y):
+        """
+        Serves the Mapbox Vector Tile z/x/y of the census tracts.
+        """
+        from analysis import tiles
+
+        if z > tiles.MAX_ZOOM or not (0 <= x < 2**z and 0 <= y < 2**z):
+            flask.abort(404)
+        response = flask.Response(tile_source().tile(z, x, y),
+            mimetype="application/vnd.mapbox-vector-tile")
+        response.headers["Cache-Control"] = "public, max-age=86400"
+        return response
+
+
+    @app.server.route("/nearest", methods=["GET", "POST"])
+    @metrics.timed(metrics.FUNCTION_SECONDS, name="app.nearest")
+    def nearest():
+        """
+        k nearest childcare centers of one point or a batch of points, with
+        the containing census tract and estimated travel times (json).
+        """
+        try:
+            lat, lon, k = parse_nearest_request(flask.request)
+        except ValueError as error:
+            return flask.jsonify({"error": str(error)}), 400
+        return flask.jsonify({"results": center_index().lookup(lat, lon, k)})
+
+
+    # Callback for changing the detail of the Illinois map with the zoom
+    @app.callback([Output("il-map", "figure"), Output("il-map-level", "data")],
+        [Input("il-map", "relayoutData")],
+        [State("il-map-level", "data")],
+        prevent_initial_call=True)
+
+    @metrics.timed(metrics.CALLBACK_SECONDS)
+    def update_il_map_detail(relayout_data, current_level):
+        """
+        Replaces the tract polygons of the Illinois map with the simplified
+        version for the new zoom level, only when the level changes.
+        """
+        scale = (relayout_data or {}).get("geo.projection.scale")
+        if scale is None or map_detail_level(scale) == current_level:
+            return dash.no_update, dash.no_update
+
+        level = map_detail_level(scale)
+        patched_figure = Patch()
+        patched_figure["data"][0]["geojson"] = map_geojson(level)
+        return patched_figure, level
 
 
     # Callback for updating the Demographic Dynamics graph
     @app.callback(Output("race-bar-graph", "figure"),
         [Input("socioeconomic-factor-dropdown_1", "value")])
     
+    @metrics.timed(metrics.CALLBACK_SECONDS)
     def update_race_bar_graph(value):
         """
         Updates and returns the race bar graph figure based on the selected 
         analysis category. 
         """
-        default_analysis = ["majority_white", "majority_black",
-                "majority_hispanic", "majority_asian",]
-        default_labels = ["Majority White", "Majority Black",
-                "Majority Hispanic", "Majority Asian",]
-        
-        # Determines analysis category and data based on user selection
-        if value == "Race Analysis":
-            current_analysis = default_analysis
-            current_analysis_labels = default_labels
-        elif value == "Housing":
-            current_analysis = ["homeowner_rate", "mobility_rate"]
-            current_analysis_labels = ["Homeowner Rate", "Mobility Rate"]
-        elif value == "Education":
-            current_analysis = ["less_than_hs_rate", "higher_education_rate"]
-            current_analysis_labels = ["Less Than High School Rate",
-                "Higher Education Rate"]
-        elif value == "Income":
-            current_analysis = ["below_poverty_rate"]
-            current_analysis_labels = ["Below Poverty Rate"]
-        else:
-            value = "Race Analysis"
-            current_analysis = default_analysis
-            current_analysis_labels = default_labels
-
-        if value != "Race Analysis":
-            race_percentages = df_final.groupby("race_category")[current_analysis].mean().reset_index()
-            long_race = pd.melt(race_percentages, id_vars=['race_category'], value_vars=current_analysis)
-            custom_labels = [f"Mean {current_analysis_labels[current_analysis.index(row['variable'])]} for {row['race_category']} Tracts" \
-                             for _, row in long_race.iterrows()]
-            y_val = 100*long_race["value"]
-            text_val = [f"{val:.2f}%" for val in 100*long_race["value"].astype(float)]
-        else:
-            majority_counts = df_final[current_analysis].sum()
-            total_tracts = len(df_final)
-            race_percentages = (majority_counts / total_tracts) * 100
-            custom_labels = current_analysis_labels
-            y_val = race_percentages
-            text_val = [f"{val:.2f}%" for val in race_percentages.values]
-            
-        # Define a color palette with 8 colors
-        palette = plt.cm.get_cmap('Blues', 8)
-        # Convert RGB colors to hexadecimal format
-        hex_colors = [mcolors.to_hex(color) for color in palette(range(8))]
-        
-        race_bar_graph_figure = go.Figure(
-            [
-                go.Bar(
-                    x = custom_labels,
-                    y=y_val,
-                    text = text_val,
-                    textposition="auto",
-                    marker_color=hex_colors,
-                )
-            ]
-        )
-
-        race_bar_graph_figure.update_layout(
-            title_text="Demographic Analysis Across Census Tracts",
-            xaxis_title="Demographic Factor",
-            yaxis_title="Percentage",
-            yaxis=dict(ticksuffix="%"),
-        )
-
-        return race_bar_graph_figure
+        return cached_figure(race_bar_figure, data_version(), value)
 
 
     # Callback for updating the Early Education Accessibility graph
@@ -419,34 +1082,28 @@ def early_education_dash():
         [Input("socioeconomic-factor-dropdown", "value"),
         Input("socioeconomic-factor-y-dropdown", "value")])
     
+    @metrics.timed(metrics.CALLBACK_SECONDS)
     def update_graph(selected_factor, y_col):
         """
         Updates and returns the correlation graph figure based on selected 
         socioeconomic factors and the chosen measurement for distance to ECCs.
         """
-        fig = px.box(
-            df_final,
-            x=selected_factor,
-            y=y_col,
-            labels={"distance_mean_imp": "Distance to Closest ECCs"},
-            notched=True)   # Visual indication of median's confidence interval
-
-        fig.update_traces(marker_color="#1f77b4")
-        fig.update_layout(
-            title="""Average Distance to Nearest Childcare Centers Among Different Socioeconomic Groups""",
-            yaxis_title="Distance to Closest ECCs",
-            xaxis_title=selected_factor.replace("_", " ").title(),
-            boxmode="group")
-
-        return fig
+        return cached_figure(accessibility_box_figure, data_version(),
+            selected_factor, y_col)
 
 
     # Callback for updating Model Simulation
-    @app.callback(Output("model_output", "children"),
+    @app.callback([Output("model_output", "children"),
+        Output("il-map", "figure", allow_duplicate=True),
+        Output("simulated-tracts", "data")],
         [Input("run-simulation-button", "n_clicks")],
-        [State("centers_input", "value"), State("optimized_dropdown", "value")])
+        [State("centers_input", "value"), State("optimized_dropdown", "value"),
+        State("simulated-tracts", "data")],
+        prevent_initial_call=True)
 
-    def update_model_output(n_clicks, centers_input, optimized_dropdown):
+    @metrics.timed(metrics.CALLBACK_SECONDS)
+    def update_model_output(n_clicks, centers_input, optimized_dropdown,
+                            simulated_tracts):
         '''
         Updates the model output text based on simulation button clicks,
         number of child centers, and optimization choice. Invokes the simulation 
@@ -458,18 +1115,31 @@ def early_education_dash():
             n_clicks (int): Number of times simulation button has been clicked.
             centers_input (int): Number of ECC to consider in simulation.
             optimized_dropdown (str): User's choice on whether to optimize.
+            simulated_tracts (lst): Map rows changed by the previous simulation.
             
         Returns:
             dash.html.Div: A Dash HTML Div element containing the simulation 
                 textual output. 
+            Patch: Partial update of the census tract map with the new ECCs
+                and distances (see simulation_map_patch).
+            lst: Map rows changed by this simulation.
         '''
         if n_clicks is None or centers_input is None:
-            return ""
+            return "", dash.no_update, dash.no_update
         
         # Convert dropdown selection to boolean for optimization parameter
-        optimized = True if optimized_dropdown == 'Yes' else False
+        optimized = optimized_dropdown in ('Yes', 'Anywhere')
+        placement = 'grid' if optimized_dropdown == 'Anywhere' else 'centroid'
 
         # In order for simulation to work, change with own API_KEY
+        metrics.SIMULATIONS_IN_FLIGHT.inc()
+        try:
+            data = dashboard_data()
+            results = create_several_child_centers("API_KEY", centers_input,
+                optimized, df=data["df_final"].copy(), return_details=True,
+                placement=placement, speed_bounds=data["speed_bounds"])
+        finally:
+            metrics.SIMULATIONS_IN_FLIGHT.dec()
         (
             ranking_lst,
             single_impact_km,
@@ -477,7 +1147,11 @@ def early_education_dash():
             total_benefited_ct,
             total_impact_km,
             total_impact_min,
-        ) = create_several_child_centers("API_KEY", centers_input, optimized)
+            simulated_df,
+            new_centers,
+        ) = results
+        map_patch, changed_rows = simulation_map_patch(simulated_df,
+            new_centers, simulated_tracts, vector_tiles)
         output = html.Div(
             [
                 html.Div(
@@ -510,7 +1184,7 @@ def early_education_dash():
                 ),
             ]
         )
-        return output
+        return output, map_patch, changed_rows
     return app
 
 
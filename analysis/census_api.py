@@ -2,6 +2,7 @@
 
 import requests
 import pandas as pd
+from analysis import profiling
 
 """
 Census Variables
@@ -76,9 +77,12 @@ def retreive_key():
         KEY = file.readline().strip()
     return KEY
 
-def retreive_census_data(variables=VARIABLES, col_names=COL_NAMES, test=""):
+def retreive_census_data(variables=VARIABLES, col_names=COL_NAMES, test="", state="17"):
     """
     Retreive data from Census API
+
+    Inputs:
+        state (str): FIPS code of the state (Illinois by default)
     
     Returns:
         Save raw data to data/Census_data_raw.csv
@@ -88,7 +92,6 @@ def retreive_census_data(variables=VARIABLES, col_names=COL_NAMES, test=""):
     year = "2022"
 
     geography = 'TRACT:*'
-    state = '17'  # Illinois state code
     
     api_key = retreive_key()
     
@@ -96,6 +99,7 @@ def retreive_census_data(variables=VARIABLES, col_names=COL_NAMES, test=""):
     url = f'{host}/{year}/{dataset}?get={variables}&for={geography}&in=state:{state}&key={api_key}'
 
     response = requests.get(url)
+    profiling.add(api_calls=1)
     data = response.json()
     
     # save to raw .csv
@@ -2,6 +2,7 @@
 
 import requests
 import pandas as pd
+from analysis.paths import data_path
 
 def clean_census_data(test=""):
     """
@@ -11,7 +12,7 @@ def clean_census_data(test=""):
         Save data to data/Census_data.csv
     """
     # retreive raw data
-    census_raw_file = "data/Census_data_raw.csv"
+    census_raw_file = data_path(test, "Census_data_raw.csv")
     raw_census = pd.read_csv(census_raw_file, dtype=str)
     raw_census[['Tract_name', 'County_name', 'State_name']] = raw_census["DETAILS"].str.split(';', expand=True)
     raw_census.head()
@@ -1,19 +1,38 @@
 import pandas as pd
+from analysis.paths import data_path
 
 
-def clean_child_centers(test=""):
+def clean_child_centers(test="", state="17", output="Child_Care_Centers_clean2.csv",
+                        halo=False):
     """
     Load the data from "data/Child_Care_Centers.csv", eliminate the columns
     that will not be used in the analysis, and save a clean pandas dataframe in
     "data/Child_Care_Centers_clean.csv".
 
+    Inputs:
+        state (str): FIPS code of the state (Illinois by default)
+        output (str): name of the clean file in the data folder
+        halo (bool): also keep the centers of other states close to the census
+            tracts of the state (see analysis/states.py)
+
     Return: None
     """
+    from analysis.states import STATES
+
     # import child center dataframe
-    child_centers_df = pd.read_csv("data/Child_Care_Centers.csv")
+    child_centers_df = pd.read_csv(data_path(test, "Child_Care_Centers.csv"))
+
+    # keep only the data for the state (and the halo)
+    keep = child_centers_df["STATE"] == STATES[state]
+    if halo:
+        import geopandas as gpd
+        from analysis.spatial_join import prepare_tracts
+        from analysis.states import halo_mask, tract_folder
 
-    # keep only the data for Illinois
-    child_centers_df = child_centers_df[child_centers_df["STATE"] == "IL"]
+        tracts = prepare_tracts(gpd.read_file(
+            data_path(test, f"{tract_folder(state)}/{tract_folder(state)}.shp")))
+        keep |= halo_mask(child_centers_df, tracts)
+    child_centers_df = child_centers_df[keep]
 
     # keep only the useful columns for the project
     child_centers_df = child_centers_df[
@@ -37,4 +56,4 @@ def clean_child_centers(test=""):
     child_centers_df.columns = [x.lower() for x in child_centers_df.columns]
 
     # save the clean dataframe
-    child_centers_df.to_csv(test + "data/Child_Care_Centers_clean2.csv", index=False)
+    child_centers_df.to_csv(test + "data/" + output, index=False)
@@ -0,0 +1,256 @@
+import numpy as np
+import pandas as pd
+from analysis.hav_distance import haversine_distance
+from analysis.paths import data_path
+from analysis.travel_estimate import DETOUR_FACTOR, ROAD_SPEED_KMH
+
+# NOTE: "What if these centers close" scenarios without new distance requests.
+# Each census tract keeps its k closest centers (the pairs of the pipeline,
+# k = 3) as rows of small arrays sorted by travel time, and an inverted index
+# lists the tracts that have each center among their k closest. Closing centers
+# only touches the tracts in their index entries: the new closest center is the
+# first one of the row that is still open, so a scenario costs O(k) per
+# affected tract. Tracts that lose all their k centers fall back to a
+# vectorized haversine search over the open centers, with estimated travel
+# times (travel_estimate). Impacts are sums over tracts, as in optimization.py,
+# but positive values are longer distances.
+
+# minutes per haversine km of the estimated travel times
+MINUTES_PER_KM = DETOUR_FACTOR / ROAD_SPEED_KMH * 60
+FALLBACK_CHUNK = 2_000
+
+
+class NearestCenters:
+    """
+    k closest centers of each census tract and the inverted index from
+    centers to tracts.
+
+    Attributes:
+        geoids (array): GEOID of each tract (row)
+        centroid_lat, centroid_lon (array): centroid of each tract
+        center_ids (array (n, k)): objectid of the k closest centers of each
+            tract sorted by travel time, -1 where a tract has less than k
+        minutes, hdistance (array (n, k)): travel time (imputed minutes) and
+            haversine distance (km) of those centers, inf where missing
+        index_ids (array): sorted objectids of the inverted index
+        index_starts (array): for index_ids[i], its tracts are
+            index_tracts[index_starts[i]:index_starts[i + 1]]
+        index_tracts (array): rows of the tracts
+        all_ids, all_lat, all_lon (array): every center, for the fallback
+            search
+    """
+
+    def __init__(self, pairs, centers):
+        pairs = pairs.assign(distance_minutes_imp=pd.to_numeric(
+            pairs["distance_minutes_imp"], errors="coerce"))
+        # pairs without travel time are not used for the minimum either
+        # (see distance_cleaning.aggregate_pairs)
+        pairs = pairs[pairs["distance_minutes_imp"].notna()]
+        pairs = pairs.sort_values(["GEOID", "distance_minutes_imp"], kind="stable")
+
+        tracts = pairs.groupby("GEOID", sort=True)[["centroid_lat", "centroid_lon"]].first()
+        self.geoids = tracts.index.to_numpy()
+        self.centroid_lat = tracts["centroid_lat"].to_numpy(dtype=float)
+        self.centroid_lon = tracts["centroid_lon"].to_numpy(dtype=float)
+
+        rows = np.searchsorted(self.geoids, pairs["GEOID"].to_numpy())
+        columns = pairs.groupby("GEOID", sort=False).cumcount().to_numpy()
+        k = int(columns.max()) + 1 if len(columns) else 1
+        shape = (len(self.geoids), k)
+        self.center_ids = np.full(shape, -1, dtype=np.int64)
+        self.minutes = np.full(shape, np.inf)
+        self.hdistance = np.full(shape, np.inf)
+        self.center_ids[rows, columns] = pairs["objectid"].to_numpy()
+        self.minutes[rows, columns] = pairs["distance_minutes_imp"].to_numpy()
+        self.hdistance[rows, columns] = pairs["hdistance"].to_numpy()
+
+        # inverted index (compressed rows): tracts of each center
+        flat_ids = self.center_ids.ravel()
+        valid = np.flatnonzero(flat_ids >= 0)
+        order = valid[np.argsort(flat_ids[valid], kind="stable")]
+        self.index_ids, starts = np.unique(flat_ids[order], return_index=True)
+        self.index_starts = np.append(starts, len(order))
+        self.index_tracts = order // k
+
+        self.all_ids = centers["objectid"].to_numpy()
+        self.all_lat = centers["latitude"].to_numpy(dtype=float)
+        self.all_lon = centers["longitude"].to_numpy(dtype=float)
+
+    def dependent_tracts(self, center_ids):
+        """
+        Returns (array): sorted rows of the tracts that have any of the centers
+            among their k closest
+        """
+        positions = np.searchsorted(self.index_ids, center_ids)
+        positions = positions[positions < len(self.index_ids)]
+        positions = positions[np.isin(self.index_ids[positions], center_ids)]
+        if len(positions) == 0:
+            return np.empty(0, dtype=np.int64)
+        slices = [self.index_tracts[self.index_starts[p]:self.index_starts[p + 1]]
+                  for p in positions]
+        return np.unique(np.concatenate(slices))
+
+    def nearest_open(self, rows, closed_ids):
+        """
+        Travel time and haversine distance to the closest open center of the
+        tracts in rows.
+
+        Inputs:
+            rows (array): rows of the tracts
+            closed_ids (array): objectids of the closed centers
+
+        Returns (tuple): minutes (array), hdistance (array) and number of
+            tracts that needed the fallback search (int)
+        """
+        closed = np.isin(self.center_ids[rows], closed_ids) | (self.center_ids[rows] < 0)
+        first_open = np.argmax(~closed, axis=1)
+        minutes = self.minutes[rows, first_open]
+        hdistance = np.where(closed, np.inf, self.hdistance[rows]).min(axis=1)
+
+        exhausted = np.flatnonzero(closed.all(axis=1))
+        if len(exhausted):
+            fallback = self.search_open(rows[exhausted], closed_ids)
+            hdistance[exhausted] = fallback
+            minutes[exhausted] = fallback * MINUTES_PER_KM
+        return minutes, hdistance, len(exhausted)
+
+    def search_open(self, rows, closed_ids):
+        """
+        Fallback for tracts that lost their k closest centers: haversine
+        distance to the closest open center, over all the centers (in chunks
+        of tracts to bound memory).
+
+        Returns (array): distance in km (inf if no center is open)
+        """
+        open_centers = ~np.isin(self.all_ids, closed_ids)
+        lat, lon = self.all_lat[open_centers], self.all_lon[open_centers]
+        distance = np.full(len(rows), np.inf)
+        if len(lat) == 0:
+            return distance
+        for start in range(0, len(rows), FALLBACK_CHUNK):
+            chunk = rows[start:start + FALLBACK_CHUNK]
+            distance[start:start + FALLBACK_CHUNK] = haversine_distance(
+                self.centroid_lat[chunk][:, None], self.centroid_lon[chunk][:, None],
+                lat[None, :], lon[None, :],
+            ).min(axis=1)
+        return distance
+
+
+def load_nearest_centers(test=""):
+    """
+    Builds the NearestCenters of the saved pairs (census_ccc_joined_backup.csv,
+    imputed as in the distance_clean stage) and centers.
+
+    Returns (NearestCenters): the structure
+    """
+    from analysis.distance_cleaning import clean_pairs
+
+    pairs = clean_pairs(pd.read_csv(data_path(test, "census_ccc_joined_backup.csv")))
+    centers = pd.read_csv(data_path(test, "Child_Care_Centers_clean.csv"))
+    return NearestCenters(pairs, centers)
+
+
+def load_closure_scenarios(file_path):
+    """
+    Reads closure scenarios from a text file: one scenario per line with the
+    objectids of its closed centers separated by commas or spaces. Empty lines
+    and lines starting with # are skipped.
+
+    Returns (lst): lists of objectids (int), one per scenario
+    """
+    scenarios = []
+    with open(file_path, "r") as file:
+        for number, line in enumerate(file, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                scenarios.append([int(i) for i in line.replace(",", " ").split()])
+            except ValueError:
+                raise ValueError(f"Line {number} of {file_path} is not a list of center ids: {line}") from None
+    return scenarios
+
+
+def score_closure(nearest, closed_ids):
+    """
+    Impact of closing a group of centers.
+
+    Inputs:
+        nearest (NearestCenters): the structure
+        closed_ids (lst): objectids of the closed centers
+
+    Returns (tuple): a tuple with 4 variables:
+        affected_ct (array): GEOIDs of the census tracts whose closest center
+            changes
+        impact_km (float): increase in haversine km to the closest center,
+            summed over tracts
+        impact_min (float): increase in minutes to the closest center, summed
+            over tracts
+        fallback_ct (int): census tracts that lost their k closest centers
+            (their new distances are estimated)
+    """
+    closed_ids = np.asarray(closed_ids, dtype=np.int64)
+    rows = nearest.dependent_tracts(closed_ids)
+    minutes, hdistance, fallback_ct = nearest.nearest_open(rows, closed_ids)
+    delta_min = minutes - nearest.minutes[rows, 0]
+    delta_km = hdistance - nearest.hdistance[rows].min(axis=1)
+    changed = (delta_min != 0) | (delta_km != 0)
+    return (nearest.geoids[rows[changed]], float(delta_km.sum()),
+            float(delta_min.sum()), fallback_ct)
+
+
+def score_relocation(nearest, moves):
+    """
+    Impact of moving centers: each one closes and opens again at a new
+    location, with estimated travel times from its new location.
+
+    Inputs:
+        nearest (NearestCenters): the structure
+        moves (dict): {objectid: (latitude, longitude)} of the moved centers
+
+    Returns (tuple): same as score_closure (impacts can be negative)
+    """
+    closed_ids = np.fromiter(moves, dtype=np.int64, count=len(moves))
+    new_lat = np.array([location[0] for location in moves.values()], dtype=float)
+    new_lon = np.array([location[1] for location in moves.values()], dtype=float)
+
+    minutes = nearest.minutes[:, 0].copy()
+    hdistance = nearest.hdistance.min(axis=1)
+    rows = nearest.dependent_tracts(closed_ids)
+    minutes[rows], hdistance[rows], fallback_ct = nearest.nearest_open(rows, closed_ids)
+
+    # every tract can get closer to a moved center
+    moved_km = haversine_distance(
+        nearest.centroid_lat[:, None], nearest.centroid_lon[:, None],
+        new_lat[None, :], new_lon[None, :],
+    ).min(axis=1)
+    minutes = np.minimum(minutes, moved_km * MINUTES_PER_KM)
+    hdistance = np.minimum(hdistance, moved_km)
+
+    delta_min = minutes - nearest.minutes[:, 0]
+    delta_km = hdistance - nearest.hdistance.min(axis=1)
+    changed = (delta_min != 0) | (delta_km != 0)
+    return (nearest.geoids[changed], float(delta_km[changed].sum()),
+            float(delta_min[changed].sum()), fallback_ct)
+
+
+def run_closure_scenarios(nearest, scenarios):
+    """
+    Scores many closure scenarios.
+
+    Inputs:
+        nearest (NearestCenters): the structure
+        scenarios (lst): lists of objectids closed in each scenario
+
+    Returns (pandas df): one row per scenario with the number of closed
+        centers, affected census tracts, impact_km, impact_min and fallback
+        census tracts
+    """
+    results = []
+    for closed_ids in scenarios:
+        affected_ct, impact_km, impact_min, fallback_ct = score_closure(
+            nearest, closed_ids)
+        results.append((len(closed_ids), len(affected_ct), impact_km,
+                        impact_min, fallback_ct))
+    return pd.DataFrame(results, columns=["closed", "affected_ct", "impact_km",
+                                          "impact_min", "fallback_ct"])
@@ -0,0 +1,129 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+SCHEMA_FILE = "_schema.json"
+
+
+def write_columns(df, path):
+    """
+    Saves a pandas dataframe as a columnar dataset: a folder with one .npy file
+    per column and a small json schema. Numeric columns are saved as they are
+    (so they can be memory-mapped when read), text and categorical columns are
+    saved as integer codes plus their labels in the schema.
+
+    Inputs:
+        df (pandas df): dataframe to save
+        path (str): folder where the dataset will be saved
+    """
+    os.makedirs(path, exist_ok=True)
+    schema = {"n_rows": len(df), "columns": []}
+
+    for i, col in enumerate(df.columns):
+        file_name = f"col_{i:03d}.npy"
+        column = {"name": str(col), "file": file_name}
+        values = df[col]
+
+        if values.dtype == object:
+            values = values.astype("category")
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # store labels in the schema and codes (-1 is missing) in the file
+            column["kind"] = "category"
+            column["labels"] = values.cat.categories.tolist()
+            column["ordered"] = bool(values.cat.ordered)
+            np.save(os.path.join(path, file_name), values.cat.codes.to_numpy())
+        else:
+            column["kind"] = "numeric"
+            np.save(os.path.join(path, file_name), values.to_numpy())
+
+        schema["columns"].append(column)
+
+    with open(os.path.join(path, SCHEMA_FILE), "w") as file:
+        json.dump(schema, file)
+
+
+def read_columns(path, columns=None, mmap=False):
+    """
+    Loads a columnar dataset saved with write_columns (or a ColumnWriter, in
+    which case all the parts are concatenated).
+
+    Inputs:
+        path (str): folder of the dataset
+        columns (lst): optional list of columns to load (default: all)
+        mmap (bool): if True, numeric columns are memory-mapped read-only
+            instead of being copied into memory
+
+    Returns (pandas df): the dataset
+    """
+    parts = list_parts(path)
+    if parts:
+        return pd.concat(
+            [read_columns(part, columns, mmap) for part in parts],
+            ignore_index=True,
+        )
+
+    with open(os.path.join(path, SCHEMA_FILE), "r") as file:
+        schema = json.load(file)
+
+    data = {}
+    for column in schema["columns"]:
+        if columns is not None and column["name"] not in columns:
+            continue
+        values = np.load(
+            os.path.join(path, column["file"]), mmap_mode="r" if mmap else None
+        )
+        if column["kind"] == "category":
+            values = pd.Categorical.from_codes(
+                values, categories=column["labels"], ordered=column["ordered"]
+            )
+        data[column["name"]] = values
+
+    return pd.DataFrame(data, copy=False)
+
+
+def list_parts(path):
+    """
+    Lists the part folders of a dataset written by a ColumnWriter, in order.
+    Returns an empty list for single-part datasets.
+    """
+    if not os.path.isdir(path):
+        raise FileNotFoundError(path)
+    return [
+        os.path.join(path, name)
+        for name in sorted(os.listdir(path))
+        if name.startswith("part-")
+    ]
+
+
+def iter_parts(path, columns=None):
+    """
+    Generator that yields the parts of a dataset one at a time as pandas
+    dataframes, so a large dataset can be processed with bounded memory.
+    """
+    parts = list_parts(path) or [path]
+    for part in parts:
+        yield read_columns(part, columns)
+
+
+class ColumnWriter:
+    """
+    Writes a columnar dataset chunk by chunk. Each call to append saves the
+    chunk as a new part, so memory use only depends on the chunk size.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.n_parts = 0
+        self.n_rows = 0
+        os.makedirs(path, exist_ok=True)
+        # remove parts from previous runs
+        for part in list_parts(path):
+            for name in os.listdir(part):
+                os.remove(os.path.join(part, name))
+            os.rmdir(part)
+
+    def append(self, df):
+        write_columns(df, os.path.join(self.path, f"part-{self.n_parts:05d}"))
+        self.n_parts += 1
+        self.n_rows += len(df)
@@ -0,0 +1,241 @@
+import numpy as np
+import pandas as pd
+import shapely
+from analysis import pipeline, profiling
+from analysis.google_api_request import get_google_distances
+from analysis.hav_distance import haversine_distance
+from analysis.paths import data_path
+
+# NOTE: Incremental refresh of the census tract x childcare center pairs when
+# a new version of the childcare centers is published. Instead of joining all
+# the tracts again and asking the Google API for every pair, the old and new
+# centers are compared by objectid and coordinates, and only the tracts whose
+# three closest centers can change are recomputed: tracts that lose one of
+# their centers and tracts with a new center closer than their current third
+# closest one (found with an STRtree of the new centers). Travel times are only
+# requested for the pairs that did not exist before. The result is the same as
+# running spatial_join and distance_api again.
+
+# Same search radius as spatial_join.join_ccc_to_ct (45km buffer in degrees)
+BUFFER_DEGREES = 0.008983 * 45
+TRACT_COLUMNS = ["STATEFP", "COUNTYFP", "TRACTCE", "GEOID", "centroid_lat",
+                 "centroid_lon"]
+
+
+def diff_centers(old_centers, new_centers):
+    """
+    Compares two versions of the childcare centers. A center that moved is
+    treated as closed and opened again.
+
+    Inputs:
+        old_centers (pandas df): previous centers, with "objectid",
+            "latitude" and "longitude"
+        new_centers (pandas df): new centers, same columns
+
+    Returns (tuple): new centers that were added or moved (pandas df) and
+        objectids of the centers that were closed or moved (set)
+    """
+    keys = ["objectid", "latitude", "longitude"]
+    merged = old_centers[keys].merge(new_centers[keys], on=keys, how="outer",
+                                     indicator=True)
+    removed = set(merged.loc[merged["_merge"] == "left_only", "objectid"])
+    added_keys = merged.loc[merged["_merge"] == "right_only", keys]
+    added = new_centers.reset_index().merge(added_keys, on=keys).set_index("index")
+    added.index.name = None
+    return added, removed
+
+
+def affected_tracts(tracts, pairs, added, removed):
+    """
+    Finds the tracts whose three closest centers can change: the ones with a
+    removed center among them and the ones where an added center (within the
+    search radius) is closer than the third closest center, or that have less
+    than three centers.
+
+    Inputs:
+        tracts (pandas df): all the tracts, with "GEOID", "centroid_lat" and
+            "centroid_lon"
+        pairs (pandas df): current three closest centers of each tract, with
+            "GEOID", "objectid" and "hdistance"
+        added (pandas df): added centers (from diff_centers)
+        removed (set): objectids of the removed centers
+
+    Returns (set): GEOIDs of the affected tracts
+    """
+    affected = set(pairs.loc[pairs["objectid"].isin(removed), "GEOID"])
+    if added.empty:
+        return affected
+
+    # distance to the third closest center (infinite with less than three)
+    closest = pairs.groupby("GEOID")["hdistance"].agg(["max", "size"])
+    reach = closest["max"].where(closest["size"] >= 3, np.inf)
+    reach = tracts["GEOID"].map(reach).fillna(np.inf).to_numpy()
+
+    tree = shapely.STRtree(shapely.points(added["longitude"], added["latitude"]))
+    tract_rows, center_rows = tree.query(
+        shapely.points(tracts["centroid_lon"], tracts["centroid_lat"]),
+        predicate="dwithin", distance=BUFFER_DEGREES)
+    distance = haversine_distance(
+        tracts["centroid_lat"].to_numpy()[tract_rows],
+        tracts["centroid_lon"].to_numpy()[tract_rows],
+        added["latitude"].to_numpy()[center_rows],
+        added["longitude"].to_numpy()[center_rows],
+    )
+    closer = tract_rows[distance <= reach[tract_rows]]
+    return affected | set(tracts["GEOID"].to_numpy()[closer])
+
+
+def closest_centers(tracts, centers):
+    """
+    Three closest centers within the search radius of each tract, with the
+    same columns as spatial_join.join_ccc_to_ct.
+
+    Inputs:
+        tracts (GeoPandas): tracts (from spatial_join.prepare_tracts)
+        centers (GeoPandas): centers (from spatial_join.prepare_centers)
+
+    Returns (pandas df): pairs sorted by haversine distance, indexed by the
+        row of the center
+    """
+    tree = shapely.STRtree(centers.geometry.values)
+    tract_rows, center_rows = tree.query(
+        shapely.points(tracts["centroid_lon"], tracts["centroid_lat"]),
+        predicate="dwithin", distance=BUFFER_DEGREES)
+
+    pairs = centers.iloc[center_rows].copy()
+    for column in TRACT_COLUMNS:
+        pairs[column] = tracts[column].to_numpy()[tract_rows]
+    pairs.insert(pairs.columns.get_loc("STATEFP"), "index_right",
+                 tracts.index.to_numpy()[tract_rows])
+    pairs["hdistance"] = haversine_distance(
+        pairs["latitude"], pairs["longitude"],
+        pairs["centroid_lat"], pairs["centroid_lon"])
+
+    pairs = pairs.sort_values(by="hdistance")
+    return pairs.groupby("GEOID").head(3)
+
+
+@profiling.profiled
+def refresh_pairs(tracts, centers, intermediate, joined, added, removed,
+                  distance_function, user_api_key):
+    """
+    Patches the pairs of the affected tracts.
+
+    Inputs:
+        tracts (GeoPandas): all the tracts (from spatial_join.prepare_tracts)
+        centers (GeoPandas): new centers (from spatial_join.prepare_centers)
+        intermediate (pandas df): current intermediate_data_backup.csv
+        joined (pandas df): current census_ccc_joined_backup.csv
+        added (pandas df), removed (set): changes (from diff_centers)
+        distance_function (function): get_google_distances or a function with
+            the same inputs
+        user_api_key (str): key of google distance matrix API
+
+    Returns (tuple): patched intermediate and joined data (pandas df),
+        number of affected tracts (int) and number of travel times requested
+        (int)
+    """
+    # use the types of the saved data (e.g. GEOID read back as an integer)
+    tracts = tracts.copy()
+    for column in TRACT_COLUMNS[:4]:
+        tracts[column] = tracts[column].astype(intermediate[column].dtype)
+
+    affected = affected_tracts(tracts, intermediate, added, removed)
+    new_pairs = closest_centers(tracts[tracts["GEOID"].isin(affected)], centers)
+    new_pairs = pd.DataFrame(new_pairs[intermediate.columns])
+    new_pairs["geometry"] = shapely.to_wkt(new_pairs["geometry"].values,
+                                           rounding_precision=-1)
+
+    # pairs are indexed by the row of the center, which changes in the new file
+    center_rows = pd.Series(centers.index, index=centers["objectid"])
+    center_rows = center_rows[~center_rows.index.duplicated()]
+    kept = intermediate[~intermediate["GEOID"].isin(affected)].copy()
+    kept.index = kept["objectid"].map(center_rows).to_numpy()
+    patched_intermediate = pd.concat([kept, new_pairs]).sort_values(
+        by="hdistance", kind="stable")
+
+    # travel times of the pairs that already existed are reused (same tract,
+    # center and coordinates), the rest are requested
+    keys = ["GEOID", "objectid", "latitude", "longitude"]
+    new_joined = new_pairs.reset_index().rename(columns={"index": "Unnamed: 0"})
+    new_joined = new_joined.merge(
+        joined[keys + ["distance_km", "distance_minutes"]].drop_duplicates(keys),
+        on=keys, how="left", indicator=True)
+    to_request = new_joined["_merge"] == "left_only"
+    requested = new_joined[to_request].copy()
+    if len(requested):
+        distance_function(requested, "distance_km", "distance_minutes",
+                          "latitude", "longitude", user_api_key)
+        new_joined.loc[to_request, ["distance_km", "distance_minutes"]] = (
+            requested[["distance_km", "distance_minutes"]].to_numpy())
+
+    kept = joined[~joined["GEOID"].isin(affected)].copy()
+    kept["Unnamed: 0"] = kept["objectid"].map(center_rows)
+    patched_joined = pd.concat([kept, new_joined[joined.columns]]).sort_values(
+        by="hdistance", kind="stable").reset_index(drop=True)
+
+    profiling.add(rows_out=len(new_pairs))
+    return patched_intermediate, patched_joined, len(affected), int(to_request.sum())
+
+
+def refresh_centers(test, centers_path, distance_function=get_google_distances,
+                    user_api_key="API_KEY", state=None):
+    """
+    Updates the childcare centers to a new version, patching
+    intermediate_data_backup.csv and census_ccc_joined_backup.csv instead of
+    running the spatial_join and distance_api stages again. The two stages are
+    marked as up to date, so the next pipeline run only cleans the distances.
+
+    Inputs:
+        test (str): test folder prefix ("" or "test/", or the prefix of a
+            state shard, see states.shard_prefix)
+        centers_path (str): csv of the new centers, with the columns of
+            Child_Care_Centers_clean.csv
+        distance_function (function): get_google_distances or a function with
+            the same inputs (e.g. travel_estimate.get_estimated_distances)
+        user_api_key (str): key of google distance matrix API ("API_KEY" reads
+            it from Google_distance_API_key.txt)
+        state (str): FIPS code of the state of a shard (None is the Illinois
+            pipeline of the data folder)
+
+    Returns (dict): number of added and removed centers, affected tracts and
+        requested travel times
+    """
+    import geopandas as gpd
+    from analysis.distance_matrix_api import get_google_api
+    from analysis.spatial_join import prepare_centers, prepare_tracts
+    from analysis.states import tract_folder
+
+    folder = tract_folder(state or "17")
+
+    old_centers = pd.read_csv(data_path(test, "Child_Care_Centers_clean.csv"))
+    new_centers = pd.read_csv(centers_path)
+    intermediate = pd.read_csv(data_path(test, "intermediate_data_backup.csv"),
+                               index_col=0)
+    joined = pd.read_csv(data_path(test, "census_ccc_joined_backup.csv"),
+                         index_col=0)
+
+    added, removed = diff_centers(old_centers, new_centers)
+    summary = {"added": len(added), "removed": len(removed)}
+    print(f"Childcare centers: {len(added)} added, {len(removed)} removed")
+
+    if summary["added"] or summary["removed"]:
+        if user_api_key == "API_KEY" and distance_function is get_google_distances:
+            user_api_key = get_google_api()
+        tracts = prepare_tracts(gpd.read_file(
+            data_path(test, f"{folder}/{folder}.shp")))
+        intermediate, joined, n_tracts, n_requests = refresh_pairs(
+            tracts, prepare_centers(new_centers), intermediate, joined, added,
+            removed, distance_function, user_api_key)
+    else:
+        n_tracts, n_requests = 0, 0
+    summary.update(tracts=n_tracts, requests=n_requests)
+    print(f"Updated {n_tracts} census tracts with {n_requests} travel time requests")
+
+    new_centers.to_csv(test + "data/Child_Care_Centers_clean.csv", index=False)
+    intermediate.to_csv(test + "data/intermediate_data_backup.csv", index=True)
+    joined.to_csv(test + "data/census_ccc_joined_backup.csv", index=True)
+    stages = pipeline.build_stages(
+        googleapi=distance_function is get_google_distances, state=state)
+    pipeline.mark_up_to_date(stages, ["spatial_join", "distance_api"], test)
+    return summary
@@ -1,4 +1,7 @@
 import pandas as pd
+from analysis.paths import data_path
+from analysis.columnar import ColumnWriter, iter_parts
+from analysis.quantile_sketch import KLLSketch
 
 
 def clean_distance_data(test=""):
@@ -11,24 +14,70 @@ def clean_distance_data(test=""):
     """
 
     # Open data as pandas
-    ct_three_ccc = pd.read_csv("data/census_ccc_joined_backup.csv")
+    ct_three_ccc = pd.read_csv(data_path(test, "census_ccc_joined_backup.csv"))
+    ct_three_ccc = clean_pairs(ct_three_ccc)
 
+    # Save data as csv
+    ct_three_ccc.to_csv(test + "data/census_ccc_joined.csv", index=True)
+
+
+def clean_pairs(ct_three_ccc):
+    """
+    In-memory part of clean_distance_data: imputates the distance in minutes of
+    the census tract x childcare center pairs using the exact 90 percentile of
+    the distance ratio.
+
+    Inputs:
+        ct_three_ccc (pandas df): census tract x childcare center pairs with
+            the Google API distances
+
+    Returns (pandas df): the pairs with "imputation" and "distance_minutes_imp"
+    """
     # Generate distance ratio
-    ct_three_ccc["distance_km"] = pd.to_numeric(
-        ct_three_ccc["distance_km"], errors="coerce"
-    )
-    ct_three_ccc["distance_ratio"] = (
-        ct_three_ccc["distance_km"] / ct_three_ccc["hdistance"]
-    )
+    ct_three_ccc = add_distance_ratio(ct_three_ccc)
 
     # Check results with histogram --> Graph in ipynb
     # We will use the 90 percentile, only for those cases where hdistance > 0.5 km
     filter_hdistance500 = ct_three_ccc[ct_three_ccc["hdistance"] > 0.5]
     quantile90 = filter_hdistance500["distance_ratio"].quantile(0.90)
 
-    # Imputate values to distance_minutes to correct weird results from Google API
     # Reset index to avoid duplicated index bugs
     ct_three_ccc = ct_three_ccc.reset_index(drop=True)
+    return impute_distance_minutes(ct_three_ccc, quantile90)
+
+
+def add_distance_ratio(ct_three_ccc):
+    """
+    Adds the (API distance / haversine distance) ratio used to find weird
+    results from the Google API.
+
+    Inputs:
+        ct_three_ccc (pandas df): census tract x childcare center pairs
+
+    Returns (pandas df): the same dataframe with the "distance_ratio" column
+    """
+    ct_three_ccc["distance_km"] = pd.to_numeric(
+        ct_three_ccc["distance_km"], errors="coerce"
+    )
+    ct_three_ccc["distance_ratio"] = (
+        ct_three_ccc["distance_km"] / ct_three_ccc["hdistance"]
+    )
+    return ct_three_ccc
+
+
+def impute_distance_minutes(ct_three_ccc, quantile90):
+    """
+    Imputates values to distance_minutes to correct weird results from Google
+    API, "discounting" the minutes of the pairs with a distance ratio above the
+    threshold. Works row by row, so it can be applied to chunks of the data.
+
+    Inputs:
+        ct_three_ccc (pandas df): pairs with the "distance_ratio" column
+        quantile90 (float): distance ratio threshold (90 percentile)
+
+    Returns (pandas df): the same dataframe with the "imputation" and
+        "distance_minutes_imp" columns
+    """
     # First imputation (only for cases where hdistance is not too small)
     # Define conditions
     conditions1 = (ct_three_ccc["distance_ratio"] > quantile90) & (
@@ -53,42 +102,123 @@ def clean_distance_data(test=""):
         ct_three_ccc["hdistance"] / ct_three_ccc["distance_km"]
     ) * ct_three_ccc["distance_minutes"]
 
-    # Save data as csv
-    ct_three_ccc.to_csv(test + "data/census_ccc_joined.csv", index=True)
+    return ct_three_ccc
 
 
-def aggregate_at_ct(test=""):
+def clean_distance_data_chunked(test="", chunksize=100_000, sketch_k=400):
+    """
+    Out-of-core version of clean_distance_data for inputs that do not fit in
+    memory. The pairs are read twice in chunks: the first pass builds a KLL
+    quantile sketch of the distance ratio (instead of the exact 90 percentile)
+    and the second one imputates each chunk and appends it to a columnar
+    dataset in data/census_ccc_joined/. Memory use depends on chunksize and
+    sketch_k, not on the number of pairs, and results match clean_distance_data
+    up to the sketch rank error (about 1.7 / sketch_k).
+
+    Inputs:
+        chunksize (int): number of rows read at a time
+        sketch_k (int): accuracy parameter of the quantile sketch
+    """
+    input_file = data_path(test, "census_ccc_joined_backup.csv")
+
+    # First pass: sketch the distance ratio where hdistance > 0.5 km
+    sketch = KLLSketch(k=sketch_k)
+    for chunk in pd.read_csv(
+        input_file, usecols=["hdistance", "distance_km"], chunksize=chunksize
+    ):
+        chunk = add_distance_ratio(chunk)
+        sketch.update(chunk.loc[chunk["hdistance"] > 0.5, "distance_ratio"])
+    quantile90 = sketch.quantile(0.90)
+
+    # Second pass: imputate chunk by chunk and save to the columnar output
+    writer = ColumnWriter(test + "data/census_ccc_joined")
+    for chunk in pd.read_csv(input_file, chunksize=chunksize):
+        chunk = add_distance_ratio(chunk)
+        chunk = impute_distance_minutes(chunk, quantile90)
+        writer.append(chunk)
+
+
+def aggregate_at_ct(test="", chunked=False):
     """
     This function aggregates the data at the census tract level, getting the min
     and mean for the distance variables, the sum of the capacity of the childcare
     centers, and keeps other key variables that already are at the tract level.
+
+    Inputs:
+        chunked (bool): if True, aggregate the columnar output of
+            clean_distance_data_chunked part by part
     """
+    if chunked:
+        pre_merge = aggregate_chunks(iter_parts(test + "data/census_ccc_joined"))
+    else:
+        # Open data as pandas
+        ct_three_ccc = pd.read_csv(data_path(test, "census_ccc_joined.csv"))
+        pre_merge = aggregate_pairs(ct_three_ccc)
 
-    # Open data as pandas
-    ct_three_ccc = pd.read_csv("data/census_ccc_joined.csv")
+    # Save data as csv
+    pre_merge.to_csv(test + "data/data_pre_merge.csv", index=True)
 
+
+def aggregate_pairs(ct_three_ccc):
+    """
+    In-memory part of aggregate_at_ct: aggregates the cleaned pairs at the
+    census tract level with named aggregations over a categorical GEOID key.
+
+    Inputs:
+        ct_three_ccc (pandas df): cleaned census tract x childcare center pairs
+
+    Returns (pandas df): data aggregated at the census tract level
+    """
     # Prepare data for aggregation
-    ct_three_ccc["distance_minutes_imp"] = pd.to_numeric(
-        ct_three_ccc["distance_minutes_imp"], errors="coerce"
+    ct_three_ccc = ct_three_ccc.assign(
+        GEOID=ct_three_ccc["GEOID"].astype("category"),
+        distance_minutes_imp=pd.to_numeric(
+            ct_three_ccc["distance_minutes_imp"], errors="coerce"
+        ),
     )
-    ct_three_ccc = ct_three_ccc.sort_values(by=["GEOID", "hdistance"])
-    ct_three_ccc = ct_three_ccc.rename(
-        columns={
-            "distance_minutes": "distance_min",
-            "hdistance": "hdistance_min",
-            "distance_minutes_imp": "distance_min_imp",
-        }
+
+    # Aggregate data at census tract level (statistics to get for each variable)
+    pre_merge = ct_three_ccc.groupby("GEOID", observed=True, sort=True).agg(
+        distance_min_imp=("distance_minutes_imp", "min"),
+        distance_mean_imp=("distance_minutes_imp", "mean"),
+        hdistance_min=("hdistance", "min"),
+        hdistance_mean=("hdistance", "mean"),
+        centroid_lat=("centroid_lat", "first"),
+        centroid_lon=("centroid_lon", "first"),
+        STATEFP=("STATEFP", "first"),
+        COUNTYFP=("COUNTYFP", "first"),
+        TRACTCE=("TRACTCE", "first"),
+        population=("population", "sum"),
     )
+    # observed=True does not always return the groups sorted, so sort the key
+    pre_merge = pre_merge.sort_index().reset_index()
+    geoid_dtype = ct_three_ccc["GEOID"].cat.categories.dtype
+    pre_merge["GEOID"] = pre_merge["GEOID"].astype(geoid_dtype)
 
-    ct_three_ccc["distance_mean_imp"] = ct_three_ccc["distance_min_imp"].copy()
-    ct_three_ccc["hdistance_mean"] = ct_three_ccc["hdistance_min"].copy()
+    return pre_merge
 
-    # Define statistics to get for each variable
-    agg_stats = {
+
+def aggregate_chunks(chunks):
+    """
+    Aggregates chunks of census tract x childcare center pairs at the census
+    tract level, with the same output as aggregate_at_ct. Means are kept as
+    running sums and counts, so only one row per census tract is kept in memory
+    besides the current chunk.
+
+    Inputs:
+        chunks (iterable): pandas dataframes with the output columns of
+            clean_distance_data
+
+    Returns (pandas df): data aggregated at the census tract level (no rows
+        without chunks)
+    """
+    partial_stats = {
         "distance_min_imp": "min",
-        "distance_mean_imp": "mean",
+        "distance_sum_imp": "sum",
+        "distance_count_imp": "sum",
         "hdistance_min": "min",
-        "hdistance_mean": "mean",
+        "hdistance_sum": "sum",
+        "hdistance_count": "sum",
         "centroid_lat": "first",
         "centroid_lon": "first",
         "STATEFP": "first",
@@ -97,11 +227,41 @@ def aggregate_at_ct(test=""):
         "population": "sum",
     }
 
-    # Aggregate data at census tract level
-    pre_merge = ct_three_ccc.groupby("GEOID").agg(agg_stats).reset_index()
+    running = None
+    for chunk in chunks:
+        chunk = chunk.assign(
+            distance_min_imp=pd.to_numeric(
+                chunk["distance_minutes_imp"], errors="coerce"
+            ),
+            hdistance_min=chunk["hdistance"],
+        )
+        chunk["distance_sum_imp"] = chunk["distance_min_imp"]
+        chunk["distance_count_imp"] = chunk["distance_min_imp"].notna().astype(int)
+        chunk["hdistance_sum"] = chunk["hdistance_min"]
+        chunk["hdistance_count"] = chunk["hdistance_min"].notna().astype(int)
+        partial = chunk.groupby("GEOID").agg(partial_stats)
 
-    # Save data as csv
-    pre_merge.to_csv(test + "data/data_pre_merge.csv", index=True)
+        # combine with the tracts aggregated so far
+        if running is not None:
+            partial = pd.concat([running, partial]).groupby(level=0).agg(partial_stats)
+        running = partial
+
+    if running is None:
+        # no chunks: same columns, no census tracts
+        running = pd.DataFrame(columns=list(partial_stats),
+                               index=pd.Index([], name="GEOID"))
+
+    pre_merge = running.reset_index()
+    pre_merge["distance_mean_imp"] = (
+        pre_merge["distance_sum_imp"] / pre_merge["distance_count_imp"]
+    )
+    pre_merge["hdistance_mean"] = pre_merge["hdistance_sum"] / pre_merge["hdistance_count"]
+
+    return pre_merge[
+        ["GEOID", "distance_min_imp", "distance_mean_imp", "hdistance_min",
+         "hdistance_mean", "centroid_lat", "centroid_lon", "STATEFP",
+         "COUNTYFP", "TRACTCE", "population"]
+    ]
 
 
 def socioeconomic_merge(test=""):
@@ -112,23 +272,118 @@ def socioeconomic_merge(test=""):
     visualizations and optimization.
     """
     # Load joined ct and ccc data (already aggregated at the ct level)
-    pre_merge = pd.read_csv("data/data_pre_merge.csv")
+    pre_merge = pd.read_csv(data_path(test, "data_pre_merge.csv"), index_col=0)
 
     # Load cleaned socioeconomic census data
-    census_clean_data = pd.read_csv("data/Census_data.csv")
+    census_clean_data = pd.read_csv(data_path(test, "Census_data.csv"))
+
+    final_data_merged = merge_census(pre_merge, census_clean_data)
+
+    # Save data as csv (will be used in visualizations and simulations)
+    final_data_merged.to_csv(test + "data/final_data_merged.csv", index=True)
+
 
+def merge_census(pre_merge, census_clean_data):
+    """
+    In-memory part of socioeconomic_merge: inner join of the census tract level
+    distance data with the cleaned socioeconomic census data on state, county
+    and tract codes (county and tract codes repeat across states), using a
+    sorted index on the census side.
+
+    Inputs:
+        pre_merge (pandas df): output of aggregate_pairs
+        census_clean_data (pandas df): output of census_clean
+
+    Returns (pandas df): merged data, one row per census tract
+    """
     # Change variable types to use them as keys
-    pre_merge["COUNTYFP"] = pd.to_numeric(pre_merge["COUNTYFP"])
-    pre_merge["TRACTCE"] = pd.to_numeric(pre_merge["TRACTCE"])
+    pre_merge = pre_merge.assign(
+        STATEFP=pd.to_numeric(pre_merge["STATEFP"]),
+        COUNTYFP=pd.to_numeric(pre_merge["COUNTYFP"]),
+        TRACTCE=pd.to_numeric(pre_merge["TRACTCE"]),
+    )
+    census_index = census_clean_data.set_index(
+        [
+            pd.to_numeric(census_clean_data["state_code"]).rename("STATEFP"),
+            pd.to_numeric(census_clean_data["county_code"]).rename("COUNTYFP"),
+            pd.to_numeric(census_clean_data["tract_code"]).rename("TRACTCE"),
+        ]
+    ).sort_index()
 
     # Merge data
     final_data_merged = pd.merge(
         pre_merge,
-        census_clean_data,
-        left_on=["COUNTYFP", "TRACTCE"],
-        right_on=["county_code", "tract_code"],
+        census_index,
+        left_on=["STATEFP", "COUNTYFP", "TRACTCE"],
+        right_index=True,
         how="inner",
     )
 
+    return final_data_merged.reset_index(drop=True)
+
+
+def merge_supply(final_data_merged, supply):
+    """
+    Adds the childcare supply inside each census tract (from
+    spatial_join.tract_supply) to the merged data: number of centers, their
+    capacity and seats per child under 5. Tracts without centers get zeros,
+    tracts without children under 5 get NaN seats per child.
+
+    Inputs:
+        final_data_merged (pandas df): output of merge_census
+        supply (pandas df): "GEOID", "ccc_count" and "ccc_capacity" of each
+            census tract
+
+    Returns (pandas df): merged data with "ccc_count", "ccc_capacity" and
+        "seats_per_child"
+    """
+    supply = supply.assign(GEOID=supply["GEOID"].astype(final_data_merged["GEOID"].dtype))
+    final_data_merged = final_data_merged.merge(
+        supply[["GEOID", "ccc_count", "ccc_capacity"]], on="GEOID", how="left")
+    for column in ["ccc_count", "ccc_capacity"]:
+        final_data_merged[column] = final_data_merged[column].fillna(0).astype(int)
+    pop_under5 = final_data_merged["pop_under5"]
+    final_data_merged["seats_per_child"] = round(
+        final_data_merged["ccc_capacity"] / pop_under5.where(pop_under5 > 0), 4)
+
+    return final_data_merged
+
+
+def clean_aggregate_merge(test="", chunksize=0, save_intermediate=False):
+    """
+    Runs clean_distance_data, aggregate_at_ct and socioeconomic_merge as one
+    stage (adding the supply inside each census tract, see merge_supply),
+    passing the dataframes from one step to the next instead of saving
+    and reading them back as csv. Only the final data is saved, to
+    data/final_data_merged.csv.
+
+    Inputs:
+        chunksize (int): if > 0, clean and aggregate out-of-core in chunks of
+            this many rows (see clean_distance_data_chunked)
+        save_intermediate (bool): if True, also save census_ccc_joined.csv and
+            data_pre_merge.csv as the separate steps do
+
+    Returns (pandas df): the merged data
+    """
+    if chunksize > 0:
+        clean_distance_data_chunked(test=test, chunksize=chunksize)
+        pre_merge = aggregate_chunks(iter_parts(test + "data/census_ccc_joined"))
+    else:
+        ct_three_ccc = pd.read_csv(data_path(test, "census_ccc_joined_backup.csv"))
+        ct_three_ccc = clean_pairs(ct_three_ccc)
+        if save_intermediate:
+            ct_three_ccc.to_csv(test + "data/census_ccc_joined.csv", index=True)
+        pre_merge = aggregate_pairs(ct_three_ccc)
+
+    if save_intermediate:
+        pre_merge.to_csv(test + "data/data_pre_merge.csv", index=True)
+
+    census_clean_data = pd.read_csv(data_path(test, "Census_data.csv"))
+    final_data_merged = merge_census(pre_merge, census_clean_data)
+    supply = pd.read_csv(data_path(test, "tract_supply.csv"))
+    final_data_merged = merge_supply(final_data_merged, supply)
+
     # Save data as csv (will be used in visualizations and simulations)
     final_data_merged.to_csv(test + "data/final_data_merged.csv", index=True)
+
+    return final_data_merged
@@ -1,7 +1,7 @@
 import pandas as pd
-import googlemaps
 from datetime import datetime
 from analysis.google_api_request import get_google_distances
+from analysis.paths import data_path
 
 
 def get_google_api():
@@ -17,21 +17,29 @@ def get_google_api():
     return user_api_key
 
 
-def get_distance_data(test=""):
+def get_distance_data(test="", estimate=False):
     """
     This function calls get_google_distances to use Google Distance Matrix API
     and get the distance in km and time (minutes) from each census tract centroid
     to each of its assigned chilcare centers. Then, saves the data into a csv
     file
+
+    Inputs:
+        estimate (bool): estimate the distances from the haversine distance
+            (travel_estimate) instead of calling the API
     """
     # Open data as pandas
-    ct_three_ccc = pd.read_csv("data/intermediate_data_backup.csv")
+    ct_three_ccc = pd.read_csv(data_path(test, "intermediate_data_backup.csv"))
 
-    # Get Google Distance Matrix API key
-    user_api_key = get_google_api()
+    if estimate:
+        from analysis.travel_estimate import get_estimated_distances
+        distance_function, user_api_key = get_estimated_distances, None
+    else:
+        # Get Google Distance Matrix API key
+        distance_function, user_api_key = get_google_distances, get_google_api()
 
     # Get distance variables and add them to the dataframe
-    get_google_distances(
+    distance_function(
         ct_three_ccc,
         "distance_km",
         "distance_minutes",
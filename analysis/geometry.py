@@ -0,0 +1,224 @@
+import numpy as np
+import shapely
+
+# NOTE: Topology-preserving simplification for the tract maps. Simplifying
+# each polygon on its own moves the two copies of a shared border differently
+# and leaves gaps and slivers between tracts. Instead, coordinates are
+# quantized to an integer grid, the rings are cut into arcs at the points where
+# tracts meet (junctions), each distinct arc is kept once and simplified once
+# (Douglas-Peucker with its ends fixed) and the rings are rebuilt from the
+# simplified arcs, so neighbours keep sharing exactly the same border. This is
+# the TopoJSON model (https://github.com/topojson/topojson-specification).
+
+# Douglas-Peucker tolerance (degrees) of the map variants for each zoom level.
+# At state zoom the Illinois map is ~800px wide, about 0.005 degrees per pixel.
+ZOOM_LEVELS = {"state": 0.002, "county": 0.0005, "tract": 0.0001}
+QUANTIZATION = 1_000_000
+
+
+class Topology:
+    """
+    Polygons stored as shared arcs of quantized coordinates.
+
+    Attributes:
+        arcs (lst): arrays (n, 2) of integer coordinates, each used by one or
+            more rings
+        features (lst): for each input geometry, a list of polygons, each a
+            list of rings, each a list of arc references (i for arc i, ~i for
+            arc i reversed)
+        scale, translate (tuple): x = translate + scale * quantized x
+    """
+
+    def __init__(self, arcs, features, scale, translate):
+        self.arcs = arcs
+        self.features = features
+        self.scale = scale
+        self.translate = translate
+
+    def arc_coordinates(self):
+        """
+        Returns (lst): arrays (n, 2) of longitude and latitude of each arc
+        """
+        scale, translate = np.array(self.scale), np.array(self.translate)
+        return [arc * scale + translate for arc in self.arcs]
+
+
+def geometry_rings(geometry):
+    """
+    Splits a Polygon or MultiPolygon into a list of polygons, each one a list
+    of rings (exterior first) as coordinate arrays without the closing point.
+    """
+    polygons = []
+    for polygon in shapely.get_parts(geometry):
+        rings = [polygon.exterior] + list(polygon.interiors)
+        polygons.append([np.asarray(ring.coords)[:-1, :2] for ring in rings])
+    return polygons
+
+
+def build_topology(geometries, quantization=QUANTIZATION):
+    """
+    Builds the shared-arc topology of a set of polygons.
+
+    Inputs:
+        geometries (GeoSeries or lst): Polygon or MultiPolygon geometries
+        quantization (int): number of grid steps on each axis of the bounding
+            box (1e6 is ~0.5m for Illinois)
+
+    Returns (Topology): the topology
+    """
+    features = [geometry_rings(geometry) for geometry in geometries]
+    all_coords = np.concatenate(
+        [ring for polygons in features for rings in polygons for ring in rings]
+    )
+    minimum, maximum = all_coords.min(axis=0), all_coords.max(axis=0)
+    scale = np.where(maximum > minimum, (maximum - minimum) / (quantization - 1), 1)
+
+    # quantize and drop repeated consecutive points
+    rings = []
+    for polygons in features:
+        for polygon in polygons:
+            for i, ring in enumerate(polygon):
+                ring = np.round((ring - minimum) / scale).astype(np.int64)
+                keep = np.any(ring != np.roll(ring, 1, axis=0), axis=1)
+                keep[0] = True
+                polygon[i] = ring[keep]
+                rings.append(polygon[i])
+
+    junctions = find_junctions(rings, quantization)
+
+    arcs, arc_ids = [], {}
+
+    def arc_reference(arc):
+        # the same border is walked in opposite directions by the two tracts,
+        # so keep each arc in a canonical direction
+        key_forward, key_reverse = arc.tobytes(), arc[::-1].tobytes()
+        if key_forward in arc_ids:
+            return arc_ids[key_forward]
+        if key_reverse in arc_ids:
+            return ~arc_ids[key_reverse]
+        arc_ids[key_forward] = len(arcs)
+        arcs.append(arc)
+        return arc_ids[key_forward]
+
+    topology_features = []
+    for polygons in features:
+        topology_polygons = []
+        for polygon in polygons:
+            topology_rings = []
+            for ring in polygon:
+                keys = ring[:, 0] * quantization + ring[:, 1]
+                cuts = np.flatnonzero(np.isin(keys, junctions))
+                if len(cuts) == 0:
+                    # ring not touching other rings: one closed arc, starting
+                    # at its smallest point so both copies of a hole match
+                    ring = np.roll(ring, -int(np.argmin(keys)), axis=0)
+                    topology_rings.append([arc_reference(np.vstack([ring, ring[:1]]))])
+                    continue
+                ring = np.roll(ring, -cuts[0], axis=0)
+                cuts = np.append(cuts - cuts[0], len(ring))
+                ring = np.vstack([ring, ring[:1]])
+                topology_rings.append([
+                    arc_reference(ring[start:end + 1])
+                    for start, end in zip(cuts[:-1], cuts[1:])
+                ])
+            topology_polygons.append(topology_rings)
+        topology_features.append(topology_polygons)
+
+    return Topology(arcs, topology_features, tuple(scale), tuple(minimum))
+
+
+def find_junctions(rings, quantization):
+    """
+    Finds the points where rings meet: points that appear with different
+    neighbours (previous and next point) in different places.
+
+    Returns (array): keys (x * quantization + y) of the junction points
+    """
+    keys, lows, highs = [], [], []
+    for ring in rings:
+        key = ring[:, 0] * quantization + ring[:, 1]
+        previous, following = np.roll(key, 1), np.roll(key, -1)
+        keys.append(key)
+        lows.append(np.minimum(previous, following))
+        highs.append(np.maximum(previous, following))
+
+    neighbours = np.unique(
+        np.column_stack([np.concatenate(keys), np.concatenate(lows),
+                         np.concatenate(highs)]),
+        axis=0,
+    )
+    points, counts = np.unique(neighbours[:, 0], return_counts=True)
+    return points[counts > 1]
+
+
+def simplify_arcs(topology, tolerance):
+    """
+    Simplifies each arc once, keeping its end points. Arcs of rings that would
+    collapse (less than 3 distinct points) are kept as they are.
+
+    Inputs:
+        topology (Topology): the topology
+        tolerance (float): Douglas-Peucker tolerance in degrees (0 keeps the
+            full resolution)
+
+    Returns (lst): arrays (n, 2) of longitude and latitude of each arc
+    """
+    original = topology.arc_coordinates()
+    if tolerance <= 0:
+        return original
+    lines = shapely.simplify(
+        np.array([shapely.LineString(arc) for arc in original]),
+        tolerance,
+        preserve_topology=False,
+    )
+    simplified = [np.asarray(line.coords) for line in lines]
+
+    for polygons in topology.features:
+        for polygon in polygons:
+            for ring in polygon:
+                if len(ring_coordinates(ring, simplified)) < 4:
+                    for reference in ring:
+                        index = reference if reference >= 0 else ~reference
+                        simplified[index] = original[index]
+    return simplified
+
+
+def ring_coordinates(ring, arcs):
+    """
+    Joins the arcs of a ring into a closed coordinate array.
+    """
+    parts = []
+    for reference in ring:
+        arc = arcs[reference] if reference >= 0 else arcs[~reference][::-1]
+        parts.append(arc if not parts else arc[1:])
+    return np.vstack(parts)
+
+
+def to_geojson(topology, properties, tolerance=0.0, decimals=5):
+    """
+    Converts the topology to a GeoJSON FeatureCollection with simplified arcs
+    and coordinates rounded to "decimals" digits.
+
+    Inputs:
+        topology (Topology): the topology
+        properties (lst): dictionary of properties of each feature
+        tolerance (float): simplification tolerance in degrees
+        decimals (int): decimal digits kept (5 is ~1m)
+
+    Returns (dict): the GeoJSON
+    """
+    arcs = [np.round(arc, decimals) for arc in simplify_arcs(topology, tolerance)]
+    features = []
+    for polygons, feature_properties in zip(topology.features, properties):
+        coordinates = [
+            [ring_coordinates(ring, arcs).tolist() for ring in polygon]
+            for polygon in polygons
+        ]
+        if len(coordinates) == 1:
+            geometry = {"type": "Polygon", "coordinates": coordinates[0]}
+        else:
+            geometry = {"type": "MultiPolygon", "coordinates": coordinates}
+        features.append({"type": "Feature", "properties": feature_properties,
+                         "geometry": geometry})
+    return {"type": "FeatureCollection", "features": features}
+
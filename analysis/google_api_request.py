@@ -1,7 +1,9 @@
-import googlemaps
 from datetime import datetime
+from analysis import metrics, profiling
 
 
+@metrics.timed(metrics.FUNCTION_SECONDS)
+@profiling.profiled
 def get_google_distances(
     df,
     new_km_distance_column,
@@ -34,6 +36,10 @@ def get_google_distances(
             "to_analyze". It will calculate the google distance just to the rows
             that have value "True" in the column "to_analyze".
     """
+    import googlemaps
+
+    profiling.add(rows_in=len(df))
+
     # Connect and define options for API
     gmaps = googlemaps.Client(key=user_api_key)
     arrival_time = datetime(2024, 4, 11, 9, 0)
@@ -73,6 +79,9 @@ def get_google_distances(
         result = gmaps.distance_matrix(
             origin, destination, mode="driving", arrival_time=arrival_time
         )
+        profiling.add(api_calls=1)
+        metrics.DISTANCE_CALLS.inc(backend="google")
+        metrics.DISTANCE_ELEMENTS.inc(backend="google")
 
         # if the request was a success, get the values
         if result["rows"][0]["elements"][0]["status"] == "OK":
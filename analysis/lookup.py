@@ -0,0 +1,154 @@
+import numpy as np
+import shapely
+from analysis.hav_distance import haversine_distance
+from analysis.travel_estimate import DETOUR_FACTOR, ROAD_SPEED_KMH
+
+# NOTE: Nearest childcare centers of any point, for the /nearest endpoint of
+# the dashboard server. The centers and the census tract polygons are kept in
+# STRtrees built once. The k nearest centers of a batch of points are searched
+# with a radius (in degrees) that grows until it covers the haversine distance
+# to the k-th nearest center found, so the result is exact, and the containing
+# tract is a point-in-polygon query. Travel times are estimated from the
+# haversine distance (travel_estimate), no API is called.
+
+# km per degree of latitude, slightly less than the real value so the search
+# radius in degrees is never too small
+KM_PER_DEGREE = 110
+INITIAL_RADIUS = 0.1
+# a radius (in degrees) covering the whole planisphere
+MAX_RADIUS = 400
+CENTER_COLUMNS = ["objectid", "name", "address", "city", "zip", "latitude",
+                  "longitude"]
+
+
+class CenterIndex:
+    """
+    In-memory indexes of the childcare centers and census tracts.
+
+    Inputs:
+        centers (pandas df): centers (Child_Care_Centers_clean.csv)
+        tracts (GeoPandas): census tract polygons with "GEOID" (optional)
+    """
+
+    def __init__(self, centers, tracts=None):
+        self.lat = centers["latitude"].to_numpy(dtype=float)
+        self.lon = centers["longitude"].to_numpy(dtype=float)
+        # missing values as null in json
+        records = centers[CENTER_COLUMNS].astype(object)
+        self.records = records.where(records.notna(), None).to_dict("records")
+        self.tree = shapely.STRtree(shapely.points(self.lon, self.lat))
+        if tracts is None:
+            self.geoids, self.tract_tree = np.array([], dtype=str), None
+        else:
+            self.geoids = tracts["GEOID"].astype(str).to_numpy()
+            self.tract_tree = shapely.STRtree(tracts.geometry.values)
+
+    def nearest(self, lat, lon, k=3):
+        """
+        k nearest centers (haversine distance) of each point.
+
+        Inputs:
+            lat, lon (array): coordinates of the points
+            k (int): number of centers
+
+        Returns (tuple): rows of the centers (array (n, k)) and their distance
+            in km (array (n, k)), sorted by distance
+        """
+        k = min(k, len(self.lat))
+        rows = np.zeros((len(lat), k), dtype=np.int64)
+        distance = np.zeros((len(lat), k))
+        points = shapely.points(lon, lat)
+        radius = np.full(len(lat), INITIAL_RADIUS)
+        pending = np.arange(len(lat))
+
+        while len(pending) and k:
+            point_rows, center_rows = self.tree.query(
+                points[pending], predicate="dwithin", distance=radius[pending])
+            found = haversine_distance(lat[pending][point_rows], lon[pending][point_rows],
+                                       self.lat[center_rows], self.lon[center_rows])
+            order = np.lexsort((found, point_rows))
+            center_rows, found = center_rows[order], found[order]
+            counts = np.bincount(point_rows, minlength=len(pending))
+            starts = np.cumsum(counts) - counts
+
+            # centers closer than the k-th one found are inside this radius
+            enough = counts >= k
+            kth = np.full(len(pending), np.inf)
+            kth[enough] = found[starts[enough] + k - 1]
+            max_lat = np.minimum(np.abs(lat[pending]) + kth / KM_PER_DEGREE, 89)
+            needed = kth / (KM_PER_DEGREE * np.cos(np.radians(max_lat)))
+            done = enough & ((needed <= radius[pending]) | (radius[pending] >= MAX_RADIUS))
+
+            positions = starts[done][:, None] + np.arange(k)
+            rows[pending[done]] = center_rows[positions]
+            distance[pending[done]] = found[positions]
+            radius[pending] = np.where(enough, needed, radius[pending] * 4)
+            pending = pending[~done]
+        return rows, distance
+
+    def containing_tracts(self, lat, lon):
+        """
+        Returns (array): GEOID of the census tract containing each point (None
+            outside every tract)
+        """
+        geoids = np.full(len(lat), None, dtype=object)
+        if self.tract_tree is None:
+            return geoids
+        # "intersects" keeps the points on a border ("within" excludes them),
+        # a point on a shared border keeps one of its tracts
+        point_rows, tract_rows = self.tract_tree.query(
+            shapely.points(lon, lat), predicate="intersects")
+        point_rows, first = np.unique(point_rows, return_index=True)
+        geoids[point_rows] = self.geoids[tract_rows[first]]
+        return geoids
+
+    def lookup(self, lat, lon, k=3):
+        """
+        Nearest centers and containing census tract of each point.
+
+        Inputs:
+            lat, lon (lst): coordinates of the points
+            k (int): number of centers
+
+        Returns (lst): one dictionary per point with its "latitude",
+            "longitude", "tract" (GEOID) and "centers" (columns of
+            CENTER_COLUMNS plus distance_km (haversine), estimated_km and
+            estimated_minutes of driving)
+        """
+        lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+        rows, distance = self.nearest(lat, lon, k)
+        tracts = self.containing_tracts(lat, lon)
+        minutes = distance * DETOUR_FACTOR / ROAD_SPEED_KMH * 60
+
+        results = []
+        for i in range(len(lat)):
+            centers = [{**self.records[row],
+                        "distance_km": round(float(distance[i, j]), 3),
+                        "estimated_km": round(float(distance[i, j] * DETOUR_FACTOR), 3),
+                        "estimated_minutes": round(float(minutes[i, j]), 1)}
+                       for j, row in enumerate(rows[i])]
+            results.append({"latitude": float(lat[i]), "longitude": float(lon[i]),
+                            "tract": tracts[i], "centers": centers})
+        return results
+
+
+def load_center_index(centers_path, gdf_path=None):
+    """
+    Builds the CenterIndex of the saved files.
+
+    Inputs:
+        centers_path (str): Child_Care_Centers_clean.csv
+        gdf_path (str): shapefile of the census tracts (optional)
+
+    Returns (CenterIndex): the indexes
+    """
+    import pandas as pd
+
+    centers = pd.read_csv(centers_path)
+    tracts = None
+    if gdf_path is not None:
+        import geopandas as gpd
+
+        # NAD83 longitude and latitude, within a meter of the center coordinates
+        tracts = gpd.read_file(gdf_path)[["GEOID", "geometry"]]
+    return CenterIndex(centers, tracts)
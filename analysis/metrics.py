@@ -0,0 +1,310 @@
+import bisect
+import functools
+import json
+import math
+import os
+import threading
+import time
+
+# NOTE: Metrics of the dashboard server in the Prometheus text format
+# (https://prometheus.io/docs/instrumenting/exposition_formats/), served at
+# /metrics. Unlike profiling.py, metrics are always on and only keep counters
+# and histogram buckets, so a measurement is a clock read and a few additions.
+# With several server workers (serve.py), a scrape reaches any one of them, so
+# each worker saves a snapshot of its values in a shared folder every
+# SNAPSHOT_SECONDS (and when it answers a scrape), and /metrics sums the
+# snapshots of all the workers. The snapshots of workers that stopped are
+# kept, so counters never go back, except for their gauges, which are dropped.
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+SNAPSHOT_SECONDS = 1
+
+lock = threading.Lock()
+snapshot_lock = threading.Lock()
+metrics = {}
+collectors = []
+# folder of the snapshots of the worker processes (None with one process)
+multiprocess_dir = None
+
+
+class Metric:
+    """
+    A counter, gauge or histogram with one value per combination of labels.
+
+    Inputs:
+        name (str): metric name
+        kind (str): "counter", "gauge" or "histogram"
+        description (str): help text
+        label_names (tuple): names of the labels
+        buckets (tuple): upper bounds of the histogram buckets
+    """
+
+    def __init__(self, name, kind, description, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.kind = kind
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        """
+        Adds amount to a counter or gauge.
+        """
+        key = tuple(labels[name] for name in self.label_names)
+        with lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """
+        Sets the value of a gauge, or of a counter kept somewhere else.
+        """
+        key = tuple(labels[name] for name in self.label_names)
+        with lock:
+            self.values[key] = value
+
+    def dec(self, amount=1, **labels):
+        """
+        Subtracts amount from a gauge.
+        """
+        self.inc(-amount, **labels)
+
+    def observe(self, value, **labels):
+        """
+        Adds a value (e.g. a duration in seconds) to a histogram.
+        """
+        key = tuple(labels[name] for name in self.label_names)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # bucket counts (the last one is +Inf), sum
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bucket] += 1
+            counts[-1] += value
+
+    def snapshot(self):
+        """
+        Returns (dict): copy of the values of every combination of labels
+        """
+        with lock:
+            return {key: list(value) if self.kind == "histogram" else value
+                    for key, value in self.values.items()}
+
+    def samples(self, values=None):
+        """
+        Inputs:
+            values (dict): values to render (default: the ones of this process)
+
+        Returns (lst): (name suffix, labels dict, value) of every sample
+        """
+        if values is None:
+            values = self.snapshot()
+        samples = []
+        for key, value in sorted(values.items()):
+            labels = dict(zip(self.label_names, key))
+            if self.kind != "histogram":
+                samples.append(("", labels, value))
+                continue
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), value[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(float(bound))
+                samples.append(("_bucket", {**labels, "le": le}, cumulative))
+            samples.append(("_sum", labels, value[-1]))
+            samples.append(("_count", labels, cumulative))
+        return samples
+
+
+def register(name, kind, description, label_names=(), buckets=LATENCY_BUCKETS):
+    """
+    Creates a metric (or returns the existing one with that name).
+
+    Returns (Metric): the metric
+    """
+    with lock:
+        if name not in metrics:
+            metrics[name] = Metric(name, kind, description, tuple(label_names), buckets)
+        return metrics[name]
+
+
+def add_collector(function):
+    """
+    Adds a function called when the metrics are rendered, to update metrics
+    that are read from somewhere else (e.g. cache statistics).
+    """
+    collectors.append(function)
+
+
+CALLBACK_SECONDS = register(
+    "dash_callback_duration_seconds", "histogram",
+    "Duration of the dashboard callbacks", ["callback"])
+FUNCTION_SECONDS = register(
+    "function_duration_seconds", "histogram",
+    "Duration of the hot analysis functions", ["function"])
+SIMULATIONS_IN_FLIGHT = register(
+    "simulations_in_flight", "gauge", "Simulations running now")
+DISTANCE_CALLS = register(
+    "distance_backend_calls_total", "counter",
+    "Calls to the distance backend (requests for the Google API)", ["backend"])
+DISTANCE_ELEMENTS = register(
+    "distance_backend_elements_total", "counter",
+    "Origin-destination pairs computed by the distance backend (billed "
+    "elements for the Google API)", ["backend"])
+CACHE_REQUESTS = register(
+    "cache_requests_total", "counter", "Cache lookups", ["cache", "result"])
+SIMULATIONS_IN_FLIGHT.set(0)
+
+
+def timed(histogram, name=None):
+    """
+    Decorator that records the duration of every call of a function in a
+    histogram, labeled with the function name.
+
+    Inputs:
+        histogram (Metric): CALLBACK_SECONDS or FUNCTION_SECONDS
+        name (str): label value (default: "module.function")
+    """
+    def decorator(func):
+        label = name or func.__module__.replace("analysis.", "") + "." + func.__name__
+        label_name = histogram.label_names[0]
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **{label_name: label})
+
+        return wrapper
+
+    return decorator
+
+
+def format_labels(labels):
+    """
+    Returns (str): labels as {name="value",...} (empty string without labels)
+    """
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def enable_multiprocess(path):
+    """
+    Aggregates the metrics of several processes through snapshots saved in a
+    folder. Called in the main process before the workers are forked.
+
+    Inputs:
+        path (str): empty folder for the snapshots
+    """
+    global multiprocess_dir
+    os.makedirs(path, exist_ok=True)
+    multiprocess_dir = path
+
+
+def save_snapshot():
+    """
+    Saves the values of the metrics of this process in the snapshot folder
+    (replacing its previous snapshot in one step, so readers never see half a
+    file).
+    """
+    for collector in collectors:
+        collector()
+    with lock:
+        registered = list(metrics.values())
+    snapshot = {metric.name: [[list(key), value] for key, value in metric.snapshot().items()]
+                for metric in registered}
+    path = os.path.join(multiprocess_dir, f"{os.getpid()}.json")
+    with snapshot_lock:
+        with open(path + ".tmp", "w") as file:
+            json.dump(snapshot, file)
+        os.replace(path + ".tmp", path)
+
+
+def start_snapshots():
+    """
+    Saves a snapshot every SNAPSHOT_SECONDS in a background thread. Called in
+    each worker process after it is forked.
+    """
+    def loop():
+        while True:
+            save_snapshot()
+            time.sleep(SNAPSHOT_SECONDS)
+
+    threading.Thread(target=loop, name="metrics-snapshots", daemon=True).start()
+
+
+def is_alive(pid):
+    """
+    Returns (bool): True if the process is running
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def merged_values():
+    """
+    Sums the snapshots of all the processes.
+
+    Returns (dict): {metric name: {labels key: value}}
+    """
+    merged = {}
+    for name in sorted(os.listdir(multiprocess_dir)):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(multiprocess_dir, name), "r") as file:
+            snapshot = json.load(file)
+        alive = is_alive(int(name.removesuffix(".json")))
+        for metric_name, values in snapshot.items():
+            metric = metrics.get(metric_name)
+            if metric is None or (metric.kind == "gauge" and not alive):
+                continue
+            totals = merged.setdefault(metric_name, {})
+            for key, value in values:
+                key = tuple(key)
+                if key not in totals:
+                    totals[key] = value
+                elif metric.kind == "histogram":
+                    totals[key] = [a + b for a, b in zip(totals[key], value)]
+                else:
+                    totals[key] += value
+    return merged
+
+
+def render():
+    """
+    Renders all the metrics in the Prometheus text format, summed over the
+    worker processes if there are several (see enable_multiprocess).
+
+    Returns (str): the metrics
+    """
+    merged = None
+    if multiprocess_dir is not None:
+        save_snapshot()
+        merged = merged_values()
+    else:
+        for collector in collectors:
+            collector()
+    lines = []
+    with lock:
+        registered = list(metrics.values())
+    for metric in registered:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        values = None if merged is None else merged.get(metric.name, {})
+        for suffix, labels, value in metric.samples(values):
+            lines.append(f"{metric.name}{suffix}{format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
@@ -1,11 +1,18 @@
+from analysis import metrics, profiling
 from analysis.hav_distance import haversine_distance
 from analysis.google_api_request import get_google_distances
 from analysis.distance_matrix_api import get_google_api
+from analysis.placement import best_site
+from analysis.travel_estimate import county_codes, load_speed_bounds, minutes_lower_bound
 import numpy as np
 import pandas as pd
 
 
-def create_several_child_centers(user_api_key, number_child_centers, optimized):
+@metrics.timed(metrics.FUNCTION_SECONDS)
+def create_several_child_centers(user_api_key, number_child_centers, optimized,
+                                 df=None, distance_function=get_google_distances,
+                                 return_details=False, placement="centroid",
+                                 weight_column=None, speed_bounds=None, test=""):
     """
     Establishes where to put a defined number of child centers (number of
     iterations) in Illinois using the distance in minutes between the centroid
@@ -18,6 +25,25 @@ def create_several_child_centers(user_api_key, number_child_centers, optimized):
             tract with less access. if True, allocate the new child center in
             the census tract that has the higher estimated impact in the
             dataframe as a whole
+        df (pandas df): data at a census tract level (default: read
+            data/final_data_merged.csv)
+        distance_function (function): function that adds the distance in km
+            and minutes to the new center, get_google_distances or a function
+            with the same inputs (e.g. travel_estimate.get_estimated_distances)
+        return_details (bool): if True, also return the census tract data
+            with the new child centers (pandas df) and the new child centers
+            (list of (GEOID, latitude, longitude) of their census tracts)
+        placement (str): "centroid" puts the new child centers at census tract
+            centroids. "grid" puts them anywhere, at the site that saves the
+            most haversine distance (see placement.best_site), and the
+            ranking refers to the census tract closest to the site
+        weight_column (str): optional column weighting the distance saved in
+            each census tract when choosing where to put the new child
+            centers (e.g. "pop_under5"), if optimized or with "grid"
+        speed_bounds (pandas Series): fastest travel speeds that decide which
+            distances are requested (default: travel_estimate.load_speed_bounds)
+        test (str): folder prefix of the data the default speed_bounds are
+            loaded from
 
     Returns (tuple): a tuple with 6 variables:
         ranking_lst (lst): List with the ranking value (int) of the census
@@ -37,10 +63,13 @@ def create_several_child_centers(user_api_key, number_child_centers, optimized):
             closest child center related to the new child centers
     """
     # import database
-    df = pd.read_csv("data/final_data_merged.csv")
-    
+    if df is None:
+        df = pd.read_csv("data/final_data_merged.csv")
+
     if user_api_key == "API_KEY":
         user_api_key = get_google_api()
+    if speed_bounds is None:
+        speed_bounds = load_speed_bounds(test)
 
         # auxiliar variables to return
     total_benefited_ct = []
@@ -49,12 +78,24 @@ def create_several_child_centers(user_api_key, number_child_centers, optimized):
     ranking_lst = []
     total_impact_km = 0
     total_impact_min = 0
+    new_centers = []
 
     # iteration to allocate each new child center
     for _ in range(number_child_centers):
+        previous_df = df
+        site = None
+        if placement == "grid":
+            site = best_site(df, weight_column)[:2]
         df, benefited_ct, impact_km, impact_min, ranking = create_new_center(
-            df, user_api_key, optimized
+            df, user_api_key, optimized, distance_function, site, weight_column,
+            speed_bounds
         )
+        if return_details:
+            # census tract of the new center (same sorting as create_new_center)
+            center = previous_df.sort_values(by=["distance_min_imp"],
+                ascending=[False]).iloc[ranking]
+            location = site or (center["centroid_lat"], center["centroid_lon"])
+            new_centers.append((center["GEOID"],) + tuple(location))
         ranking_lst.append(ranking + 1)
         total_benefited_ct.append(benefited_ct)
         single_impact_km.append(impact_km)
@@ -62,11 +103,18 @@ def create_several_child_centers(user_api_key, number_child_centers, optimized):
         total_impact_km += impact_km
         total_impact_min += impact_min
 
-    return (ranking_lst,single_impact_km,single_impact_min,total_benefited_ct,
+    results = (ranking_lst,single_impact_km,single_impact_min,total_benefited_ct,
         total_impact_km,total_impact_min)
+    if return_details:
+        return results + (df, new_centers)
+    return results
 
 
-def create_new_center(df, user_api_key, optimized):
+@metrics.timed(metrics.FUNCTION_SECONDS)
+@profiling.profiled
+def create_new_center(df, user_api_key, optimized,
+                      distance_function=get_google_distances, site=None,
+                      weight_column=None, speed_bounds=None, test=""):
     """
     Takes a child center dataframe "df" that has data at a census tract level
     and a column related to distance in minutes for each census tract.
@@ -81,6 +129,19 @@ def create_new_center(df, user_api_key, optimized):
             tract with less access. if True, allocate the new child center in
             the census tract that has the higher estimated impact in the
             dataframe as a whole
+        distance_function (function): get_google_distances or a function with
+            the same inputs
+        site (tuple): optional (latitude, longitude) of the new child center.
+            If given, it is used instead of a census tract centroid and every
+            census tract (including the closest one) is analyzed
+        weight_column (str): optional column weighting the distance saved in
+            each census tract, if optimized
+        speed_bounds (pandas Series): fastest travel speed of each county
+            (default: travel_estimate.load_speed_bounds). Only the census
+            tracts whose lower bound of the travel time to the new center is
+            below their current time are requested
+        test (str): folder prefix of the data the default speed_bounds are
+            loaded from
 
     Returns (tuple): a tuple with 5 variables:
         df (pandas df): pandas dataframe with the new child center on it
@@ -95,6 +156,8 @@ def create_new_center(df, user_api_key, optimized):
     """
     if user_api_key == "API_KEY":
         user_api_key = get_google_api()
+    if speed_bounds is None:
+        speed_bounds = load_speed_bounds(test)
     
     # return variables: impact in reduced kilometers and reduced minutes
     impact_km = 0
@@ -107,17 +170,24 @@ def create_new_center(df, user_api_key, optimized):
 
     # if optimized, take row (ranking) from the census tract that has the highest
     # expected impact, otherwise, take first row of df (longest distance in minutes)
-    if optimized:
-        ranking = optimization_new_center_distance_overall_impact(df)
+    if site is not None:
+        # census tract closest to the site
+        ranking = int(np.argmin(haversine_distance(
+            df["centroid_lat"].astype(float), df["centroid_lon"].astype(float),
+            site[0], site[1])))
+        df["new_center_lat"], df["new_center_lon"] = site
+    elif optimized:
+        ranking = optimization_new_center_distance_overall_impact(df, weight_column)
     else:
         ranking = 0
 
-    # generate comparison columns with coordinates of the census tract with
-    # highest distance in minutes
-    df["new_center_lat"], df["new_center_lon"] = (
-        df["centroid_lat"][ranking],
-        df["centroid_lon"][ranking],
-    )
+    if site is None:
+        # generate comparison columns with coordinates of the census tract with
+        # highest distance in minutes
+        df["new_center_lat"], df["new_center_lon"] = (
+            df["centroid_lat"][ranking],
+            df["centroid_lon"][ranking],
+        )
 
     # calculate (haverstine) distance from each census tract to the new center
     df = df.assign(
@@ -129,23 +199,34 @@ def create_new_center(df, user_api_key, optimized):
         )
     )
 
-    # if distance to the new center less than 1.5 current maximum distance,
-    # analyze it. Otherwise, assume that new center will not be closest center.
-    # This is done due to limits of google requests.
-    df["to_analyze"] = df["hdistance_new_center"] < 1.5 * df["hdistance_min"]
+    # analyze a census tract only if the new center can be closer in minutes:
+    # the travel time to the new center is at least minutes_bound (haversine
+    # distance at the fastest possible speed). The others would not benefit.
+    counties = county_codes(df)
+    df["minutes_bound"] = minutes_lower_bound(
+        df["hdistance_new_center"], counties, counties[ranking], speed_bounds)
+    df["to_analyze"] = df["minutes_bound"] < df["distance_min_imp"]
 
     # don't analyze with google maps first census tract (there will be a child
     # center there) and set child center parameters for that census tract
-    df.loc[0, "to_analyze"] = False
-    benefited_ct.append(df.loc[0, "GEOID"])
-    impact_km += df.loc[0, "hdistance_min"] - 0.1
-    impact_min += df.loc[0, "distance_min_imp"] - 1
-    df.loc[0, "hdistance_min"] = 0.1
-    df.loc[0, "distance_min_imp"] = 1
-
-    # define name of new columns and apply distance request in googlemaps
-    get_google_distances(df,"new_km_distance","new_min_distance",
-        "new_center_lat","new_center_lon",user_api_key,limit_analysis=True)
+    if site is None:
+        df.loc[0, "to_analyze"] = False
+        benefited_ct.append(df.loc[0, "GEOID"])
+        impact_km += df.loc[0, "hdistance_min"] - 0.1
+        impact_min += df.loc[0, "distance_min_imp"] - 1
+        df.loc[0, "hdistance_min"] = 0.1
+        df.loc[0, "distance_min_imp"] = 1
+
+    # define name of new columns and apply distance request in googlemaps,
+    # only for the analyzed census tracts, the most promising first
+    requested = df[df["to_analyze"]].sort_values("minutes_bound", kind="stable").copy()
+    df["new_km_distance"], df["new_min_distance"] = np.nan, np.nan
+    if len(requested):
+        distance_function(requested,"new_km_distance","new_min_distance",
+            "new_center_lat","new_center_lon",user_api_key)
+        for column in ["new_km_distance", "new_min_distance"]:
+            df.loc[requested.index, column] = pd.to_numeric(
+                requested[column], errors="coerce")
 
     # for each analyzed census tract, if new time is lower than current value
     # assign new center as closest center
@@ -160,12 +241,13 @@ def create_new_center(df, user_api_key, optimized):
     # drop helper columns created by the function
     df = df.drop(
         columns=["new_center_lat","new_center_lon","hdistance_new_center",
-            "to_analyze","new_km_distance","new_min_distance"])
+            "minutes_bound","to_analyze","new_km_distance","new_min_distance"])
 
     return df, benefited_ct, impact_km, impact_min, ranking
 
 
-def optimization_new_center_distance_overall_impact(df):
+@metrics.timed(metrics.FUNCTION_SECONDS)
+def optimization_new_center_distance_overall_impact(df, weight_column=None):
     """
     Takes a pandas dataframe that has data at a census tract level and a column
     related to distance in minutes to closest child center by census tract.
@@ -175,6 +257,8 @@ def optimization_new_center_distance_overall_impact(df):
 
     Inputs:
         df (pandas df): the pandas dataframe with data at a census tract level
+        weight_column (str): optional column weighting the reduced distance of
+            each census tract
 
     Returns (int): index of the row of the dataframe that has the
             census tract with the highest impact estimate
@@ -190,7 +274,7 @@ def optimization_new_center_distance_overall_impact(df):
     # for effiency, just check in the first 150 census tracts (highest
     # probability to have a higher impact)
     for row_index in range(150):
-        impact = new_center_distance_overall_impact(df, row_index)
+        impact = new_center_distance_overall_impact(df, row_index, weight_column)
         if impact > aux_highest_impact:
             aux_highest_impact = impact
             optimum_row_index = row_index
@@ -198,7 +282,7 @@ def optimization_new_center_distance_overall_impact(df):
     return optimum_row_index
 
 
-def new_center_distance_overall_impact(df, row_index):
+def new_center_distance_overall_impact(df, row_index, weight_column=None):
     """
     Takes a pandas dataframe that has data at a census tract level and a column
     related to distance in minutes to closest child center by census tract.
@@ -208,6 +292,8 @@ def new_center_distance_overall_impact(df, row_index):
     Inputs:
         df (pandas df): the pandas dataframe with data at a census tract level
         row_index (int): row index of the dataframe to be evaluated
+        weight_column (str): optional column weighting the reduced distance of
+            each census tract
 
     Returns (int): impact in haversine distance in the whole dataframe of a new
         center in the census tract related to row_index
@@ -236,5 +322,8 @@ def new_center_distance_overall_impact(df, row_index):
         0,
     )
 
+    if weight_column is not None:
+        df["reduced_distance"] *= df[weight_column]
+
     # return sum reduced distance
     return df["reduced_distance"].sum()
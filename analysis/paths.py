@@ -0,0 +1,67 @@
+import hashlib
+import os
+
+# Folder of the state shards (see analysis/states.py) and the raw inputs they
+# share with the data folder. Any other input of a shard is an output of an
+# earlier stage of the same shard, so it never falls back to the data folder
+# (which holds the outputs of another run).
+SHARD_FOLDER = "states/"
+SHARED_INPUTS = ("Child_Care_Centers.csv", "tl_")
+
+
+def data_path(test, file_name):
+    """
+    Path of a data file, taking the test folder version if it exists (so test
+    runs read what previous test steps saved) and the data folder otherwise.
+    In a state shard only the shared raw inputs fall back to the data folder,
+    so a missing shard input fails instead of reading another run's file.
+
+    Inputs:
+        test (str): test folder prefix ("" or "test/")
+        file_name (str): file name inside the data folder
+
+    Returns (str): path of the file
+    """
+    test_path = test + "data/" + file_name
+    if test and os.path.exists(test_path):
+        return test_path
+    if SHARD_FOLDER in test and not file_name.startswith(SHARED_INPUTS):
+        return test_path
+    return "data/" + file_name
+
+
+def file_hash(path, file_cache=None):
+    """
+    Content hash (sha256) of a file or of all the files in a folder. Hashes
+    are cached by size and modification time, so unchanged files are not read
+    again. Returns None if the path does not exist.
+
+    Inputs:
+        path (str): path of a file or folder
+        file_cache (dict): optional cache {path: [size, mtime, hash]}, updated
+            with the hashed files
+
+    Returns (str): hex digest
+    """
+    if file_cache is None:
+        file_cache = {}
+    if os.path.isdir(path):
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(path)):
+            digest.update(name.encode())
+            digest.update(str(file_hash(os.path.join(path, name), file_cache)).encode())
+        return digest.hexdigest()
+    if not os.path.exists(path):
+        return None
+
+    stat = os.stat(path)
+    cached = file_cache.get(path)
+    if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+        return cached[2]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    file_cache[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+    return digest.hexdigest()
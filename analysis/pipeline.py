@@ -0,0 +1,479 @@
+import ast
+import hashlib
+import inspect
+import json
+import os
+import traceback
+from concurrent.futures import (
+    FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+)
+from analysis import census_api, census_clean, child_centers_clean
+from analysis import distance_matrix_api
+from analysis import distance_cleaning, spatial_join
+from analysis import profiling
+from analysis.paths import data_path, file_hash
+
+STATE_FILE = ".pipeline_state.json"
+
+
+class Stage:
+    """
+    A step of the data pipeline: a function of the analysis modules, the data
+    files it reads and writes (names inside the data folder) and the keyword
+    parameters it is called with. Stages that read the outputs of other stages
+    depend on them. "kind" is "io" for stages that mostly wait for an API and
+    "cpu" for the ones that compute, which decides where they run in parallel.
+    """
+
+    def __init__(self, name, func, inputs, outputs, description, kind="cpu",
+                 params=None, enabled=True):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.outputs = outputs
+        self.description = description
+        self.kind = kind
+        self.params = params or {}
+        self.enabled = enabled
+
+    def run(self, test):
+        print(self.description)
+        self.func(test=test, **self.params)
+
+
+def build_stages(googleapi=False, chunksize=0, state=None):
+    """
+    Declares the stages of the pipeline with their inputs and outputs.
+
+    Inputs:
+        googleapi (bool): Option to run the distance calculator (time and
+            money costly), otherwise its saved output is used as an input
+        chunksize (int): If > 0, clean the distance data in chunks
+        state (str): FIPS code of the state of a shard (see
+            analysis/states.py). A shard cleans its own childcare centers
+            (with the halo of the neighbouring states) and estimates the
+            distances without googleapi, as it has no saved ones. None is the
+            Illinois pipeline of the data folder
+
+    Returns (lst): list of Stage
+    """
+    from analysis.states import tract_folder
+
+    sharded = state is not None
+    tracts = tract_folder(state or "17")
+    # the stage functions default to Illinois
+    state_params = {"state": state} if sharded else {}
+    centers_params, centers_inputs = {}, ["Child_Care_Centers.csv"]
+    centers_output = "Child_Care_Centers_clean2.csv"
+    if sharded:
+        centers_output = "Child_Care_Centers_clean.csv"
+        centers_params = {**state_params, "output": centers_output, "halo": True}
+        centers_inputs = centers_inputs + [tracts]
+
+    return [
+        Stage("census_data", census_api.retreive_census_data,
+              inputs=[],
+              outputs=["Census_data_raw.csv"],
+              description="Retreiving Census Data",
+              kind="io",
+              params=state_params),
+        Stage("census_clean", census_clean.clean_census_data,
+              inputs=["Census_data_raw.csv"],
+              outputs=["Census_data.csv"],
+              description="Cleaning Census Data"),
+        Stage("child_centers_clean", child_centers_clean.clean_child_centers,
+              inputs=centers_inputs,
+              outputs=[centers_output],
+              description="Cleaning Child Center Data",
+              params=centers_params),
+        Stage("spatial_join", spatial_join.assign_ccc_to_ct,
+              inputs=[tracts, "Child_Care_Centers_clean.csv"],
+              outputs=["intermediate_data_backup.csv"],
+              description="Merging Child Center and Census Data",
+              params=state_params),
+        Stage("tract_supply", spatial_join.tract_supply,
+              inputs=[tracts, "Child_Care_Centers_clean.csv"],
+              outputs=["tract_supply.csv"],
+              description="Counting Child Centers in each Census Tract",
+              params=state_params),
+        Stage("distance_api", distance_matrix_api.get_distance_data,
+              inputs=["intermediate_data_backup.csv"],
+              outputs=["census_ccc_joined_backup.csv"],
+              description="Calculating Tract x Child Center Distance",
+              kind="io" if googleapi else "cpu",
+              params={"estimate": True} if sharded and not googleapi else {},
+              enabled=googleapi or sharded),
+        Stage("distance_clean", distance_cleaning.clean_aggregate_merge,
+              inputs=["census_ccc_joined_backup.csv", "Census_data.csv",
+                      "tract_supply.csv"],
+              outputs=["final_data_merged.csv"],
+              description="Cleaning Child Center Distance Data",
+              params={"chunksize": chunksize}),
+    ]
+
+
+STAGE_NAMES = [stage.name for stage in build_stages()]
+
+
+def sort_stages(stages):
+    """
+    Orders the stages so each one comes after the stages that produce its
+    inputs (keeping the declared order otherwise).
+
+    Inputs:
+        stages (lst): list of Stage
+
+    Returns (tuple): sorted list of Stage and a dictionary with the names of
+        the stages each stage depends on
+    """
+    producers = {}
+    for stage in stages:
+        for output in stage.outputs:
+            producers[output] = stage.name
+    depends_on = {
+        stage.name: {producers[i] for i in stage.inputs if i in producers}
+        for stage in stages
+    }
+
+    sorted_stages = []
+    done = set()
+    pending = list(stages)
+    while pending:
+        ready = [stage for stage in pending if depends_on[stage.name] <= done]
+        if not ready:
+            raise ValueError(
+                "Pipeline has a cycle between: "
+                + ", ".join(stage.name for stage in pending)
+            )
+        sorted_stages.append(ready[0])
+        done.add(ready[0].name)
+        pending.remove(ready[0])
+
+    return sorted_stages, depends_on
+
+
+def source_files(code_file):
+    """
+    Source files of a module and of the modules of its package it imports (at
+    the top or inside functions), recursively, so a stage reruns when a helper
+    module it uses changes.
+
+    Inputs:
+        code_file (str): path of the module
+
+    Returns (lst): sorted paths of the files
+    """
+    package_dir = os.path.dirname(os.path.abspath(code_file))
+    package = os.path.basename(package_dir)
+    files = set()
+    pending = [os.path.abspath(code_file)]
+    while pending:
+        path = pending.pop()
+        if path in files:
+            continue
+        files.add(path)
+        with open(path, "r") as file:
+            tree = ast.parse(file.read(), path)
+        for node in ast.walk(tree):
+            # import analysis.x / from analysis import x / from analysis.x import y
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module == package:
+                modules = [f"{package}.{alias.name}" for alias in node.names]
+            elif isinstance(node, ast.ImportFrom):
+                modules = [node.module or ""]
+            else:
+                continue
+            for module in modules:
+                parts = module.split(".")
+                if parts[0] != package or len(parts) < 2:
+                    continue
+                module_file = os.path.join(package_dir, parts[1] + ".py")
+                if os.path.exists(module_file):
+                    pending.append(module_file)
+    return sorted(files)
+
+
+def stage_signature(stage, test, file_cache):
+    """
+    Hash of everything a stage depends on: the source code of its module and
+    of the modules it imports, its parameters and the content of its input
+    files.
+    """
+    code_file = inspect.getsourcefile(inspect.unwrap(stage.func))
+    signature = {
+        "code": {os.path.basename(path): file_hash(path, file_cache)
+                 for path in source_files(code_file)},
+        "params": stage.params,
+        "inputs": {i: file_hash(data_path(test, i), file_cache) for i in stage.inputs},
+    }
+    return hashlib.sha256(json.dumps(signature, sort_keys=True).encode()).hexdigest()
+
+
+def load_state(test):
+    """
+    Loads the signatures of the last run of each stage (and the file hash
+    cache) from the data folder.
+    """
+    path = test + "data/" + STATE_FILE
+    if not os.path.exists(path):
+        return {"stages": {}, "files": {}}
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def save_state(test, state):
+    with open(test + "data/" + STATE_FILE, "w") as file:
+        json.dump(state, file, indent=1)
+
+
+def mark_up_to_date(stages, names, test=""):
+    """
+    Records the current signature of stages whose outputs were updated outside
+    the pipeline (e.g. by delta_refresh), so they are not run again.
+
+    Inputs:
+        stages (lst): list of Stage
+        names (lst): names of the stages to mark
+        test (str): test folder prefix
+    """
+    state = load_state(test)
+    for stage in stages:
+        if stage.name in names:
+            state["stages"][stage.name] = stage_signature(stage, test, state["files"])
+    save_state(test, state)
+
+
+def needs_run(stage, test, state, force):
+    """
+    Checks if a stage has to run: it was forced, an output is missing or its
+    signature changed since its last run.
+
+    Returns (str): reason to run the stage, or None if it is up to date
+    """
+    if stage.name in force or "all" in force:
+        return "forced"
+    missing = [o for o in stage.outputs if not os.path.exists(test + "data/" + o)]
+    if missing:
+        return "missing " + ", ".join(missing)
+    if state["stages"].get(stage.name) != stage_signature(stage, test, state["files"]):
+        return "inputs or code changed"
+    return None
+
+
+def plan_pipeline(stages, test="", force=()):
+    """
+    Dry run: decides which stages would run, without running anything. As the
+    new outputs are not known yet, stages downstream of a stage that runs are
+    planned to run too.
+
+    Returns (lst): list of (stage name, action, reason) tuples
+    """
+    state = load_state(test)
+    sorted_stages, depends_on = sort_stages(stages)
+    plan = []
+    to_run = set()
+    for stage in sorted_stages:
+        if not stage.enabled:
+            plan.append((stage.name, "disabled", "using saved outputs"))
+            continue
+        reason = needs_run(stage, test, state, force)
+        upstream = depends_on[stage.name] & to_run
+        if reason is None and upstream:
+            reason = "upstream " + ", ".join(sorted(upstream)) + " will run"
+        if reason is None:
+            plan.append((stage.name, "skip", "up to date"))
+        else:
+            to_run.add(stage.name)
+            plan.append((stage.name, "run", reason))
+    return plan
+
+
+def run_pipeline(stages, test="", force=(), dry_run=False, workers=1,
+                 cprofile_dir=None):
+    """
+    Runs the stages in dependency order, skipping the ones that are up to date
+    (same inputs, code and parameters as their last run and outputs present),
+    like make. Signatures are saved after each stage, so an interrupted run
+    resumes where it stopped.
+
+    With more than one worker, stages that do not depend on each other run at
+    the same time: "io" stages (API requests) in threads and "cpu" stages in
+    processes, at most "workers" stages in total. If a stage fails, the stages
+    downstream of it are skipped while the others go on, and the error of the
+    first failed stage is raised at the end.
+
+    Inputs:
+        stages (lst): list of Stage
+        test (str): Save data to test folder or regular
+        force (tuple): names of stages to run even if up to date ("all" for
+            every stage)
+        dry_run (bool): only print the plan
+        workers (int): maximum number of stages running at the same time (1
+            runs them one after another in this process)
+        cprofile_dir (str): if profiling is enabled, save the cProfile stats
+            of each stage in this folder
+
+    Returns (lst): names of the stages that ran (or would run)
+    """
+    if dry_run:
+        plan = plan_pipeline(stages, test, force)
+        for name, action, reason in plan:
+            print(f"{action:>8}  {name} ({reason})")
+        return [name for name, action, _ in plan if action == "run"]
+
+    os.makedirs(test + "data", exist_ok=True)
+    state = load_state(test)
+    sorted_stages, depends_on = sort_stages(stages)
+    pending = [stage for stage in sorted_stages if stage.enabled]
+    done = {stage.name for stage in sorted_stages if not stage.enabled}
+    running = {}
+    ran = []
+    failed = {}
+    blocked = set()
+
+    def finish(stage):
+        state["stages"][stage.name] = stage_signature(stage, test, state["files"])
+        save_state(test, state)
+        done.add(stage.name)
+        ran.append(stage.name)
+
+    def fail(stage, error):
+        details = "".join(traceback.format_exception(error))
+        print(f"Stage {stage.name} failed:\n{details}")
+        failed[stage.name] = error
+
+    pools = {}
+    if workers > 1:
+        pools["io"] = ThreadPoolExecutor(max_workers=workers)
+        pools["cpu"] = ProcessPoolExecutor(max_workers=workers)
+    try:
+        while pending or running:
+            # stages downstream of a failed stage do not run (in dependency
+            # order, so the stages downstream of those are skipped too)
+            for stage in list(pending):
+                upstream = depends_on[stage.name] & (set(failed) | blocked)
+                if upstream:
+                    print(f"Skipping {stage.name} (upstream {', '.join(sorted(upstream))} failed)")
+                    pending.remove(stage)
+                    blocked.add(stage.name)
+
+            # start every stage whose upstream stages are done while there
+            # are free workers (skipping an up to date stage can make others
+            # ready, so repeat until stable)
+            ready = pending
+            while ready:
+                ready = [s for s in pending if depends_on[s.name] <= done]
+                for stage in ready:
+                    if pools and len(running) >= workers:
+                        ready = []
+                        break
+                    pending.remove(stage)
+                    # upstream stages already ran, so their new outputs are
+                    # hashed here
+                    if needs_run(stage, test, state, force) is None:
+                        print(f"Skipping {stage.name} (up to date)")
+                        done.add(stage.name)
+                        continue
+                    try:
+                        check_inputs(stage, test)
+                        if stage.kind == "cpu" and pools:
+                            future = pools["cpu"].submit(
+                                run_stage_process, stage, test, profiling.ENABLED,
+                                cprofile_dir)
+                            running[future] = stage
+                        elif pools:
+                            future = pools["io"].submit(
+                                run_stage, stage, test, cprofile_dir)
+                            running[future] = stage
+                        else:
+                            run_stage(stage, test, cprofile_dir)
+                            finish(stage)
+                    except Exception as error:
+                        fail(stage, error)
+
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    fail(stage, error)
+                    continue
+                # measurements taken in worker processes come back as results
+                profiling.merge(future.result() or {})
+                finish(stage)
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    if failed:
+        raise next(iter(failed.values()))
+    return ran
+
+
+def check_inputs(stage, test):
+    """
+    Raises FileNotFoundError if an input of the stage does not exist.
+    """
+    paths = [data_path(test, i) for i in stage.inputs]
+    missing = [path for path in paths if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(
+            f"Stage {stage.name} is missing inputs: " + ", ".join(missing)
+        )
+
+
+def run_stage(stage, test, cprofile_dir=None):
+    """
+    Runs a stage, measuring it when profiling is enabled (time, memory, rows
+    and bytes of its input and output files).
+    """
+    if not profiling.ENABLED:
+        stage.run(test)
+        return
+
+    cprofile_path = None
+    if cprofile_dir:
+        cprofile_path = os.path.join(cprofile_dir, stage.name + ".prof")
+    with profiling.measure("stage " + stage.name, trace_memory=True,
+                           cprofile_path=cprofile_path):
+        rows, size = file_stats([data_path(test, i) for i in stage.inputs])
+        profiling.add(rows_in=rows, bytes_read=size)
+        stage.run(test)
+        rows, size = file_stats([test + "data/" + o for o in stage.outputs])
+        profiling.add(rows_out=rows, bytes_written=size)
+
+
+def run_stage_process(stage, test, profile, cprofile_dir=None):
+    """
+    Runs a stage in a worker process. The process has its own copy of the
+    measurements, so they are returned to be merged in the main process.
+    """
+    profiling.reset()
+    if profile:
+        profiling.enable()
+    run_stage(stage, test, cprofile_dir)
+    return profiling.collect()
+
+
+def file_stats(paths):
+    """
+    Number of data rows (of csv files) and total size in bytes of files or
+    folders.
+
+    Returns (tuple): rows (int) and size (int)
+    """
+    rows, size = 0, 0
+    for path in paths:
+        if os.path.isdir(path):
+            for name in os.listdir(path):
+                sub_rows, sub_size = file_stats([os.path.join(path, name)])
+                rows, size = rows + sub_rows, size + sub_size
+        elif os.path.exists(path):
+            size += os.path.getsize(path)
+            if path.endswith(".csv"):
+                with open(path, "rb") as file:
+                    rows += sum(1 for _ in file) - 1
+    return rows, size
@@ -0,0 +1,201 @@
+import numpy as np
+import shapely
+from analysis.hav_distance import haversine_distance
+
+# NOTE: Placement of a new center anywhere, not only at census tract
+# centroids. The objective is the one of
+# optimization.new_center_distance_overall_impact: the haversine distance to
+# the closest center saved by all the tracts (optionally weighted, e.g. by
+# children under 5). The search is coarse to fine: cells of a grid (5km) that
+# contain tracts are evaluated, then the best cells are split in 3x3 smaller
+# cells again and again. The best site is polished by alternating between the
+# tracts it serves and their weighted geometric median (Weiszfeld), which
+# maximizes the saved distance of those tracts. Every evaluated site counts
+# against a fixed budget, and the centroids of the tracts with the longest
+# travel times (the candidates of the centroid-only search) are evaluated too,
+# so the result is never worse than that search.
+
+KM_PER_DEGREE = 111.32
+SITE_CHUNK = 2_000
+
+
+class SiteSearch:
+    """
+    Evaluates candidate sites in batches: a tract benefits from a site closer
+    than its current closest center, so only the tracts within the largest
+    current distance of a site (found with an STRtree) are compared with it.
+
+    Inputs:
+        df (pandas df): data at a census tract level, with "centroid_lat",
+            "centroid_lon" and "hdistance_min"
+        weight_column (str): optional column weighting each tract
+        budget (int): maximum number of sites to evaluate
+    """
+
+    def __init__(self, df, weight_column=None, budget=20_000):
+        self.lat = df["centroid_lat"].to_numpy(dtype=float)
+        self.lon = df["centroid_lon"].to_numpy(dtype=float)
+        self.hdistance = np.nan_to_num(df["hdistance_min"].to_numpy(dtype=float))
+        if weight_column is None:
+            self.weights = np.ones(len(df))
+        else:
+            self.weights = np.nan_to_num(df[weight_column].to_numpy(dtype=float))
+        self.tree = shapely.STRtree(shapely.points(self.lon, self.lat))
+        # degrees covering the largest distance in any direction
+        max_lat = min(np.abs(self.lat).max(), 89)
+        self.radius = self.hdistance.max() / (KM_PER_DEGREE * np.cos(np.radians(max_lat)))
+        self.budget = budget
+        self.evaluations = 0
+
+    def remaining(self):
+        return max(self.budget - self.evaluations, 0)
+
+    def impacts(self, site_lat, site_lon):
+        """
+        Returns (array): saved distance (km, weighted) of each site
+        """
+        impacts = np.zeros(len(site_lat))
+        self.evaluations += len(site_lat)
+        for start in range(0, len(site_lat), SITE_CHUNK):
+            end = start + SITE_CHUNK
+            sites, tracts = self.served(site_lat[start:end], site_lon[start:end])
+            impacts[start:end] = np.bincount(
+                sites, weights=self.gains(tracts, site_lat[start + sites],
+                                          site_lon[start + sites]),
+                minlength=len(site_lat[start:end]))
+        return impacts
+
+    def served(self, site_lat, site_lon):
+        """
+        Returns (tuple): site and tract indices of the pairs close enough to
+            save distance
+        """
+        return self.tree.query(shapely.points(site_lon, site_lat),
+                               predicate="dwithin", distance=self.radius)
+
+    def gains(self, tracts, site_lat, site_lon):
+        """
+        Returns (array): saved distance of each (tract, site) pair
+        """
+        distance = haversine_distance(self.lat[tracts], self.lon[tracts],
+                                      site_lat, site_lon)
+        return np.maximum(self.hdistance[tracts] - distance, 0) * self.weights[tracts]
+
+
+def to_plane(lat, lon, origin):
+    """
+    Returns (tuple): x, y in km from origin (equirectangular projection)
+    """
+    lat0, lon0 = origin
+    return ((lon - lon0) * KM_PER_DEGREE * np.cos(np.radians(lat0)),
+            (lat - lat0) * KM_PER_DEGREE)
+
+
+def from_plane(x, y, origin):
+    """
+    Returns (tuple): latitude and longitude of plane coordinates
+    """
+    lat0, lon0 = origin
+    return (lat0 + y / KM_PER_DEGREE,
+            lon0 + x / (KM_PER_DEGREE * np.cos(np.radians(lat0))))
+
+
+def best_site(df, weight_column=None, cell_km=5, min_cell_km=0.1, keep=8,
+              budget=20_000, seeds=150, polish_iterations=10):
+    """
+    Finds the site where a new center saves the most distance to the closest
+    center, searching a grid from coarse to fine and polishing the best site.
+
+    Inputs:
+        df (pandas df): data at a census tract level
+        weight_column (str): optional column weighting each tract
+        cell_km (float): size of the coarse cells
+        min_cell_km (float): the cells are refined down to this size
+        keep (int): best sites refined at each level
+        budget (int): maximum number of sites evaluated
+        seeds (int): centroids of the tracts with the longest travel times
+            evaluated as well
+        polish_iterations (int): maximum Weiszfeld polishing rounds
+
+    Returns (tuple): latitude (float), longitude (float) and saved distance in
+        km (float, weighted) of the best site
+    """
+    search = SiteSearch(df, weight_column, budget)
+    origin = (float(np.mean(search.lat)), float(np.mean(search.lon)))
+    x, y = to_plane(search.lat, search.lon, origin)
+
+    # coarse level: cells with tracts inside, the ones with more distance to
+    # save first if there are more than half the budget
+    cells, cell_of_tract = np.unique(np.floor(np.column_stack([x, y]) / cell_km),
+                                     axis=0, return_inverse=True)
+    cell_of_tract = cell_of_tract.ravel()
+    if len(cells) > budget // 2:
+        potential = np.bincount(cell_of_tract,
+                                weights=search.hdistance * search.weights)
+        cells = cells[np.argsort(-potential, kind="stable")[:budget // 2]]
+    candidates = (cells + 0.5) * cell_km
+
+    top = np.argsort(-df["distance_min_imp"].to_numpy(), kind="stable")[:seeds]
+    candidates = np.vstack([candidates, np.column_stack([x[top], y[top]])])
+    candidates = candidates[:search.remaining()]
+    impacts = search.impacts(*from_plane(candidates[:, 0], candidates[:, 1], origin))
+
+    # refinement: split the best cells in 3x3 cells a third of the size
+    offsets = np.array([(i, j) for i in (-1, 0, 1) for j in (-1, 0, 1) if i or j])
+    size = cell_km
+    while size / 3 >= min_cell_km and search.remaining() > 0:
+        size /= 3
+        best = candidates[np.argsort(-impacts, kind="stable")[:keep]]
+        children = (best[:, None, :] + offsets[None, :, :] * size).reshape(-1, 2)
+        children = children[:search.remaining()]
+        child_impacts = search.impacts(*from_plane(children[:, 0], children[:, 1], origin))
+        candidates = np.vstack([candidates, children])
+        impacts = np.concatenate([impacts, child_impacts])
+
+    best = int(np.argmax(impacts))
+    site, impact = candidates[best], impacts[best]
+    site, impact = polish_site(search, site, impact, origin, polish_iterations)
+    lat, lon = from_plane(site[0], site[1], origin)
+    return float(lat), float(lon), float(impact)
+
+
+def polish_site(search, site, impact, origin, iterations=10):
+    """
+    Moves a site to the weighted geometric median (Weiszfeld algorithm) of the
+    tracts it serves, weighted by the tract weights, while the saved distance
+    improves. Serving different tracts at the new site starts a new round
+    (like k-medoids with one center).
+
+    Inputs:
+        search (SiteSearch): the evaluator
+        site (array): x, y of the site in km
+        impact (float): saved distance of the site
+        origin (tuple): origin of the plane coordinates
+
+    Returns (tuple): polished site (array) and its saved distance (float)
+    """
+    x, y = to_plane(search.lat, search.lon, origin)
+    for _ in range(iterations):
+        if search.remaining() == 0:
+            break
+        lat, lon = from_plane(site[0], site[1], origin)
+        _, tracts = search.served(np.array([lat]), np.array([lon]))
+        tracts = tracts[search.gains(tracts, lat, lon) > 0]
+        if len(tracts) == 0:
+            break
+        points = np.column_stack([x[tracts], y[tracts]])
+        weights = search.weights[tracts]
+        median = site
+        for _ in range(50):
+            distance = np.maximum(np.hypot(*(points - median).T), 1e-6)
+            step = np.sum(points * (weights / distance)[:, None], axis=0) / np.sum(
+                weights / distance)
+            converged = np.hypot(*(step - median)) < 1e-3
+            median = step
+            if converged:
+                break
+        new_impact = search.impacts(*from_plane(median[:1], median[1:], origin))[0]
+        if new_impact <= impact:
+            break
+        site, impact = median, new_impact
+    return site, impact
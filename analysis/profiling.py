@@ -0,0 +1,246 @@
+import cProfile
+import functools
+import json
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# NOTE: Profiling is off by default. When it is off, profiled functions only
+# check the ENABLED flag before calling the original function, and measure and
+# add do nothing.
+
+ENABLED = False
+
+FIELDS = ["calls", "wall_s", "cpu_s", "peak_traced_mb", "max_rss_mb", "rows_in",
+          "rows_out", "bytes_read", "bytes_written", "api_calls"]
+MAX_FIELDS = ["peak_traced_mb", "max_rss_mb"]
+
+records = {}
+records_lock = threading.Lock()
+local = threading.local()
+# tracemalloc is process-wide: it is started by the first measurement tracing
+# memory and stopped by the last one, in any thread
+memory_lock = threading.Lock()
+memory_users = 0
+started_tracing = False
+
+
+def enable():
+    global ENABLED
+    ENABLED = True
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+def reset():
+    """
+    Removes all the measurements recorded so far.
+    """
+    with records_lock:
+        records.clear()
+
+
+def collect():
+    """
+    Returns (dict): copy of the measurements, {name: {field: value}}
+    """
+    with records_lock:
+        return {name: dict(record) for name, record in records.items()}
+
+
+def merge(new_records):
+    """
+    Adds measurements taken somewhere else (e.g. in a worker process) to the
+    ones of this process. Times and counters are added up, memory peaks keep
+    the maximum.
+    """
+    with records_lock:
+        for name, new_record in new_records.items():
+            record = records.setdefault(name, dict.fromkeys(FIELDS, 0))
+            for field in FIELDS:
+                if field in MAX_FIELDS:
+                    record[field] = max(record[field], new_record.get(field, 0))
+                else:
+                    record[field] += new_record.get(field, 0)
+
+
+def add(**counters):
+    """
+    Adds to counters (rows_in, rows_out, bytes_read, bytes_written,
+    api_calls) of every measurement running in this thread, e.g.
+    add(api_calls=1) from a function that makes an API request.
+    """
+    if not ENABLED:
+        return
+    for record in getattr(local, "stack", []):
+        for field, value in counters.items():
+            record[field] += value
+
+
+@contextmanager
+def measure(name, trace_memory=False, cprofile_path=None):
+    """
+    Context manager that measures the code inside it: wall and CPU time,
+    counters added with add, the process' maximum RSS and, if trace_memory,
+    the peak memory allocated by Python (tracemalloc). The peak is only reset
+    when no other measurement traces memory, so measurements running at the
+    same time in other threads (e.g. io stages) get the peak since the first
+    of them started, an upper bound that includes the allocations of the
+    others. If cprofile_path is given, the cProfile stats of the block are
+    saved there.
+
+    Inputs:
+        name (str): name the measurement is recorded under (repeated names
+            are added up)
+        trace_memory (bool): trace memory allocations (slower)
+        cprofile_path (str): optional path of a .prof file
+    """
+    if not ENABLED:
+        yield None
+        return
+
+    record = dict.fromkeys(FIELDS, 0)
+    record["calls"] = 1
+    if not hasattr(local, "stack"):
+        local.stack = []
+    local.stack.append(record)
+
+    if trace_memory:
+        start_memory_tracing()
+    profiler = None
+    if cprofile_path:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+
+    try:
+        yield record
+    finally:
+        record["wall_s"] = time.perf_counter() - wall_start
+        record["cpu_s"] = time.thread_time() - cpu_start
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(os.path.dirname(cprofile_path) or ".", exist_ok=True)
+            profiler.dump_stats(cprofile_path)
+        if trace_memory:
+            record["peak_traced_mb"] = stop_memory_tracing() / 2**20
+        # ru_maxrss is in kilobytes on Linux
+        record["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        # the same object (another record can be equal to it)
+        for i in range(len(local.stack) - 1, -1, -1):
+            if local.stack[i] is record:
+                del local.stack[i]
+                break
+        merge({name: record})
+
+
+def start_memory_tracing():
+    """
+    Starts tracing memory allocations for a measurement, or resets the peak
+    if no other measurement is tracing.
+    """
+    global memory_users, started_tracing
+    with memory_lock:
+        if memory_users == 0:
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.start()
+                started_tracing = True
+        memory_users += 1
+
+
+def stop_memory_tracing():
+    """
+    Ends the memory tracing of a measurement, stopping tracemalloc after the
+    last one (if it was started by start_memory_tracing).
+
+    Returns (int): peak traced memory in bytes
+    """
+    global memory_users, started_tracing
+    with memory_lock:
+        peak = tracemalloc.get_traced_memory()[1]
+        memory_users -= 1
+        if memory_users == 0 and started_tracing:
+            tracemalloc.stop()
+            started_tracing = False
+    return peak
+
+
+def profiled(func):
+    """
+    Decorator that measures every call of a (hot) function when profiling is
+    enabled. Calls are recorded under "module.function".
+    """
+    name = func.__module__.replace("analysis.", "") + "." + func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return func(*args, **kwargs)
+        with measure(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def summary_table(run_records, previous_records=None):
+    """
+    Formats the measurements as a text table, with the change in wall time
+    per call against a previous run when available.
+
+    Returns (str): the table
+    """
+    header = (f"{'name':<36}{'calls':>7}{'wall s':>10}{'cpu s':>10}{'peak MB':>9}"
+              f"{'rows in':>10}{'rows out':>10}{'MB read':>9}{'MB written':>11}"
+              f"{'api':>6}{'vs last':>9}")
+    lines = [header, "-" * len(header)]
+    for name, record in run_records.items():
+        change = ""
+        if previous_records and name in previous_records:
+            # compare the wall time per call, runs can have different calls
+            previous = previous_records[name]
+            previous_wall = previous["wall_s"] / max(previous["calls"], 1)
+            wall = record["wall_s"] / max(record["calls"], 1)
+            if previous_wall > 0:
+                change = f"{100 * (wall / previous_wall - 1):+.0f}%"
+        lines.append(
+            f"{name:<36}{record['calls']:>7}{record['wall_s']:>10.2f}"
+            f"{record['cpu_s']:>10.2f}{record['peak_traced_mb']:>9.1f}"
+            f"{record['rows_in']:>10}{record['rows_out']:>10}"
+            f"{record['bytes_read'] / 2**20:>9.1f}"
+            f"{record['bytes_written'] / 2**20:>11.1f}"
+            f"{record['api_calls']:>6}{change:>9}"
+        )
+    return "\n".join(lines)
+
+
+def write_report(run_records, profile_dir="profile"):
+    """
+    Saves the measurements of this run as json in profile_dir (one file per
+    run, so runs can be compared over time) and prints the summary table
+    against the previous run.
+
+    Returns (str): path of the json report
+    """
+    os.makedirs(profile_dir, exist_ok=True)
+    previous = sorted(f for f in os.listdir(profile_dir) if f.startswith("run-"))
+    previous_records = None
+    if previous:
+        with open(os.path.join(profile_dir, previous[-1]), "r") as file:
+            previous_records = json.load(file)["records"]
+
+    path = os.path.join(profile_dir, time.strftime("run-%Y%m%d-%H%M%S.json"))
+    with open(path, "w") as file:
+        json.dump({"created": time.time(), "records": run_records}, file, indent=1)
+
+    print(summary_table(run_records, previous_records))
+    print(f"Profile saved to {path}")
+    return path
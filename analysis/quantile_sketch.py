@@ -0,0 +1,109 @@
+import numpy as np
+
+# NOTE: Compact version of the KLL sketch (Karnin, Lang and Liberty, 2016).
+# It keeps a few "compactors" of values. Values at level h represent 2**h
+# original values, and when a level gets full half of its (sorted) values are
+# promoted to the next level. The rank error is roughly 1.7 / k, independent of
+# how many values are added, and two sketches can be merged.
+
+
+class KLLSketch:
+    """
+    Streaming quantile sketch with bounded memory. Values are added in batches
+    with update, sketches built over different chunks can be combined with
+    merge and quantile returns the approximate quantile of all values seen.
+    """
+
+    def __init__(self, k=400, seed=0):
+        """
+        Inputs:
+            k (int): accuracy parameter (size of the largest compactor)
+            seed (int): seed of the random offsets used when compacting, so
+                results are reproducible
+        """
+        self.k = k
+        self.n = 0
+        self.compactors = [np.empty(0)]
+        self.rng = np.random.default_rng(seed)
+
+    def capacity(self, level):
+        """
+        Maximum number of values that compactor "level" can hold before
+        being compacted. Lower levels get geometrically smaller capacities.
+        """
+        depth = len(self.compactors) - level - 1
+        return max(int(np.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def size(self):
+        """
+        Number of values retained by the sketch (not the number seen).
+        """
+        return sum(len(compactor) for compactor in self.compactors)
+
+    def update(self, values):
+        """
+        Adds an array of values to the sketch (NaN values are ignored).
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        self.n += len(values)
+        self.compactors[0] = np.concatenate([self.compactors[0], values])
+        self.compress()
+
+    def merge(self, other):
+        """
+        Adds all the values seen by other sketch to this one.
+        """
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append(np.empty(0))
+        for level, compactor in enumerate(other.compactors):
+            self.compactors[level] = np.concatenate(
+                [self.compactors[level], compactor]
+            )
+        self.n += other.n
+        self.compress()
+
+    def compress(self):
+        """
+        Compacts every level over its capacity until the sketch is back to its
+        size limit.
+        """
+        level = 0
+        while level < len(self.compactors):
+            compactor = self.compactors[level]
+            if len(compactor) >= self.capacity(level):
+                if level + 1 == len(self.compactors):
+                    self.compactors.append(np.empty(0))
+                compactor = np.sort(compactor)
+                # an odd value out stays in this level
+                leftover = compactor[len(compactor) - len(compactor) % 2 :]
+                compactor = compactor[: len(compactor) - len(compactor) % 2]
+                # keep the even or odd positions, each one now weighs double
+                offset = self.rng.integers(2)
+                self.compactors[level + 1] = np.concatenate(
+                    [self.compactors[level + 1], compactor[offset::2]]
+                )
+                self.compactors[level] = leftover
+                # capacities depend on the height, so start again from the top
+                level = 0
+                continue
+            level += 1
+
+    def quantile(self, q):
+        """
+        Approximate q-quantile (0 <= q <= 1) of the values seen. Returns NaN
+        if the sketch is empty.
+        """
+        if self.n == 0:
+            return np.nan
+        values = np.concatenate(self.compactors)
+        weights = np.concatenate(
+            [np.full(len(c), 2.0**level) for level, c in enumerate(self.compactors)]
+        )
+        order = np.argsort(values)
+        values, weights = values[order], weights[order]
+
+        # rank of each retained value in the original data (midpoint of its
+        # weight), interpolated linearly like pandas' default quantile
+        ranks = (np.cumsum(weights) - weights / 2) / weights.sum()
+        return float(np.interp(q, ranks, values))
@@ -0,0 +1,194 @@
+import itertools
+import json
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from analysis.columnar import ColumnWriter
+from analysis.optimization import create_several_child_centers
+from analysis.travel_estimate import get_estimated_distances, load_speed_bounds
+
+# NOTE: Batch runs of the new child centers simulation (the dashboard button,
+# many times). A scenario file is a json list of scenarios; a list value
+# (other than exclude_tracts) is a sweep, expanded to one scenario per value
+# (every combination if there are several). The census tract data is loaded
+# once and the worker processes get it when they start (forked, so it is not
+# copied). Results are appended to a columnar dataset (analysis/columnar.py)
+# as each scenario finishes, one row per new child center.
+
+SCENARIO_DEFAULTS = {
+    "name": None,
+    "number_child_centers": 1,
+    "optimized": True,
+    "placement": "centroid",
+    "distance": "estimate",
+    "weight_column": None,
+    "exclude_tracts": [],
+}
+
+# census tract data and speed bounds (travel_estimate.speed_bounds) of the
+# worker processes
+baseline = None
+bounds = None
+
+
+def load_scenarios(path):
+    """
+    Reads a scenario file and expands the sweeps.
+
+    Inputs:
+        path (str): json file with a list of scenarios, each a dictionary with
+            any of the keys of SCENARIO_DEFAULTS:
+            name (str): name of the scenario (default: its position)
+            number_child_centers (int): new child centers to allocate
+            optimized (bool): see create_several_child_centers
+            placement (str): "centroid" or "grid"
+            distance (str): "estimate" (offline) or "google" (API, costly)
+            weight_column (str): column weighting the saved distance
+            exclude_tracts (lst): GEOIDs of census tracts left out of the
+                scenario (numbers or strings of digits)
+
+    Returns (lst): list of scenario dictionaries with all the keys
+    """
+    with open(path, "r") as file:
+        entries = json.load(file)
+
+    scenarios = []
+    for i, entry in enumerate(entries):
+        unknown = set(entry) - set(SCENARIO_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Scenario {i} has unknown keys: " + ", ".join(sorted(unknown)))
+        entry = {**SCENARIO_DEFAULTS, **entry}
+        sweeps = {key: value for key, value in entry.items()
+                  if isinstance(value, list) and key != "exclude_tracts"}
+        for values in itertools.product(*sweeps.values()):
+            scenario = {**entry, **dict(zip(sweeps, values))}
+            name = entry["name"] if entry["name"] is not None else str(i)
+            if sweeps:
+                name += "[" + ",".join(f"{k}={v}" for k, v in zip(sweeps, values)) + "]"
+            scenario["name"] = name
+            if scenario["distance"] not in ("estimate", "google"):
+                raise ValueError(f"Scenario {name}: unknown distance {scenario['distance']}")
+            if scenario["placement"] not in ("centroid", "grid"):
+                raise ValueError(f"Scenario {name}: unknown placement {scenario['placement']}")
+            scenario["exclude_tracts"] = parse_geoids(name, scenario["exclude_tracts"])
+            scenarios.append(scenario)
+    return scenarios
+
+
+def parse_geoids(name, geoids):
+    """
+    Reads the GEOIDs of the census tracts excluded from a scenario as
+    integers (the type of the GEOID column of the census tract data).
+
+    Inputs:
+        name (str): name of the scenario (for the error message)
+        geoids (lst): GEOIDs as numbers or strings of digits
+
+    Returns (lst): GEOIDs as int
+    """
+    parsed = []
+    for geoid in geoids:
+        if isinstance(geoid, bool) or not str(geoid).strip().isdigit():
+            raise ValueError(f"Scenario {name}: invalid GEOID in exclude_tracts: {geoid!r}")
+        parsed.append(int(str(geoid).strip()))
+    return parsed
+
+
+def set_baseline(df, speed_bounds=None):
+    """
+    Keeps the census tract data and the speed bounds in a worker process.
+    """
+    global baseline, bounds
+    baseline, bounds = df, speed_bounds
+
+
+def run_scenario(scenario):
+    """
+    Runs one scenario on the census tract data of the process.
+
+    Inputs:
+        scenario (dict): scenario from load_scenarios
+
+    Returns (pandas df): one row per new child center with its ranking,
+        impacts, location and benefited census tracts
+    """
+    df = baseline[~baseline["GEOID"].isin(scenario["exclude_tracts"])].copy()
+    if scenario["distance"] == "google":
+        from analysis.google_api_request import get_google_distances
+        distance_function, user_api_key = get_google_distances, "API_KEY"
+    else:
+        distance_function, user_api_key = get_estimated_distances, None
+
+    (ranking_lst, single_impact_km, single_impact_min, total_benefited_ct,
+     _, _, _, new_centers) = create_several_child_centers(
+        user_api_key, scenario["number_child_centers"], scenario["optimized"],
+        df=df, distance_function=distance_function, return_details=True,
+        placement=scenario["placement"], weight_column=scenario["weight_column"],
+        speed_bounds=bounds)
+
+    return pd.DataFrame({
+        "scenario": scenario["name"],
+        "number_child_centers": scenario["number_child_centers"],
+        "optimized": scenario["optimized"],
+        "placement": scenario["placement"],
+        "distance": scenario["distance"],
+        "weight_column": str(scenario["weight_column"]),
+        "center": range(1, len(ranking_lst) + 1),
+        "ranking": ranking_lst,
+        "latitude": [center[1] for center in new_centers],
+        "longitude": [center[2] for center in new_centers],
+        "impact_km": single_impact_km,
+        "impact_min": single_impact_min,
+        "n_benefited_ct": [len(tracts) for tracts in total_benefited_ct],
+        "benefited_ct": [",".join(str(t) for t in tracts) for tracts in total_benefited_ct],
+    })
+
+
+def run_scenarios(scenarios, df, out, workers=4, test=""):
+    """
+    Runs scenarios in parallel and saves their results as they finish. A
+    scenario that fails is reported and the others go on.
+
+    Inputs:
+        scenarios (lst): scenarios from load_scenarios
+        df (pandas df): census tract data (final_data_merged.csv)
+        out (str): folder of the columnar results (read them with
+            columnar.read_columns)
+        workers (int): processes running scenarios at the same time (1 runs
+            them one after another in this process)
+        test (str): folder prefix of the data the speed bounds are loaded from
+
+    Returns (lst): names of the scenarios that failed
+    """
+    writer = ColumnWriter(out)
+    speed_bounds = load_speed_bounds(test)
+    failed = []
+
+    def save(scenario, result):
+        writer.append(result)
+        print(f"Scenario {scenario['name']} done ({len(result)} centers)")
+
+    if workers <= 1:
+        set_baseline(df, speed_bounds)
+        for scenario in scenarios:
+            try:
+                save(scenario, run_scenario(scenario))
+            except Exception:
+                print(f"Scenario {scenario['name']} failed:\n{traceback.format_exc()}")
+                failed.append(scenario["name"])
+        return failed
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=set_baseline,
+                             initargs=(df, speed_bounds)) as pool:
+        futures = {pool.submit(run_scenario, scenario): scenario
+                   for scenario in scenarios}
+        for future in as_completed(futures):
+            scenario = futures[future]
+            error = future.exception()
+            if error is not None:
+                print(f"Scenario {scenario['name']} failed:\n"
+                      + "".join(traceback.format_exception(error)))
+                failed.append(scenario["name"])
+                continue
+            save(scenario, future.result())
+    return failed
@@ -0,0 +1,138 @@
+import gc
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+import traceback
+from werkzeug.serving import make_server
+from analysis import metrics
+
+# NOTE: Production serving with several worker processes (Linux/macOS, it uses
+# fork). The data is loaded once in the main process before forking, so the
+# workers share its memory pages (copy-on-write) instead of each loading its
+# own copy. gc.freeze moves the loaded objects out of the garbage collector's
+# reach, so collections in the workers do not write to (and copy) those pages.
+# The workers share their metrics through snapshots in a temporary folder (see
+# metrics.py). All the workers accept connections from the same listening
+# socket; a worker that dies is replaced, after a delay that doubles while
+# workers keep failing soon after they start (e.g. missing data), until the
+# server gives up.
+
+# A worker running for less than this (seconds) failed at startup
+MIN_UPTIME = 5
+RESPAWN_DELAY = 0.5
+MAX_FAST_FAILURES = 5
+
+
+def serve(server, host="127.0.0.1", port=8000, workers=4, preload=None):
+    """
+    Serves a WSGI application (e.g. the Flask server of the Dash app) with
+    several worker processes, each one handling requests on threads. Stops on
+    SIGINT or SIGTERM, or after MAX_FAST_FAILURES workers in a row failed at
+    startup.
+
+    Inputs:
+        server (WSGI app): the application
+        host (str): address to listen on
+        port (int): port to listen on
+        workers (int): number of worker processes
+        preload (function): optional function loading the data before the
+            workers are started
+    """
+    if preload is not None:
+        preload()
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(128)
+    listener.set_inheritable(True)
+
+    metrics_dir = tempfile.mkdtemp(prefix="dashboard-metrics-")
+    metrics.enable_multiprocess(metrics_dir)
+
+    gc.collect()
+    gc.freeze()
+
+    children = {}
+    stopping = False
+    fast_failures = 0
+
+    parent = os.getpid()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        if os.getpid() != parent:
+            # a worker stopped before it installed its own handlers
+            os._exit(0)
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for _ in range(workers):
+        children[start_worker(server, host, port, listener)] = time.monotonic()
+    print(f"Serving on http://{host}:{port} with {workers} workers")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = children.pop(pid, None)
+        if stopping or started is None:
+            continue
+        code = os.waitstatus_to_exitcode(status)
+        if time.monotonic() - started < MIN_UPTIME:
+            fast_failures += 1
+        else:
+            fast_failures = 0
+        if fast_failures >= MAX_FAST_FAILURES:
+            print(f"Worker {pid} stopped (exit code {code}), {fast_failures} "
+                  "workers failed at startup in a row, stopping the server")
+            stop(signal.SIGTERM, None)
+            continue
+        delay = RESPAWN_DELAY * 2 ** fast_failures if fast_failures else 0
+        print(f"Worker {pid} stopped (exit code {code}), starting a new one"
+              + (f" in {delay:g}s" if delay else ""))
+        time.sleep(delay)
+        if not stopping:
+            children[start_worker(server, host, port, listener)] = time.monotonic()
+    listener.close()
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    if fast_failures >= MAX_FAST_FAILURES:
+        raise SystemExit("The workers failed at startup")
+
+
+def start_worker(server, host, port, listener):
+    """
+    Forks a worker process serving requests from the listening socket.
+
+    Returns (int): process id of the worker
+    """
+    pid = os.fork()
+    if pid:
+        return pid
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    code = 0
+    try:
+        metrics.start_snapshots()
+        worker = make_server(host, port, server, threaded=True, fd=listener.fileno())
+        worker.serve_forever()
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        # never return into the caller's code (the server loop of the parent)
+        os._exit(code)
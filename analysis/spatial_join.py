@@ -1,27 +1,49 @@
 # Import libraries
 import pandas as pd
-import geopandas as gpd
-import matplotlib.pyplot as plt
+from analysis import profiling
 from analysis.hav_distance import haversine_distance
+from analysis.paths import data_path
 
 
-def prepare_data():
+def prepare_data(test="", state="17"):
     """
     This function loads and prepares the census tract (ct) shapefile and
     childcare center (ccc) data for the spatial join. This implies turning both
     of them in GeoPandas, creating centroids and getting the coordinates for the
     ct shapefile, and setting a common CRS for both GeoPandas dataframes.
 
+    Inputs:
+        state (str): FIPS code of the state of the census tract shapefile
+
     Returns:
         ct (GeoPandas): prepared census tract data
         ccc_il_gpd (GeoPandas): prepared childcare centers data
     """
+    import geopandas as gpd
+    from analysis.states import tract_folder
+
     # Read and prepare data
     ct = gpd.read_file(
-        "data/tl_2023_17_tract/tl_2023_17_tract.shp"
+        data_path(test, f"{tract_folder(state)}/{tract_folder(state)}.shp")
     )  # Census Tracts (ct)
-    ccc_il = pd.read_csv("data/Child_Care_Centers_clean.csv")  # ChilCareCenters (ccc)
+    ccc_il = pd.read_csv(
+        data_path(test, "Child_Care_Centers_clean.csv")
+    )  # ChilCareCenters (ccc)
+
+    return prepare_tracts(ct), prepare_centers(ccc_il)
+
+
+def prepare_tracts(ct):
+    """
+    Calculates centroids and adds their coordinates as new columns to the
+    census tract Geo DataFrame.
+
+    Inputs:
+        ct (GeoPandas): census tract polygons
 
+    Returns (GeoPandas): census tracts with "centroid", "centroid_lat" and
+        "centroid_lon"
+    """
     # Calculate centroids and add coordinates as new columns to the original
     # census tract Geo DataFrame
     ct["centroid"] = ct.geometry.centroid
@@ -31,6 +53,21 @@ def prepare_data():
     # Set CRS to avoid spatial issues later
     ct.crs = "EPSG:4326"
 
+    return ct
+
+
+def prepare_centers(ccc_il):
+    """
+    Turns the childcare centers data (from a csv) into a Geo DataFrame of
+    points.
+
+    Inputs:
+        ccc_il (pandas df): childcare centers with latitude and longitude
+
+    Returns (GeoPandas): childcare centers as points
+    """
+    import geopandas as gpd
+
     # As ccc came from a csv, it needs to be transformed into a Geo DataFrame
     ccc_il_gpd = gpd.GeoDataFrame(
         ccc_il, geometry=gpd.points_from_xy(ccc_il["longitude"], ccc_il["latitude"])
@@ -39,27 +76,105 @@ def prepare_data():
     # Set CRS to avoid spatial issues
     ccc_il_gpd.crs = "EPSG:4326"
 
-    return ct, ccc_il_gpd
+    return ccc_il_gpd
 
 
 ## Intermediate analysis: Assign each CCC to the census tract it belongs to ##
-# See results in .ipynb
+# First explored in .ipynb, now the tract_supply stage of the pipeline: one
+# bulk STRtree query of all the center points against the tract polygons, and
+# the rollups are sums over the tract of each center (np.bincount), so it
+# scales linearly with the number of centers.
 
 
-def assign_ccc_to_ct(test=""):
+def assign_ccc_to_tracts(ct_gpd, ccc_gpd):
+    """
+    Finds the census tract containing each childcare center (point in polygon).
+
+    Inputs:
+        ct_gpd (GeoPandas): census tract polygons
+        ccc_gpd (GeoPandas): childcare centers (from prepare_centers)
+
+    Returns (array): row of the containing census tract of each center (-1 if
+        it is outside every tract)
+    """
+    import numpy as np
+    import shapely
+
+    tree = shapely.STRtree(ct_gpd.geometry.values)
+    # "intersects" keeps the centers on a border ("within" excludes them), a
+    # center on the border of two tracts goes to the first one
+    ccc_rows, ct_rows = tree.query(ccc_gpd.geometry.values, predicate="intersects")
+    ccc_rows, first = np.unique(ccc_rows, return_index=True)
+    tract_of_ccc = np.full(len(ccc_gpd), -1, dtype=np.int64)
+    tract_of_ccc[ccc_rows] = ct_rows[first]
+    return tract_of_ccc
+
+
+def supply_rollups(ct_gpd, ccc_gpd):
+    """
+    Childcare supply inside each census tract.
+
+    Inputs:
+        ct_gpd (GeoPandas): census tract polygons with "GEOID"
+        ccc_gpd (GeoPandas): childcare centers with "population" (capacity)
+
+    Returns (pandas df): one row per census tract with "GEOID", "ccc_count"
+        (centers in the tract) and "ccc_capacity" (sum of their capacity)
+    """
+    import numpy as np
+
+    tract_of_ccc = assign_ccc_to_tracts(ct_gpd, ccc_gpd)
+    inside = tract_of_ccc >= 0
+    capacity = pd.to_numeric(ccc_gpd["population"], errors="coerce").fillna(0)
+    return pd.DataFrame({
+        "GEOID": ct_gpd["GEOID"].to_numpy(),
+        "ccc_count": np.bincount(tract_of_ccc[inside], minlength=len(ct_gpd)),
+        "ccc_capacity": np.bincount(
+            tract_of_ccc[inside], weights=capacity.to_numpy()[inside],
+            minlength=len(ct_gpd)).astype(np.int64),
+    })
+
+
+@profiling.profiled
+def tract_supply(test="", state="17"):
+    """
+    Counts the childcare centers and their capacity inside each census tract.
+    Resulting data is saved as .csv, so the function does not return anything.
+    """
+    ct_gpd, ccc_gpd = prepare_data(test, state)
+    supply = supply_rollups(ct_gpd, ccc_gpd)
+    supply.to_csv(test + "data/tract_supply.csv", index=False)
+
+
+@profiling.profiled
+def assign_ccc_to_ct(test="", state="17"):
     """
     This function performs the spatial join between ct and ccc data using
     spatial buffers for the ct centroids. A large buffer size (45km) is used to
     make sure most ct are assigned at least 3 ccc. Then, haversine distance is
     used to filter the three closest ccc for each ct. Resulting data is saved as
     .csv, so the function does not return anything.
+    """
+    # Call prepare_data to get GeoDataFrames
+    ct_gpd, ccc_gpd = prepare_data(test, state)
+    ct_three_ccc = join_ccc_to_ct(ct_gpd, ccc_gpd)
+
+    # Save data as csv
+    ct_three_ccc.to_csv(test + "data/intermediate_data_backup.csv", index=True)
+
+
+def join_ccc_to_ct(ct_gpd, ccc_gpd):
+    """
+    In-memory part of assign_ccc_to_ct: spatial join of the centers within
+    45km of each census tract centroid, keeping the three closest ones.
 
     Inputs:
-        ct_gpd (GeoPandas): census tract data
-        ccc_gpd (GeoPandas): childcare centers data
+        ct_gpd (GeoPandas): census tract data (from prepare_tracts)
+        ccc_gpd (GeoPandas): childcare centers data (from prepare_centers)
+
+    Returns (GeoPandas): the three closest ccc for each ct
     """
-    # Call prepare_data to get GeoDataFrames
-    ct_gpd, ccc_gpd = prepare_data()
+    import geopandas as gpd
 
     # Generate Geo DataFrame with centroids and selected variables (needed for 
     # further analysis)
@@ -116,5 +231,4 @@ def assign_ccc_to_ct(test=""):
     buffer_ccc = buffer_ccc.sort_values(by="hdistance")
     ct_three_ccc = buffer_ccc.groupby("GEOID").head(3)
 
-    # Save data as csv
-    ct_three_ccc.to_csv(test + "data/intermediate_data_backup.csv", index=True)
+    return ct_three_ccc
@@ -0,0 +1,181 @@
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from analysis.columnar import ColumnWriter
+from analysis.paths import SHARD_FOLDER
+
+# NOTE: Multi-state and national runs. Each state is an independent shard: the
+# whole pipeline runs for it in its own folder, states/<FIPS>/data/ (used as
+# the "test" prefix of the stages, so shared raw inputs such as
+# Child_Care_Centers.csv and the tract shapefiles are read from data/ and the
+# outputs stay in the shard). Shards run in parallel worker processes. Tracts
+# near a border can have their closest centers in another state, so the
+# centers of a shard include a halo: the centers of other states within the
+# search radius of the spatial join (45km) of any of its tract centroids. Each
+# shard only joins its own tracts, so the outputs of the shards do not overlap
+# and are merged into columnar datasets (analysis/columnar.py) in
+# data/states/, one part per state.
+
+# FIPS code: postal abbreviation
+STATES = {
+    "01": "AL", "02": "AK", "04": "AZ", "05": "AR", "06": "CA", "08": "CO",
+    "09": "CT", "10": "DE", "11": "DC", "12": "FL", "13": "GA", "15": "HI",
+    "16": "ID", "17": "IL", "18": "IN", "19": "IA", "20": "KS", "21": "KY",
+    "22": "LA", "23": "ME", "24": "MD", "25": "MA", "26": "MI", "27": "MN",
+    "28": "MS", "29": "MO", "30": "MT", "31": "NE", "32": "NV", "33": "NH",
+    "34": "NJ", "35": "NM", "36": "NY", "37": "NC", "38": "ND", "39": "OH",
+    "40": "OK", "41": "OR", "42": "PA", "44": "RI", "45": "SC", "46": "SD",
+    "47": "TN", "48": "TX", "49": "UT", "50": "VT", "51": "VA", "53": "WA",
+    "54": "WV", "55": "WI", "56": "WY",
+}
+
+# Same search radius as spatial_join.join_ccc_to_ct (45km buffer in degrees)
+HALO_DEGREES = 0.008983 * 45
+
+# Outputs of a shard merged into data/states/ and the index column of each
+# csv (None if it was saved without index)
+SHARD_OUTPUTS = {
+    "final_data_merged.csv": 0,
+    "census_ccc_joined_backup.csv": 0,
+    "tract_supply.csv": None,
+}
+
+
+def tract_folder(state):
+    """
+    Returns (str): name of the TIGER/Line census tract shapefile folder of a
+        state inside the data folder
+    """
+    return f"tl_2023_{state}_tract"
+
+
+def shard_prefix(state, test=""):
+    """
+    Returns (str): folder prefix of the shard of a state (used as the "test"
+        prefix of the pipeline stages)
+    """
+    return f"{test}{SHARD_FOLDER}{state}/"
+
+
+def parse_states(states):
+    """
+    Reads a list of states given as FIPS codes or postal abbreviations.
+
+    Inputs:
+        states (lst): e.g. ["17", "IN", "55"], or ["all"] for every state
+
+    Returns (lst): sorted FIPS codes
+    """
+    if list(states) == ["all"]:
+        return sorted(STATES)
+    fips = {abbreviation: code for code, abbreviation in STATES.items()}
+    codes = set()
+    for state in states:
+        code = fips.get(state.upper(), state.zfill(2))
+        if code not in STATES:
+            raise ValueError(f"Unknown state: {state}")
+        codes.add(code)
+    return sorted(codes)
+
+
+def halo_mask(centers, tracts):
+    """
+    Finds the centers within the search radius of any census tract centroid.
+
+    Inputs:
+        centers (pandas df): centers with "LATITUDE" and "LONGITUDE" (raw
+            Child_Care_Centers.csv columns)
+        tracts (GeoPandas): census tracts (from spatial_join.prepare_tracts)
+
+    Returns (array): True for the centers close to the tracts
+    """
+    import numpy as np
+    import shapely
+
+    tree = shapely.STRtree(shapely.points(tracts["centroid_lon"], tracts["centroid_lat"]))
+    center_rows, _ = tree.query(
+        shapely.points(centers["LONGITUDE"], centers["LATITUDE"]),
+        predicate="dwithin", distance=HALO_DEGREES)
+    mask = np.zeros(len(centers), dtype=bool)
+    mask[center_rows] = True
+    return mask
+
+
+def run_shard(state, googleapi=False, chunksize=0, force=(), test=""):
+    """
+    Runs the pipeline of a state in its shard folder, one stage after another
+    (the shards are the parallel units).
+
+    Returns (lst): names of the stages that ran
+    """
+    from analysis import pipeline
+
+    prefix = shard_prefix(state, test)
+    os.makedirs(prefix + "data", exist_ok=True)
+    stages = pipeline.build_stages(googleapi=googleapi, chunksize=chunksize,
+                                   state=state)
+    return pipeline.run_pipeline(stages, test=prefix, force=force)
+
+
+def run_states(states, googleapi=False, chunksize=0, force=(), workers=4, test=""):
+    """
+    Runs the pipeline of several states in parallel and merges the outputs of
+    the shards that finished. A shard that fails is reported and the others go
+    on.
+
+    Inputs:
+        states (lst): FIPS codes of the states
+        googleapi (bool): get the travel times from the Google API (time and
+            money costly), otherwise they are estimated (travel_estimate)
+        chunksize (int): If > 0, clean the distance data in chunks
+        force (tuple): stages to run even if they are up to date
+        workers (int): shards that run at the same time, each in its own
+            process (1 runs them one after another in this process)
+        test (str): folder prefix of the shards and merged outputs
+
+    Returns (lst): FIPS codes of the states that failed
+    """
+    failed = []
+    if workers <= 1:
+        for state in states:
+            try:
+                run_shard(state, googleapi, chunksize, force, test)
+            except Exception:
+                print(f"State {state} failed:\n{traceback.format_exc()}")
+                failed.append(state)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run_shard, state, googleapi, chunksize, force, test): state
+                       for state in states}
+            for future in as_completed(futures):
+                state = futures[future]
+                error = future.exception()
+                if error is not None:
+                    details = "".join(traceback.format_exception(error))
+                    print(f"State {state} failed:\n{details}")
+                    failed.append(state)
+                    continue
+                print(f"State {state} ({STATES[state]}) done")
+
+    merge_shards([state for state in states if state not in failed], test)
+    return failed
+
+
+def merge_shards(states, test=""):
+    """
+    Merges the outputs of the shards into columnar datasets, one per output in
+    data/states/ (e.g. data/states/final_data_merged), with one part per
+    state. Read them with columnar.read_columns (every state) or
+    columnar.iter_parts (state by state).
+
+    Inputs:
+        states (lst): FIPS codes of the states, in the order of the parts
+        test (str): folder prefix of the shards and merged outputs
+    """
+    for name, index_col in SHARD_OUTPUTS.items():
+        writer = ColumnWriter(test + "data/states/" + name.removesuffix(".csv"))
+        for state in sorted(states):
+            path = shard_prefix(state, test) + "data/" + name
+            if os.path.exists(path):
+                writer.append(pd.read_csv(path, index_col=index_col).reset_index(drop=True))
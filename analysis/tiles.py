@@ -0,0 +1,220 @@
+import functools
+import math
+import numpy as np
+import shapely
+
+# NOTE: Mapbox Vector Tiles (https://github.com/mapbox/vector-tile-spec, v2.1)
+# of the census tracts, encoded directly as protocol buffers. Tracts are
+# projected to Web Mercator once; a tile only clips and simplifies the tracts
+# its bounds touch (found with an STRtree), so the map downloads the visible
+# tracts at the detail of the current zoom. Plotly map layers have a single
+# color, so tracts are split into one tile layer per bin of the colored
+# variable ("tracts_0", "tracts_1", ... and "tracts_na" for missing values).
+
+EXTENT = 4096
+BUFFER = 64
+MAX_ZOOM = 14
+ORIGIN = 20037508.342789244
+LAYER_PREFIX = "tracts_"
+
+# Vector tile commands and geometry type
+MOVE_TO, LINE_TO, CLOSE_PATH = 1, 2, 7
+POLYGON = 3
+
+
+class TileSource:
+    """
+    Census tract polygons and attributes to cut vector tiles from.
+
+    Inputs:
+        gdf (GeoPandas): tracts, with a "GEOID" column and the attribute
+            columns
+        attributes (lst): columns added to every feature of the tiles
+        color_column (str): column used to split the tracts into layers
+        bins (lst): upper edges of the bins of color_column (the last bin has
+            no upper edge)
+    """
+
+    def __init__(self, gdf, attributes, color_column, bins):
+        self.geometries = gdf.to_crs(epsg=3857).geometry.values
+        self.tree = shapely.STRtree(self.geometries)
+        self.attributes = gdf[["GEOID"] + attributes].to_dict("records")
+        values = gdf[color_column].to_numpy(dtype=float)
+        layer = np.searchsorted(np.asarray(bins), values, side="left").astype(object)
+        layer[np.isnan(values)] = "na"
+        self.layers = [LAYER_PREFIX + str(name) for name in layer]
+        self.tile = functools.lru_cache(maxsize=4096)(self.tile)
+
+    def tile(self, z, x, y):
+        """
+        Cuts and encodes one tile (cached, the most recently used tiles are
+        kept).
+
+        Inputs:
+            z, x, y (int): zoom, column and row of the tile
+
+        Returns (bytes): the tile in Mapbox Vector Tile format
+        """
+        size = 2 * ORIGIN / 2**z
+        minx, maxy = -ORIGIN + x * size, ORIGIN - y * size
+        margin = size * BUFFER / EXTENT
+        bounds = (minx - margin, maxy - size - margin, minx + size + margin, maxy + margin)
+
+        rows = self.tree.query(shapely.box(*bounds), predicate="intersects")
+        rows.sort()
+        clipped = shapely.clip_by_rect(self.geometries[rows], *bounds)
+        # one pixel of the tile, smaller details are not visible
+        clipped = shapely.simplify(clipped, size / EXTENT, preserve_topology=True)
+
+        layers = {}
+        for row, geometry in zip(rows, clipped):
+            rings = tile_rings(geometry, minx, maxy, size)
+            if rings:
+                layers.setdefault(self.layers[row], []).append(
+                    (int(row), self.attributes[row], rings))
+        return encode_tile(layers)
+
+
+def tile_rings(geometry, minx, maxy, size):
+    """
+    Converts a (clipped) polygon to integer tile coordinates.
+
+    Returns (lst): (exterior, [interiors]) for each polygon, each ring an
+        integer array without the closing point, exteriors with positive area
+        and interiors with negative area (y axis going down)
+    """
+    polygons = []
+    for polygon in shapely.get_parts(geometry):
+        if polygon.geom_type != "Polygon" or polygon.is_empty:
+            continue
+        rings = []
+        for i, ring in enumerate([polygon.exterior] + list(polygon.interiors)):
+            coords = np.asarray(ring.coords)[:-1, :2]
+            tile_coords = np.column_stack([
+                (coords[:, 0] - minx) / size * EXTENT,
+                (maxy - coords[:, 1]) / size * EXTENT,
+            ]).round().astype(np.int64)
+            keep = np.any(tile_coords != np.roll(tile_coords, 1, axis=0), axis=1)
+            tile_coords = tile_coords[keep]
+            area = signed_area(tile_coords)
+            if len(tile_coords) < 3 or area == 0:
+                if i == 0:
+                    break
+                continue
+            if (area > 0) != (i == 0):
+                tile_coords = tile_coords[::-1]
+            rings.append(tile_coords)
+        if rings:
+            polygons.append(rings)
+    return polygons
+
+
+def signed_area(coords):
+    """
+    Returns (float): twice the signed area of a ring (surveyor's formula)
+    """
+    x, y = coords[:, 0], coords[:, 1]
+    return float(np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y))
+
+
+def encode_varint(value):
+    """
+    Returns (bytes): protocol buffer encoding of a non-negative integer
+    """
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def encode_field(number, wire_type, payload):
+    """
+    Encodes a protocol buffer field: payload is an int for varints (wire type
+    0), bytes for length-delimited fields (wire type 2) and 8 bytes for doubles
+    (wire type 1).
+    """
+    key = encode_varint(number << 3 | wire_type)
+    if wire_type == 0:
+        return key + encode_varint(payload)
+    if wire_type == 2:
+        return key + encode_varint(len(payload)) + payload
+    return key + payload
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def encode_geometry(polygons):
+    """
+    Returns (bytes): packed geometry commands of the polygons
+    """
+    commands = []
+    cursor = np.zeros(2, dtype=np.int64)
+    for rings in polygons:
+        for ring in rings:
+            deltas = np.diff(np.vstack([cursor, ring]), axis=0)
+            encoded = ((deltas << 1) ^ (deltas >> 63)).ravel().tolist()
+            commands.append(MOVE_TO | 1 << 3)
+            commands.extend(encoded[:2])
+            commands.append(LINE_TO | (len(ring) - 1) << 3)
+            commands.extend(encoded[2:])
+            commands.append(CLOSE_PATH | 1 << 3)
+            cursor = ring[-1]
+    return b"".join(encode_varint(command) for command in commands)
+
+
+def encode_value(value):
+    """
+    Returns (bytes): a vector tile Value (string, integer or double)
+    """
+    if isinstance(value, str):
+        return encode_field(1, 2, value.encode())
+    if isinstance(value, (bool, np.bool_)):
+        return encode_field(7, 0, int(value))
+    if isinstance(value, (int, np.integer)):
+        return encode_field(6, 0, zigzag(int(value)))
+    return encode_field(3, 1, np.float64(value).tobytes())
+
+
+def encode_tile(layers):
+    """
+    Encodes the tile.
+
+    Inputs:
+        layers (dict): {layer name: [(feature id, {attribute: value},
+            polygons), ...]}, with polygons as returned by tile_rings
+
+    Returns (bytes): the tile
+    """
+    tile = b""
+    for name, features in layers.items():
+        keys, values = {}, {}
+        encoded_features = b""
+        for feature_id, attributes, polygons in features:
+            tags = []
+            for key, value in attributes.items():
+                if value is None or (isinstance(value, float) and math.isnan(value)):
+                    continue
+                tags.append(keys.setdefault(key, len(keys)))
+                tags.append(values.setdefault((type(value).__name__, value), len(values)))
+            feature = (
+                encode_field(1, 0, feature_id)
+                + encode_field(2, 2, b"".join(encode_varint(t) for t in tags))
+                + encode_field(3, 0, POLYGON)
+                + encode_field(4, 2, encode_geometry(polygons))
+            )
+            encoded_features += encode_field(2, 2, feature)
+
+        layer = (
+            encode_field(15, 0, 2)
+            + encode_field(1, 2, name.encode())
+            + encoded_features
+            + b"".join(encode_field(3, 2, key.encode()) for key in keys)
+            + b"".join(encode_field(4, 2, encode_value(value)) for _, value in values)
+            + encode_field(5, 0, EXTENT)
+        )
+        tile += encode_field(3, 2, layer)
+    return tile
@@ -0,0 +1,150 @@
+import numpy as np
+from analysis import metrics, profiling
+from analysis.hav_distance import haversine_distance
+
+# NOTE: Medians of the Google Distance Matrix API results for Illinois
+# (data/census_ccc_joined.csv, pairs with haversine distance > 0.5 km): the
+# driving distance is about 1.4 times the haversine distance and the average
+# driving speed is about 34 km/h.
+DETOUR_FACTOR = 1.4
+ROAD_SPEED_KMH = 34
+
+
+def get_estimated_distances(
+    df,
+    new_km_distance_column,
+    new_min_distance_column,
+    lat_comparison_column,
+    lon_comparison_column,
+    user_api_key=None,
+    limit_analysis=False,
+):
+    """
+    Offline replacement of get_google_distances (same inputs and output
+    columns) that estimates the driving distance in km and time in minutes from
+    the haversine distance. Useful for benchmarks and simulations without API
+    costs. Modifies the pandas dataframe "df", doesn't have a return.
+
+    Inputs:
+        df (pandas df): Pandas dataframe that has information at a census tract
+            level
+        new_km_distance_column (str): name of the new column of distance in
+            kilometers
+        new_min_distance_column (str): name of the new column of distance in
+            minutes
+        lat_comparison_column (str): column with the latitude of the
+            comparison point
+        lon_comparison_column (str): column with the longitude of the
+            comparison point
+        user_api_key (str): not used, kept to have the same inputs as
+            get_google_distances
+        limit_analysis (bool): if "True", only the rows with value "True" in
+            the column "to_analyze" are estimated, the others are NaN
+    """
+    profiling.add(rows_in=len(df))
+    hdistance = haversine_distance(
+        df["centroid_lat"].astype(float),
+        df["centroid_lon"].astype(float),
+        df[lat_comparison_column].astype(float),
+        df[lon_comparison_column].astype(float),
+    )
+    km_distance = hdistance * DETOUR_FACTOR
+    min_distance = km_distance / ROAD_SPEED_KMH * 60
+
+    if limit_analysis:
+        km_distance = km_distance.where(df["to_analyze"], np.nan)
+        min_distance = min_distance.where(df["to_analyze"], np.nan)
+
+    metrics.DISTANCE_CALLS.inc(backend="estimate")
+    metrics.DISTANCE_ELEMENTS.inc(
+        int(df["to_analyze"].sum()) if limit_analysis else len(df), backend="estimate")
+
+    df[new_km_distance_column] = km_distance
+    df[new_min_distance_column] = min_distance
+
+
+# NOTE: Lower bounds of travel times for the query planner of
+# optimization.create_new_center. A road is never shorter than the haversine
+# distance and no road in the US has a speed limit above 85 mph (137 km/h), so
+# the haversine distance at MAX_SPEED_KMH is a travel time the API will not go
+# below. The fastest effective speed (haversine km per minute of the API
+# travel time) observed in each county, with a margin, only raises the speed
+# of a county if its data is faster than that (e.g. odd API results). Counties
+# with few observed pairs use the fastest speed of all the pairs.
+MAX_SPEED_KMH = 140
+SPEED_MARGIN = 1.1
+MIN_COUNTY_PAIRS = 20
+
+
+def county_codes(df):
+    """
+    Returns (pandas Series): county FIPS code (state and county) of each row
+        of a dataframe with "STATEFP" and "COUNTYFP"
+    """
+    return df["STATEFP"].astype(int) * 1000 + df["COUNTYFP"].astype(int)
+
+
+def speed_bounds(pairs, margin=SPEED_MARGIN, min_pairs=MIN_COUNTY_PAIRS):
+    """
+    Fastest effective speed of the API travel times in each county, at least
+    MAX_SPEED_KMH.
+
+    Inputs:
+        pairs (pandas df): census tract x childcare center pairs with the API
+            travel times (census_ccc_joined_backup.csv)
+        margin (float): multiplies the observed speeds
+        min_pairs (int): counties with fewer pairs (longer than 0.5 km) use
+            the fastest speed of all the pairs
+
+    Returns (pandas Series): haversine km per minute, indexed by county code
+        (see county_codes)
+    """
+    import pandas as pd
+
+    minutes = pd.to_numeric(pairs["distance_minutes"], errors="coerce")
+    valid = (pairs["hdistance"] > 0.5) & (minutes > 0)
+    speed = (pairs["hdistance"] / minutes)[valid]
+    counties = speed.groupby(county_codes(pairs[valid])).agg(["max", "size"])
+    bounds = counties["max"].where(counties["size"] >= min_pairs, speed.max()) * margin
+    return bounds.clip(lower=MAX_SPEED_KMH / 60)
+
+
+def load_speed_bounds(test=""):
+    """
+    speed_bounds of the saved API travel times (census_ccc_joined_backup.csv).
+    Without the file every county gets MAX_SPEED_KMH.
+
+    Inputs:
+        test (str): folder prefix of the data (e.g. "test/" or a state shard)
+
+    Returns (pandas Series): the bounds
+    """
+    import os
+    import pandas as pd
+    from analysis.paths import data_path
+
+    path = data_path(test, "census_ccc_joined_backup.csv")
+    if not os.path.exists(path):
+        return pd.Series(dtype=float)
+    pairs = pd.read_csv(path, usecols=["STATEFP", "COUNTYFP", "hdistance", "distance_minutes"])
+    return speed_bounds(pairs)
+
+
+def minutes_lower_bound(hdistance, counties, center_county, bounds):
+    """
+    Travel time the API will not go below between census tracts and a new
+    center: the haversine distance at the fastest speed of the county of the
+    tract or of the center (MAX_SPEED_KMH for counties without bounds).
+
+    Inputs:
+        hdistance (array): haversine distance in km of each tract to the center
+        counties (array): county code of each tract
+        center_county (int): county code of the center
+        bounds (pandas Series): output of speed_bounds
+
+    Returns (array): minutes
+    """
+    fastest = bounds.max() if len(bounds) else MAX_SPEED_KMH / 60
+    speed = bounds.reindex(counties).fillna(fastest).to_numpy()
+    speed = np.maximum(speed, bounds.get(center_county, fastest))
+    return np.asarray(hdistance) / speed
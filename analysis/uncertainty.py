@@ -0,0 +1,342 @@
+import numpy as np
+import pandas as pd
+from analysis.hav_distance import haversine_distance
+from analysis.paths import data_path
+from analysis.placement import SiteSearch
+from analysis.travel_estimate import (
+    DETOUR_FACTOR, ROAD_SPEED_KMH, county_codes, minutes_lower_bound, speed_bounds
+)
+
+# NOTE: Monte Carlo uncertainty of the travel times. distance_cleaning imputes
+# the minutes of the pairs whose API distance is too long for their haversine
+# distance (above the 90 percentile of the ratio), and everything downstream
+# takes the minutes as exact. Here each draw perturbs the travel times of the
+# census tract x childcare center pairs: the percentile of the imputation rule
+# is drawn (so the set of imputed pairs changes) and every value gets
+# multiplicative log-normal noise, larger for imputed values than for API
+# values. Draws are arrays of shape (draws x tracts x 3) processed in batches,
+# and the greedy placement of optimization.py is replayed on all the draws of a
+# batch at once, to measure how often each recommended census tract is chosen.
+
+# minutes per haversine km of the estimated travel times
+MINUTES_PER_KM = DETOUR_FACTOR / ROAD_SPEED_KMH * 60
+# maximum number of pair values held at once (draws x pairs)
+BATCH_VALUES = 5_000_000
+CANDIDATES = 150
+
+
+class PairTimes:
+    """
+    Travel time inputs of the census tract x childcare center pairs, as arrays
+    of shape (tracts x k) aligned with the census tract data.
+
+    Inputs:
+        pairs (pandas df): pairs with the Google API distances
+            (census_ccc_joined_backup.csv)
+        geoids (array): GEOIDs of the census tracts, in order
+    """
+
+    def __init__(self, pairs, geoids):
+        minutes = pd.to_numeric(pairs["distance_minutes"], errors="coerce")
+        km = pd.to_numeric(pairs["distance_km"], errors="coerce")
+        pairs = pairs.assign(distance_minutes=minutes, distance_km=km,
+                             distance_ratio=km / pairs["hdistance"])
+        pairs = pairs[pairs["GEOID"].isin(geoids)]
+
+        # imputation threshold: percentile of the ratio where hdistance > 0.5
+        ratio = pairs.loc[pairs["hdistance"] > 0.5, "distance_ratio"].to_numpy()
+        self.ratio_sample = ratio[~np.isnan(ratio)]
+
+        order = np.argsort(geoids, kind="stable")
+        rows = order[np.searchsorted(geoids, pairs["GEOID"].to_numpy(), sorter=order)]
+        columns = pairs.groupby("GEOID", sort=False).cumcount().to_numpy()
+        k = int(columns.max()) + 1 if len(columns) else 1
+        shape = (len(geoids), k)
+
+        def matrix(values, fill):
+            out = np.full(shape, fill, dtype=float)
+            out[rows, columns] = values
+            return out
+
+        self.minutes = matrix(pairs["distance_minutes"].to_numpy(), np.nan)
+        self.ratio = matrix(pairs["distance_ratio"].to_numpy(), np.nan)
+        # minutes if the pair is imputed (see impute_distance_minutes)
+        self.discounted = matrix(
+            (pairs["hdistance"] / pairs["distance_km"] * pairs["distance_minutes"]).to_numpy(),
+            np.nan)
+        self.can_impute = matrix(
+            ((pairs["hdistance"] > 0.5) | (pairs["distance_km"] > 0.5)).to_numpy(), 0
+        ).astype(bool)
+        self.has_pairs = np.isin(np.arange(len(geoids)), rows)
+
+    def draw(self, quantiles, rng, sigma_api, sigma_imputed):
+        """
+        Draws travel times to the closest center.
+
+        Inputs:
+            quantiles (array): percentile of the imputation rule of each draw
+            rng (Generator): random numbers
+            sigma_api, sigma_imputed (float): standard deviation of the
+                log-normal noise of API and imputed minutes
+
+        Returns (array): minutes to the closest center (draws x tracts, NaN for
+            tracts without pairs)
+        """
+        if len(self.ratio_sample):
+            thresholds = np.quantile(self.ratio_sample, quantiles)[:, None, None]
+        else:
+            thresholds = np.full((len(quantiles), 1, 1), np.inf)
+        imputed = (self.ratio[None] > thresholds) & self.can_impute[None]
+        sigma = np.where(imputed, sigma_imputed, sigma_api)
+        noise = np.exp(rng.standard_normal(imputed.shape) * sigma)
+        minutes = np.where(imputed, self.discounted[None], self.minutes[None]) * noise
+        with np.errstate(all="ignore"):
+            closest = np.fmin.reduce(minutes, axis=2)
+        return closest
+
+
+def draw_travel_times(pair_times, baseline, n_draws, seed=0, sigma_api=0.1,
+                      sigma_imputed=0.3, quantile_range=(0.85, 0.95)):
+    """
+    Generator of batches of drawn travel times to the closest center.
+
+    Inputs:
+        pair_times (PairTimes): pair inputs
+        baseline (array): current minutes of each tract (distance_min_imp),
+            kept for tracts without pairs
+        n_draws (int): number of draws
+        seed (int): random seed
+        sigma_api (float): log-normal noise of API minutes (~10%)
+        sigma_imputed (float): log-normal noise of imputed minutes (~30%)
+        quantile_range (tuple): the percentile of the imputation rule is drawn
+            uniformly in this range
+
+    Yields (array): minutes (batch draws x tracts)
+    """
+    rng = np.random.default_rng(seed)
+    batch = max(1, BATCH_VALUES // max(pair_times.minutes.size, 1))
+    for start in range(0, n_draws, batch):
+        size = min(batch, n_draws - start)
+        quantiles = rng.uniform(*quantile_range, size)
+        minutes = pair_times.draw(quantiles, rng, sigma_api, sigma_imputed)
+        minutes[:, ~pair_times.has_pairs] = baseline[~pair_times.has_pairs]
+        yield minutes
+
+
+def accessibility_metrics(minutes, weights):
+    """
+    Accessibility of each draw.
+
+    Inputs:
+        minutes (array): minutes to the closest center (draws x tracts)
+        weights (array): weight of each tract (children under 5)
+
+    Returns (pandas df): mean minutes, mean minutes weighted by children under
+        5 and 90 percentile of the minutes of each draw
+    """
+    valid = ~np.isnan(minutes)
+    filled = np.where(valid, minutes, 0)
+    return pd.DataFrame({
+        "mean_minutes": filled.sum(axis=1) / valid.sum(axis=1),
+        "weighted_mean_minutes": (filled * weights).sum(axis=1)
+        / (valid * weights).sum(axis=1),
+        "p90_minutes": np.nanquantile(minutes, 0.9, axis=1),
+    })
+
+
+def greedy_sites(tract_data, minutes, n_centers, optimized, cache=None,
+                 bounds=None):
+    """
+    Replays the greedy placement of create_several_child_centers on every draw
+    at once: each new center goes to the census tract with the longest travel
+    time or, if optimized, to the one with the highest haversine impact among
+    the 150 longest. Then travel times to the new center are estimated from
+    the haversine distance (no API calls per draw) for the tracts whose lower
+    bound of the travel time (travel_estimate.minutes_lower_bound) is below
+    their current time, and its census tract gets 0.1 km and 1 minute.
+    Haversine distances only depend on the previous centers, so they are kept
+    once per sequence of centers (in cache, shared between batches) instead of
+    once per draw.
+
+    Inputs:
+        tract_data (pandas df): data at a census tract level
+        minutes (array): minutes to the closest center (draws x tracts)
+        n_centers (int): number of new centers
+        optimized (bool): as in create_several_child_centers
+        cache (dict): states of the sequences of centers seen so far
+        bounds (pandas Series): fastest travel speed of each county
+            (travel_estimate.speed_bounds), None to skip the lower bound
+
+    Returns (array): row of the census tract of each new center (draws x
+        n_centers)
+    """
+    if cache is None:
+        cache = {}
+    if () not in cache:
+        cache[()] = {"hdistance": tract_data["hdistance_min"].to_numpy(dtype=float)}
+    lat = tract_data["centroid_lat"].to_numpy(dtype=float)
+    lon = tract_data["centroid_lon"].to_numpy(dtype=float)
+    counties = county_codes(tract_data).to_numpy() if bounds is not None else None
+    minutes = np.where(np.isnan(minutes), -np.inf, minutes)
+    sites = np.zeros((len(minutes), n_centers), dtype=np.int64)
+
+    for step in range(n_centers):
+        histories, groups = np.unique(sites[:, :step], axis=0, return_inverse=True)
+        groups = groups.ravel()
+        if optimized:
+            top = longest_times(minutes)
+        for group, history in enumerate(histories):
+            members = np.flatnonzero(groups == group)
+            state = history_state(cache, tuple(history), lat, lon)
+            if optimized:
+                member_top = top[members]
+                impacts = candidate_impacts(state, member_top, lat, lon)
+                sites[members, step] = member_top[
+                    np.arange(len(members)), np.argmax(impacts[member_top], axis=1)]
+            else:
+                sites[members, step] = np.argmax(minutes[members], axis=1)
+
+            for site in np.unique(sites[members, step]):
+                at_site = members[sites[members, step] == site]
+                distance = haversine_distance(lat, lon, lat[site], lon[site])
+                estimate = distance * MINUTES_PER_KM
+                better = estimate < minutes[at_site]
+                if bounds is not None:
+                    better &= minutes_lower_bound(
+                        distance, counties, counties[site], bounds) < minutes[at_site]
+                minutes[at_site] = np.where(better, estimate, minutes[at_site])
+                minutes[at_site, site] = 1
+    return sites
+
+
+def history_state(cache, history, lat, lon):
+    """
+    Haversine distance to the closest center of each tract after placing the
+    centers of history (cached).
+
+    Returns (dict): state with "hdistance"
+    """
+    if history not in cache:
+        previous = history_state(cache, history[:-1], lat, lon)
+        site = history[-1]
+        distance = haversine_distance(lat, lon, lat[site], lon[site])
+        hdistance = np.minimum(previous["hdistance"], distance)
+        hdistance[site] = 0.1
+        cache[history] = {"hdistance": hdistance}
+    return cache[history]
+
+
+def longest_times(minutes):
+    """
+    Returns (array): the 150 tracts with the longest travel time of each draw,
+        longest first (the candidates of
+        optimization_new_center_distance_overall_impact)
+    """
+    n_candidates = min(CANDIDATES, minutes.shape[1])
+    top = np.argpartition(-minutes, n_candidates - 1, axis=1)[:, :n_candidates]
+    order = np.argsort(-np.take_along_axis(minutes, top, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+
+def candidate_impacts(state, candidates, lat, lon):
+    """
+    Haversine impact of a new center at each candidate tract, computed once
+    per state for the candidates not seen before.
+
+    Returns (array): impact of every tract (NaN if not computed)
+    """
+    if "impacts" not in state:
+        state["search"] = SiteSearch(pd.DataFrame({
+            "centroid_lat": lat, "centroid_lon": lon,
+            "hdistance_min": state["hdistance"],
+        }))
+        state["impacts"] = np.full(len(lat), np.nan)
+    impacts = state["impacts"]
+    missing = np.unique(candidates)
+    missing = missing[np.isnan(impacts[missing])]
+    if len(missing):
+        impacts[missing] = state["search"].impacts(lat[missing], lon[missing])
+    return impacts
+
+
+def site_stability(sites, baseline_sites, geoids):
+    """
+    How often each census tract is recommended across the draws.
+
+    Inputs:
+        sites (array): census tract rows of the new centers (draws x centers)
+        baseline_sites (array): census tract rows chosen without perturbation
+        geoids (array): GEOID of each row
+
+    Returns (pandas df): for each step and chosen census tract, the share of
+        draws choosing it at that step and among all the new centers, and
+        whether it is the choice without perturbation
+    """
+    n_draws, n_centers = sites.shape
+    chosen_anywhere = pd.Series(
+        np.concatenate([np.unique(row) for row in sites])).value_counts() / n_draws
+    results = []
+    for step in range(n_centers):
+        rows, counts = np.unique(sites[:, step], return_counts=True)
+        for row, count in zip(rows, counts):
+            results.append((step + 1, geoids[row], count / n_draws,
+                            chosen_anywhere[row], row == baseline_sites[step]))
+    stability = pd.DataFrame(results, columns=["step", "GEOID", "share_at_step",
+                                               "share_anywhere", "baseline"])
+    return stability.sort_values(["step", "share_at_step"], ascending=[True, False],
+                                 ignore_index=True)
+
+
+def run_uncertainty(test="", n_draws=1000, n_centers=5, optimized=True, seed=0,
+                    out=None):
+    """
+    Runs the Monte Carlo analysis on the saved data and saves the results as
+    csv files: uncertainty_tracts.csv (minutes of each census tract: baseline,
+    mean, standard deviation, 5 and 95 percentiles), uncertainty_metrics.csv
+    (accessibility of each draw) and uncertainty_sites.csv (see
+    site_stability).
+
+    Inputs:
+        test (str): test folder prefix ("" or "test/")
+        n_draws (int): number of draws
+        n_centers (int): new centers of the greedy placement
+        optimized (bool): as in create_several_child_centers
+        seed (int): random seed
+        out (str): folder of the results (default: the data folder)
+
+    Returns (pandas df): site stability
+    """
+    tract_data = pd.read_csv(data_path(test, "final_data_merged.csv"), index_col=0)
+    pairs = pd.read_csv(data_path(test, "census_ccc_joined_backup.csv"))
+    out = out or test + "data"
+
+    geoids = tract_data["GEOID"].to_numpy()
+    baseline = tract_data["distance_min_imp"].to_numpy(dtype=float)
+    weights = tract_data["pop_under5"].to_numpy(dtype=float)
+    pair_times = PairTimes(pairs, geoids)
+    bounds = speed_bounds(pairs)
+
+    cache = {}
+    baseline_sites = greedy_sites(tract_data, baseline[None], n_centers, optimized,
+                                  cache, bounds)[0]
+    draws, metrics, sites = [], [], []
+    for minutes in draw_travel_times(pair_times, baseline, n_draws, seed):
+        draws.append(minutes.astype(np.float32))
+        metrics.append(accessibility_metrics(minutes, weights))
+        sites.append(greedy_sites(tract_data, minutes, n_centers, optimized, cache,
+                                  bounds))
+    draws = np.concatenate(draws)
+
+    pd.DataFrame({
+        "GEOID": geoids,
+        "baseline_minutes": baseline,
+        "mean_minutes": np.nanmean(draws, axis=0),
+        "std_minutes": np.nanstd(draws, axis=0),
+        "p05_minutes": np.nanquantile(draws, 0.05, axis=0),
+        "p95_minutes": np.nanquantile(draws, 0.95, axis=0),
+    }).to_csv(out + "/uncertainty_tracts.csv", index=False)
+    pd.concat(metrics, ignore_index=True).to_csv(out + "/uncertainty_metrics.csv",
+                                                 index_label="draw")
+    stability = site_stability(np.concatenate(sites), baseline_sites, geoids)
+    stability.to_csv(out + "/uncertainty_sites.csv", index=False)
+    return stability
@@ -0,0 +1,280 @@
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+import click
+import numpy as np
+from analysis import closures, distance_cleaning, placement, spatial_join
+from analysis.hav_distance import haversine_distance
+from analysis.optimization import create_several_child_centers
+from analysis.travel_estimate import get_estimated_distances, speed_bounds
+from benchmarks.synthetic import SIZES, make_dataset
+
+# NOTE: Each benchmark returns a function to time and the number of items it
+# processes, so results are reported as throughput (items per second). The
+# timed function is run "repeat" times and the best time is kept, then it is
+# run once more with tracemalloc to get its peak memory.
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def bench_haversine(data):
+    """
+    Vectorized haversine distance between tract centroids and random centers.
+    """
+    rng = np.random.default_rng(0)
+    tracts, centers = data["tract_data"], data["centers"]
+    n_pairs = 30 * len(tracts)
+    tract_rows = rng.integers(len(tracts), size=n_pairs)
+    center_rows = rng.integers(len(centers), size=n_pairs)
+    lat1 = tracts["centroid_lat"].to_numpy()[tract_rows]
+    lon1 = tracts["centroid_lon"].to_numpy()[tract_rows]
+    lat2 = centers["latitude"].to_numpy()[center_rows]
+    lon2 = centers["longitude"].to_numpy()[center_rows]
+    return lambda: haversine_distance(lat1, lon1, lat2, lon2), n_pairs
+
+
+def bench_spatial_join(data):
+    """
+    spatial_join.join_ccc_to_ct: 45km buffers, spatial join and three closest
+    centers per tract.
+    """
+    def run():
+        ct = spatial_join.prepare_tracts(data["tracts"].copy())
+        ccc = spatial_join.prepare_centers(data["centers"].copy())
+        return spatial_join.join_ccc_to_ct(ct, ccc)
+
+    return run, len(data["centers"])
+
+
+def bench_tract_supply(data):
+    """
+    spatial_join.supply_rollups: bulk point in polygon of the centers and
+    supply of each tract.
+    """
+    def run():
+        ccc = spatial_join.prepare_centers(data["centers"].copy())
+        return spatial_join.supply_rollups(data["tracts"], ccc)
+
+    return run, len(data["centers"])
+
+
+def bench_distance_cleaning(data):
+    """
+    distance_cleaning in memory: imputation, aggregation and census merge.
+    """
+    def run():
+        ct_three_ccc = distance_cleaning.clean_pairs(data["pairs"].copy())
+        pre_merge = distance_cleaning.aggregate_pairs(ct_three_ccc)
+        return distance_cleaning.merge_census(pre_merge, data["census"])
+
+    return run, len(data["pairs"])
+
+
+def bench_optimization(data, n_centers=3):
+    """
+    optimization.create_several_child_centers (optimized placement) with
+    estimated travel times instead of the Google API.
+    """
+    bounds = speed_bounds(data["pairs"])
+
+    def run():
+        return create_several_child_centers(
+            None, n_centers, True, df=data["tract_data"].copy(),
+            distance_function=get_estimated_distances, speed_bounds=bounds,
+        )
+
+    return run, n_centers
+
+
+def bench_placement(data):
+    """
+    placement.best_site: coarse to fine search of the best site for a new
+    center, anywhere in the map.
+    """
+    return lambda: placement.best_site(data["tract_data"]), 1
+
+
+def bench_closures(data, n_scenarios=1000, n_closed=5):
+    """
+    closures.run_closure_scenarios: closure scenarios of random centers scored
+    with the top-k structure of the pairs.
+    """
+    pairs = distance_cleaning.clean_pairs(data["pairs"].copy())
+    nearest = closures.NearestCenters(pairs, data["centers"])
+    rng = np.random.default_rng(0)
+    ids = pairs["objectid"].unique()
+    scenarios = [rng.choice(ids, n_closed, replace=False) for _ in range(n_scenarios)]
+    return lambda: closures.run_closure_scenarios(nearest, scenarios), n_scenarios
+
+
+def import_times(module):
+    """
+    Imports a module in a new Python process with "python -X importtime".
+
+    Inputs:
+        module (str): module to import
+
+    Returns (dict): cumulative import time in seconds of every module
+        imported, {module: seconds}
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True, cwd=REPO_DIR,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def bench_import_cli(data):
+    """
+    Cold start of the command line (new process importing analysis.__main__).
+    """
+    return lambda: import_times("analysis.__main__"), 1
+
+
+def bench_import_app(data):
+    """
+    Cold start of the dashboard (new process importing analysis.app).
+    """
+    return lambda: import_times("analysis.app"), 1
+
+
+BENCHMARKS = {
+    "haversine": bench_haversine,
+    "spatial_join": bench_spatial_join,
+    "tract_supply": bench_tract_supply,
+    "distance_cleaning": bench_distance_cleaning,
+    "optimization": bench_optimization,
+    "placement": bench_placement,
+    "closures": bench_closures,
+    "import_cli": bench_import_cli,
+    "import_app": bench_import_app,
+}
+
+
+def time_benchmark(func, n_items, repeat):
+    """
+    Times a benchmark function.
+
+    Inputs:
+        func (function): function to time
+        n_items (int): number of items the function processes
+        repeat (int): number of timed runs (the best one is kept)
+
+    Returns (dict): items, seconds, items_per_s and peak_mb
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    best = min(times)
+    return {
+        "items": n_items,
+        "seconds": best,
+        "items_per_s": n_items / best,
+        "peak_mb": peak / 2**20,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the results next to the baseline ones.
+
+    Returns (lst): names of the benchmarks with a throughput more than
+        "tolerance" (fraction) below the baseline
+    """
+    header = ["benchmark", "items", "seconds", "items/s", "peak MB", "vs baseline"]
+    rows = []
+    regressions = []
+    for name, result in results.items():
+        change = ""
+        if name in baseline:
+            ratio = result["items_per_s"] / baseline[name]["items_per_s"]
+            change = f"{100 * (ratio - 1):+.1f}%"
+            if ratio < 1 - tolerance:
+                change += " slower"
+                regressions.append(name)
+        rows.append([name, f"{result['items']}", f"{result['seconds']:.3f}",
+                     f"{result['items_per_s']:.1f}", f"{result['peak_mb']:.1f}", change])
+
+    # size each column to its longest cell so wide values don't run together
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    for row in [header] + rows:
+        cells = [row[0].ljust(widths[0])]
+        cells += [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]
+        print("  ".join(cells))
+    return regressions
+
+
+@click.command()
+@click.option("--size", default="illinois", type=click.Choice(list(SIZES)))
+@click.option("--scale", default=1.0, help="Multiplies the number of tracts and centers", type=float)
+@click.option("--benchmark", "names", multiple=True, type=click.Choice(list(BENCHMARKS)),
+              help="Benchmarks to run (default: all)")
+@click.option("--repeat", default=3, help="Timed runs per benchmark", type=int)
+@click.option("--save_baseline", is_flag=True, help="Save the results as the new baseline")
+@click.option("--check", is_flag=True, help="Fail if a benchmark is slower than the baseline")
+@click.option("--tolerance", default=0.2, help="Allowed throughput drop with --check", type=float)
+@click.option("--importtime", is_flag=True, help="Print the slowest imports of the CLI and the dashboard")
+
+
+def main(size, scale, names, repeat, save_baseline, check, tolerance, importtime):
+    """
+    Runs the benchmarks on a synthetic dataset and compares them with the
+    saved baseline for the same size and scale. Throughput depends on the
+    machine, so the change is only reported unless "check" is set, in which
+    case it exits with an error if a benchmark is slower than the baseline
+    by more than the tolerance.
+    """
+    warnings.filterwarnings("ignore")
+    if importtime:
+        for module in ["analysis.__main__", "analysis.app"]:
+            times = import_times(module)
+            print(f"Slowest imports of {module} ({times[module]:.3f}s in total):")
+            for name, seconds in sorted(times.items(), key=lambda item: -item[1])[1:11]:
+                print(f"  {name:<40}{seconds:>8.3f}s")
+
+    data = make_dataset(size, scale)
+    print(f"Synthetic {size} data: {len(data['tract_data'])} tracts, "
+          f"{len(data['centers'])} centers, {len(data['pairs'])} pairs")
+
+    results = {}
+    for name in names or BENCHMARKS:
+        func, n_items = BENCHMARKS[name](data)
+        results[name] = time_benchmark(func, n_items, repeat)
+
+    baseline_path = os.path.join(BASELINE_DIR, f"{size}_x{scale:g}.json")
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path, "r") as file:
+            baseline = json.load(file)
+    regressions = compare(results, baseline, tolerance)
+
+    if save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path, "w") as file:
+            json.dump({**baseline, **results}, file, indent=1)
+        print(f"Baseline saved to {baseline_path}")
+    elif check and regressions:
+        raise SystemExit("Slower than baseline: " + ", ".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
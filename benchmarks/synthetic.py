@@ -0,0 +1,292 @@
+import os
+import click
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from analysis.hav_distance import haversine_distance
+from analysis.travel_estimate import DETOUR_FACTOR, ROAD_SPEED_KMH
+
+# NOTE: Synthetic data with the same schema as the pipeline data, to measure
+# how the analysis scales beyond Illinois. Tracts are square cells on a grid
+# over the bounding box, centers are placed in tracts with a skewed (lognormal)
+# density, and distances come from the actual nearest synthetic center.
+
+# (number of tracts, number of centers, bounding box lat_min, lat_max,
+# lon_min, lon_max, number of states)
+SIZES = {
+    "illinois": (3_200, 2_900, (36.97, 42.51, -91.51, -87.49), 1),
+    "national": (85_000, 100_000, (24.5, 49.0, -124.7, -67.0), 50),
+}
+TRACTS_PER_COUNTY = 30
+CENSUS_COLUMNS = [
+    "state_name", "state_code", "county_name", "county_code", "tract_name",
+    "tract_code", "tot_pop", "pop_under5", "homeowner_rate", "less_than_hs_rate",
+    "higher_education_rate", "below_poverty_rate", "mobility_rate", "income_cat",
+    "majority_white", "majority_black", "majority_asian", "majority_hispanic",
+]
+
+
+def make_tracts(n_tracts, bbox, n_states=1, seed=0):
+    """
+    Generates census tract polygons with the columns of the TIGER shapefile
+    used by the pipeline.
+
+    Inputs:
+        n_tracts (int): number of tracts
+        bbox (tuple): lat_min, lat_max, lon_min, lon_max
+        n_states (int): number of states the tracts are split into
+        seed (int): random seed
+
+    Returns (GeoPandas): tracts with STATEFP, COUNTYFP, TRACTCE, GEOID
+    """
+    lat_min, lat_max, lon_min, lon_max = bbox
+    aspect = (lon_max - lon_min) / (lat_max - lat_min)
+    n_cols = int(np.ceil(np.sqrt(n_tracts * aspect)))
+    n_rows = int(np.ceil(n_tracts / n_cols))
+    width = (lon_max - lon_min) / n_cols
+    height = (lat_max - lat_min) / n_rows
+
+    i = np.arange(n_tracts)
+    x0 = lon_min + (i % n_cols) * width
+    y0 = lat_min + (i // n_cols) * height
+
+    # consecutive tracts share a state and a county
+    per_state = int(np.ceil(n_tracts / n_states))
+    state = i // per_state
+    in_state = i % per_state
+    county = in_state // TRACTS_PER_COUNTY
+    tract = in_state % TRACTS_PER_COUNTY
+
+    statefp = pd.Series(state + 1).map("{:02d}".format)
+    countyfp = pd.Series(2 * county + 1).map("{:03d}".format)
+    tractce = pd.Series(100 * (tract + 1)).map("{:06d}".format)
+
+    return gpd.GeoDataFrame(
+        {
+            "STATEFP": statefp,
+            "COUNTYFP": countyfp,
+            "TRACTCE": tractce,
+            "GEOID": statefp + countyfp + tractce,
+        },
+        geometry=shapely.box(x0, y0, x0 + width, y0 + height),
+        crs="EPSG:4269",
+    )
+
+
+def make_centers(n_centers, tracts, seed=0):
+    """
+    Generates childcare centers with the columns of
+    data/Child_Care_Centers_clean.csv, placed in the tracts with a skewed
+    density.
+
+    Inputs:
+        n_centers (int): number of centers
+        tracts (GeoPandas): tracts from make_tracts
+
+    Returns (pandas df): the centers
+    """
+    rng = np.random.default_rng(seed)
+    weights = rng.lognormal(0, 1.5, len(tracts))
+    chosen = rng.choice(len(tracts), size=n_centers, p=weights / weights.sum())
+    bounds = tracts.geometry.bounds.to_numpy()[chosen]
+    longitude = rng.uniform(bounds[:, 0], bounds[:, 2])
+    latitude = rng.uniform(bounds[:, 1], bounds[:, 3])
+    geoid = tracts["GEOID"].to_numpy()[chosen]
+
+    objectid = np.arange(1, n_centers + 1)
+    return pd.DataFrame(
+        {
+            "objectid": objectid,
+            "name": [f"CENTER {i}" for i in objectid],
+            "address": [f"{i} MAIN ST" for i in objectid],
+            "city": "CITY",
+            "state": "IL",
+            "zip": 60000 + objectid % 3000,
+            "population": rng.integers(10, 200, n_centers),
+            "county": "COUNTY",
+            "countyfips": [g[:5] for g in geoid],
+            "latitude": latitude,
+            "longitude": longitude,
+            "naics_desc": "CHILD DAY CARE CENTERS",
+        }
+    )
+
+
+def tract_centroids(tracts):
+    """
+    Centroids of the (square) synthetic tracts.
+
+    Returns (tuple): arrays of latitudes and longitudes
+    """
+    bounds = tracts.geometry.bounds.to_numpy()
+    return (bounds[:, 1] + bounds[:, 3]) / 2, (bounds[:, 0] + bounds[:, 2]) / 2
+
+
+def nearest_center_distance(tracts, centers):
+    """
+    Haversine distance (km) from each tract centroid to its nearest center.
+    """
+    centroid_lat, centroid_lon = tract_centroids(tracts)
+    points = shapely.points(centers["longitude"], centers["latitude"])
+    tree = shapely.STRtree(points)
+    _, nearest = tree.query_nearest(shapely.points(centroid_lon, centroid_lat),
+                                    return_distance=False, all_matches=False)
+    return haversine_distance(
+        centroid_lat,
+        centroid_lon,
+        centers["latitude"].to_numpy()[nearest],
+        centers["longitude"].to_numpy()[nearest],
+    )
+
+
+def make_tract_data(tracts, centers, seed=0):
+    """
+    Generates census tract level data with the columns of
+    data/final_data_merged.csv.
+
+    Inputs:
+        tracts (GeoPandas): tracts from make_tracts
+        centers (pandas df): centers from make_centers
+
+    Returns (pandas df): one row per tract
+    """
+    rng = np.random.default_rng(seed)
+    n = len(tracts)
+    centroid_lat, centroid_lon = tract_centroids(tracts)
+
+    hdistance_min = np.maximum(nearest_center_distance(tracts, centers), 0.05)
+    hdistance_mean = hdistance_min * rng.uniform(1.2, 2.5, n)
+    to_minutes = DETOUR_FACTOR / ROAD_SPEED_KMH * 60
+    distance_min_imp = hdistance_min * to_minutes * rng.lognormal(0, 0.2, n)
+    distance_mean_imp = hdistance_mean * to_minutes * rng.lognormal(0, 0.2, n)
+
+    tot_pop = rng.integers(500, 8_000, n)
+    race = rng.choice(4, size=n, p=[0.6, 0.2, 0.05, 0.15])
+    median_income = rng.lognormal(11, 0.4, n)
+
+    return pd.DataFrame(
+        {
+            "GEOID": tracts["GEOID"].astype("int64"),
+            "distance_min_imp": distance_min_imp,
+            "distance_mean_imp": distance_mean_imp,
+            "hdistance_min": hdistance_min,
+            "hdistance_mean": hdistance_mean,
+            "centroid_lat": centroid_lat,
+            "centroid_lon": centroid_lon,
+            "STATEFP": tracts["STATEFP"].astype(int),
+            "COUNTYFP": tracts["COUNTYFP"].astype(int),
+            "TRACTCE": tracts["TRACTCE"].astype(int),
+            "population": rng.integers(30, 600, n),
+            "state_name": " State " + tracts["STATEFP"],
+            "state_code": tracts["STATEFP"].astype(int),
+            "county_name": " County " + tracts["COUNTYFP"],
+            "county_code": tracts["COUNTYFP"].astype(int),
+            "tract_name": "Census Tract " + tracts["TRACTCE"],
+            "tract_code": tracts["TRACTCE"].astype(int),
+            "tot_pop": tot_pop,
+            "pop_under5": (tot_pop * rng.uniform(0.02, 0.09, n)).astype(int) + 10,
+            "homeowner_rate": rng.beta(5, 3, n).round(4),
+            "less_than_hs_rate": rng.beta(1.5, 12, n).round(4),
+            "higher_education_rate": rng.beta(2, 4, n).round(4),
+            "below_poverty_rate": rng.beta(1.5, 9, n).round(4),
+            "mobility_rate": rng.beta(9, 1.5, n).round(4),
+            "income_cat": pd.qcut(median_income, 3, labels=["low", "medium", "high"]),
+            "majority_white": (race == 0).astype(int),
+            "majority_black": (race == 1).astype(int),
+            "majority_asian": (race == 2).astype(int),
+            "majority_hispanic": (race == 3).astype(int),
+        }
+    )
+
+
+def make_pairs(tract_data, centers, seed=0):
+    """
+    Generates census tract x childcare center pairs (three per tract) with the
+    columns of data/census_ccc_joined_backup.csv, including about 10% of
+    "weird" Google API distances for the imputation to correct.
+
+    Inputs:
+        tract_data (pandas df): tract data from make_tract_data
+        centers (pandas df): centers from make_centers
+
+    Returns (pandas df): the pairs
+    """
+    rng = np.random.default_rng(seed)
+    n = len(tract_data) * 3
+    tract_rows = tract_data.loc[
+        np.repeat(tract_data.index.to_numpy(), 3),
+        ["GEOID", "centroid_lat", "centroid_lon", "STATEFP", "COUNTYFP", "TRACTCE"],
+    ].reset_index(drop=True)
+    center_rows = centers.sample(n, replace=True, random_state=seed).reset_index(drop=True)
+
+    hdistance = np.repeat(tract_data["hdistance_min"].to_numpy(), 3) * np.tile(
+        [1.0, 1.3, 1.7], len(tract_data)
+    )
+    detour = DETOUR_FACTOR * rng.lognormal(0, 0.15, n)
+    detour[rng.random(n) < 0.1] *= rng.uniform(2, 6)
+    distance_km = hdistance * detour
+    distance_minutes = distance_km / ROAD_SPEED_KMH * 60 * rng.lognormal(0, 0.2, n)
+
+    pairs = pd.concat([center_rows, tract_rows], axis=1)
+    pairs["hdistance"] = hdistance
+    pairs["distance_km"] = distance_km
+    pairs["distance_minutes"] = distance_minutes
+    return pairs
+
+
+def make_census(tract_data):
+    """
+    Cleaned census data (columns of data/Census_data.csv) for the tracts.
+    """
+    return tract_data[CENSUS_COLUMNS].copy()
+
+
+def make_dataset(size="illinois", scale=1.0, seed=0):
+    """
+    Generates a full synthetic dataset.
+
+    Inputs:
+        size (str): "illinois" (~3k tracts) or "national" (~85k tracts and
+            ~100k centers)
+        scale (float): multiplies the number of tracts and centers
+
+    Returns (dict): tracts (GeoPandas), centers, tract_data, pairs and census
+        (pandas df)
+    """
+    n_tracts, n_centers, bbox, n_states = SIZES[size]
+    tracts = make_tracts(int(n_tracts * scale), bbox, n_states, seed)
+    centers = make_centers(int(n_centers * scale), tracts, seed)
+    tract_data = make_tract_data(tracts, centers, seed)
+    return {
+        "tracts": tracts,
+        "centers": centers,
+        "tract_data": tract_data,
+        "pairs": make_pairs(tract_data, centers, seed),
+        "census": make_census(tract_data),
+    }
+
+
+@click.command()
+@click.option("--size", default="illinois", type=click.Choice(list(SIZES)))
+@click.option("--scale", default=1.0, help="Multiplies the number of tracts and centers", type=float)
+@click.option("--out", default="synthetic/data", help="Folder for the csv files")
+@click.option("--seed", default=0, type=int)
+
+
+def main(size, scale, out, seed):
+    """
+    Saves a synthetic dataset as csv files with the names used by the pipeline.
+    """
+    data = make_dataset(size, scale, seed)
+    os.makedirs(out, exist_ok=True)
+    data["tract_data"].to_csv(os.path.join(out, "final_data_merged.csv"), index=True)
+    data["centers"].to_csv(os.path.join(out, "Child_Care_Centers_clean.csv"), index=False)
+    data["pairs"].to_csv(os.path.join(out, "census_ccc_joined_backup.csv"), index=True)
+    data["census"].to_csv(os.path.join(out, "Census_data.csv"), index=False)
+    data["tracts"].to_file(os.path.join(out, "tracts.gpkg"), driver="GPKG")
+    print(f"Saved {len(data['tracts'])} tracts and {len(data['centers'])} centers to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+from analysis import closures, distance_cleaning
+from analysis.hav_distance import haversine_distance
+from benchmarks.synthetic import make_dataset
+
+
+def small_nearest():
+    """
+    Two census tracts with their 3 closest of 4 centers: tract 1 has centers
+    1, 2, 3 and tract 2 has centers 2, 3, 4 (in order of travel time).
+    """
+    centers = pd.DataFrame({"objectid": [1, 2, 3, 4],
+                            "latitude": [41.0, 41.1, 41.2, 42.0],
+                            "longitude": [-88.0, -88.0, -88.0, -88.0]})
+    pairs = pd.DataFrame({
+        "GEOID": [1, 1, 1, 2, 2, 2],
+        "objectid": [1, 2, 3, 2, 3, 4],
+        "centroid_lat": [41.0] * 3 + [41.5] * 3,
+        "centroid_lon": [-88.0] * 6,
+        "distance_minutes_imp": [5.0, 12.0, 20.0, 30.0, 25.0, 40.0],
+        "hdistance": [0.0, 11.1, 22.2, 44.5, 33.4, 55.6],
+    })
+    return closures.NearestCenters(pairs, centers), centers
+
+
+def test_tract_moves_to_its_next_closest_center():
+    nearest, _ = small_nearest()
+
+    affected, impact_km, impact_min, fallback = closures.score_closure(nearest, [1])
+
+    assert list(affected) == [1]
+    assert impact_min == 12.0 - 5.0
+    assert np.isclose(impact_km, 11.1)
+    assert fallback == 0
+
+
+def test_fallback_when_all_closest_centers_close():
+    nearest, centers = small_nearest()
+
+    affected, impact_km, impact_min, fallback = closures.score_closure(nearest, [1, 2, 3])
+
+    # tract 1 only has center 4 left, out of its 3 closest
+    open_km = haversine_distance(41.0, -88.0, 42.0, -88.0)
+    assert fallback == 1
+    assert list(affected) == [1, 2]
+    assert np.isclose(impact_km, (open_km - 0.0) + (55.6 - 33.4))
+    assert np.isclose(impact_min, open_km * closures.MINUTES_PER_KM - 5.0 + (40.0 - 25.0))
+
+
+def test_relocation_matches_full_recompute():
+    data = make_dataset("illinois", scale=0.02, seed=3)
+    pairs = distance_cleaning.clean_pairs(data["pairs"])
+    centers = data["centers"]
+    nearest = closures.NearestCenters(pairs, centers)
+    moved = pairs["objectid"].drop_duplicates().iloc[:4].to_numpy()
+    moves = {int(i): (41.0 + 0.5 * n, -89.0) for n, i in enumerate(moved)}
+
+    affected, impact_km, impact_min, _ = closures.score_relocation(nearest, moves)
+
+    # every tract recomputed from its pairs, the open centers and the new sites
+    delta_km, delta_min, changed = [], [], []
+    open_centers = centers[~centers["objectid"].isin(moved)]
+    for geoid, tract in pairs.groupby("GEOID"):
+        lat, lon = tract["centroid_lat"].iloc[0], tract["centroid_lon"].iloc[0]
+        kept = tract[~tract["objectid"].isin(moved)]
+        if len(kept):
+            km, minutes = kept["hdistance"].min(), kept["distance_minutes_imp"].min()
+        else:
+            km = haversine_distance(lat, lon, open_centers["latitude"],
+                                    open_centers["longitude"]).min()
+            minutes = km * closures.MINUTES_PER_KM
+        moved_km = min(haversine_distance(lat, lon, *site) for site in moves.values())
+        km, minutes = min(km, moved_km), min(minutes, moved_km * closures.MINUTES_PER_KM)
+        delta_km.append(km - tract["hdistance"].min())
+        delta_min.append(minutes - tract["distance_minutes_imp"].min())
+        if delta_km[-1] != 0 or delta_min[-1] != 0:
+            changed.append(geoid)
+
+    assert len(changed) > 0
+    assert sorted(affected) == changed
+    assert np.isclose(impact_km, sum(delta_km))
+    assert np.isclose(impact_min, sum(delta_min))
+
+
+def test_load_closure_scenarios(tmp_path):
+    path = tmp_path / "closures.txt"
+    path.write_text("# closed centers\n1, 2\n\n3 4 5\n")
+
+    assert closures.load_closure_scenarios(path) == [[1, 2], [3, 4, 5]]
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+from analysis.columnar import ColumnWriter, iter_parts, read_columns, write_columns
+
+
+def sample_frame(n=5, start=0):
+    return pd.DataFrame({
+        "GEOID": np.arange(start, start + n, dtype=np.int64) + 17031000100,
+        "minutes": np.linspace(0.5, 30, n).astype(np.float32),
+        "majority_white": (np.arange(n) % 2).astype(np.int8),
+        "name": ["a", None, "b", "a", "c"][:n],
+        "income_cat": pd.Categorical(["low", "high", "low", "medium", "high"][:n],
+                                     categories=["low", "medium", "high"], ordered=True),
+    })
+
+
+def test_round_trip_keeps_values_and_types(tmp_path):
+    df = sample_frame()
+    write_columns(df, tmp_path / "data")
+    result = read_columns(str(tmp_path / "data"))
+
+    # text columns come back as categories
+    expected = df.assign(name=df["name"].astype("category"))
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_selected_columns_and_mmap(tmp_path):
+    write_columns(sample_frame(), tmp_path / "data")
+    result = read_columns(str(tmp_path / "data"), columns=["minutes"], mmap=True)
+
+    assert list(result.columns) == ["minutes"]
+    assert np.array_equal(result["minutes"].to_numpy(), sample_frame()["minutes"].to_numpy())
+
+
+def test_writer_parts(tmp_path):
+    path = str(tmp_path / "data")
+    writer = ColumnWriter(path)
+    writer.append(sample_frame(5, 0))
+    writer.append(sample_frame(3, 5))
+
+    assert (writer.n_parts, writer.n_rows) == (2, 8)
+    assert [len(part) for part in iter_parts(path)] == [5, 3]
+    assert read_columns(path)["GEOID"].tolist() == list(range(17031000100, 17031000108))
+
+    # a new writer replaces the parts of the previous one
+    ColumnWriter(path).append(sample_frame(2))
+    assert len(read_columns(path)) == 2
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+from analysis import delta_refresh
+from analysis.spatial_join import prepare_centers
+from benchmarks.synthetic import make_dataset
+
+
+def top3(tracts, centers):
+    """
+    Returns (dict): GEOID: sorted (objectid, hdistance) of its three closest
+        centers (full recompute)
+    """
+    pairs = delta_refresh.closest_centers(tracts, prepare_centers(centers.copy()))
+    return {geoid: sorted(zip(group["objectid"], group["hdistance"].round(9)))
+            for geoid, group in pairs.groupby("GEOID")}
+
+
+def test_only_tracts_whose_closest_centers_change_are_affected():
+    data = make_dataset("illinois", scale=0.1, seed=2)
+    tracts, old_centers = data["tract_data"], data["centers"]
+    rng = np.random.default_rng(0)
+
+    # close 5 centers, move 3 and open 4 near random tracts
+    new_centers = old_centers.drop(index=rng.choice(len(old_centers), 5, replace=False))
+    moved = rng.choice(new_centers.index, 3, replace=False)
+    new_centers.loc[moved, "latitude"] += 0.05
+    opened = old_centers.iloc[:4].copy()
+    opened["objectid"] = old_centers["objectid"].max() + 1 + np.arange(4)
+    near = tracts.sample(4, random_state=1)
+    opened["latitude"] = near["centroid_lat"].to_numpy() + 0.01
+    opened["longitude"] = near["centroid_lon"].to_numpy()
+    new_centers = pd.concat([new_centers, opened], ignore_index=True)
+
+    old_pairs = delta_refresh.closest_centers(tracts, prepare_centers(old_centers.copy()))
+    added, removed = delta_refresh.diff_centers(old_centers, new_centers)
+    affected = delta_refresh.affected_tracts(tracts, old_pairs, added, removed)
+
+    before, after = top3(tracts, old_centers), top3(tracts, new_centers)
+    changed = {geoid for geoid in set(before) | set(after)
+               if before.get(geoid) != after.get(geoid)}
+    assert len(changed) > 0
+    assert len(changed) < len(tracts)
+    assert affected == changed
+
+
+def test_no_change_affects_no_tract():
+    data = make_dataset("illinois", scale=0.05, seed=2)
+    centers = data["centers"]
+    pairs = delta_refresh.closest_centers(data["tract_data"], prepare_centers(centers.copy()))
+
+    added, removed = delta_refresh.diff_centers(centers, centers.copy())
+
+    assert delta_refresh.affected_tracts(data["tract_data"], pairs, added, removed) == set()
@@ -0,0 +1,20 @@
+import pandas as pd
+from analysis import distance_cleaning
+from benchmarks.synthetic import make_dataset
+
+
+def test_aggregate_chunks_matches_aggregate_pairs():
+    pairs = distance_cleaning.clean_pairs(make_dataset("illinois", scale=0.05)["pairs"])
+    expected = distance_cleaning.aggregate_pairs(pairs)
+    chunked = distance_cleaning.aggregate_chunks(
+        pairs.iloc[start:start + 100] for start in range(0, len(pairs), 100))
+
+    pd.testing.assert_frame_equal(chunked, expected, check_dtype=False)
+
+
+def test_aggregate_chunks_without_chunks():
+    result = distance_cleaning.aggregate_chunks([])
+
+    assert len(result) == 0
+    assert list(result.columns) == list(distance_cleaning.aggregate_pairs(
+        distance_cleaning.clean_pairs(make_dataset("illinois", scale=0.01)["pairs"])).columns)
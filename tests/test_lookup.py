@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+from analysis.hav_distance import haversine_distance
+from analysis.lookup import CENTER_COLUMNS, CenterIndex
+
+
+def random_centers(n, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = pd.DataFrame({column: "" for column in CENTER_COLUMNS}, index=range(n))
+    centers["objectid"] = np.arange(n)
+    centers["latitude"] = rng.uniform(37, 42.5, n)
+    centers["longitude"] = rng.uniform(-91.5, -87.5, n)
+    return centers
+
+
+def brute_force(centers, lat, lon, k):
+    distance = haversine_distance(lat[:, None], lon[:, None],
+                                  centers["latitude"].to_numpy()[None, :],
+                                  centers["longitude"].to_numpy()[None, :])
+    return np.sort(distance, axis=1)[:, :k]
+
+
+def test_nearest_matches_brute_force():
+    centers = random_centers(500)
+    index = CenterIndex(centers)
+    rng = np.random.default_rng(1)
+    # points inside the area of the centers, a dense corner and far away
+    lat = np.concatenate([rng.uniform(37, 42.5, 200), [37.0, 61.2, -33.9]])
+    lon = np.concatenate([rng.uniform(-91.5, -87.5, 200), [-91.5, -149.9, 151.2]])
+
+    rows, distance = index.nearest(lat, lon, k=5)
+
+    np.testing.assert_allclose(distance, brute_force(centers, lat, lon, 5))
+    np.testing.assert_allclose(
+        haversine_distance(lat[:, None], lon[:, None], centers["latitude"].to_numpy()[rows],
+                           centers["longitude"].to_numpy()[rows]), distance)
+
+
+def test_far_query_finds_the_closest_centers():
+    centers = random_centers(50)
+    index = CenterIndex(centers)
+    # Sydney, on the other side of the planet
+    lat, lon = np.array([-33.9]), np.array([151.2])
+
+    _, distance = index.nearest(lat, lon, k=3)
+
+    assert distance[0, 0] > 10_000
+    np.testing.assert_allclose(distance, brute_force(centers, lat, lon, 3))
+
+
+def test_k_larger_than_the_number_of_centers():
+    centers = random_centers(4)
+    index = CenterIndex(centers)
+    lat, lon = np.array([40.0, 41.0]), np.array([-89.0, -88.0])
+
+    rows, distance = index.nearest(lat, lon, k=10)
+
+    assert rows.shape == (2, 4)
+    assert all(sorted(row) == [0, 1, 2, 3] for row in rows)
+    np.testing.assert_allclose(distance, brute_force(centers, lat, lon, 4))
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pytest
+from analysis.optimization import create_new_center
+from analysis.travel_estimate import get_estimated_distances, speed_bounds
+from benchmarks.synthetic import make_dataset
+
+
+def counting_estimates(requests):
+    """
+    get_estimated_distances that records how many census tracts it is asked.
+    """
+    def distance_function(df, *args, **kwargs):
+        requests.append(len(df))
+        get_estimated_distances(df, *args, **kwargs)
+    return distance_function
+
+
+@pytest.mark.parametrize("optimized, site", [(False, None), (True, None),
+                                             (False, (40.1, -88.9))])
+def test_speed_bounds_do_not_change_the_new_center(optimized, site):
+    data = make_dataset("illinois", scale=0.05, seed=4)
+    df = data["tract_data"]
+    # infinite speed: the lower bound is 0 and every census tract is requested
+    no_bounds = pd.Series({0: np.inf})
+
+    pruned_requests, all_requests = [], []
+    pruned = create_new_center(df.copy(), None, optimized, counting_estimates(pruned_requests),
+                               site=site, speed_bounds=speed_bounds(data["pairs"]))
+    full = create_new_center(df.copy(), None, optimized, counting_estimates(all_requests),
+                             site=site, speed_bounds=no_bounds)
+
+    new_df, benefited, impact_km, impact_min, ranking = pruned
+    assert ranking == full[4]
+    assert sorted(benefited) == sorted(full[1])
+    assert np.isclose(impact_km, full[2]) and np.isclose(impact_min, full[3])
+    pd.testing.assert_frame_equal(new_df, full[0])
+    assert sum(pruned_requests) < sum(all_requests)
@@ -0,0 +1,33 @@
+import pytest
+from analysis.paths import data_path
+from analysis.pipeline import Stage, check_inputs
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    for name in ["Child_Care_Centers.csv", "Census_data.csv"]:
+        (tmp_path / "data" / name).write_text("x\n1\n")
+    return tmp_path
+
+
+def test_test_runs_fall_back_to_the_data_folder(data_dir):
+    assert data_path("test/", "Census_data.csv") == "data/Census_data.csv"
+
+    (data_dir / "test" / "data").mkdir(parents=True)
+    (data_dir / "test" / "data" / "Census_data.csv").write_text("x\n2\n")
+    assert data_path("test/", "Census_data.csv") == "test/data/Census_data.csv"
+
+
+def test_shards_only_fall_back_for_shared_inputs(data_dir):
+    shard = "states/17/"
+    assert data_path(shard, "Child_Care_Centers.csv") == "data/Child_Care_Centers.csv"
+    assert data_path(shard, "tl_2023_17_tract/tl_2023_17_tract.shp") == \
+        "data/tl_2023_17_tract/tl_2023_17_tract.shp"
+    assert data_path(shard, "Census_data.csv") == "states/17/data/Census_data.csv"
+
+    stage = Stage("distance_clean", None, inputs=["Census_data.csv"], outputs=[],
+                  description="")
+    with pytest.raises(FileNotFoundError, match="states/17/data/Census_data.csv"):
+        check_inputs(stage, shard)
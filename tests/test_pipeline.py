@@ -0,0 +1,170 @@
+import time
+import pytest
+from analysis import pipeline
+from analysis.pipeline import Stage
+
+
+def copy_stage(source, target, suffix=""):
+    """
+    Stage function that copies a data file, adding a suffix.
+    """
+    def run(test=""):
+        with open(test + "data/" + source, "r") as file:
+            content = file.read()
+        with open(test + "data/" + target, "w") as file:
+            file.write(content + suffix)
+    return run
+
+
+def fake_stages():
+    """
+    raw.csv -> a -> b, and raw.csv -> c -> d where c always writes the same
+    content.
+    """
+    def constant(test=""):
+        with open(test + "data/c.csv", "w") as file:
+            file.write("c")
+
+    return [
+        Stage("a", copy_stage("raw.csv", "a.csv", "a"), ["raw.csv"], ["a.csv"], ""),
+        Stage("b", copy_stage("a.csv", "b.csv", "b"), ["a.csv"], ["b.csv"], ""),
+        Stage("c", constant, ["raw.csv"], ["c.csv"], ""),
+        Stage("d", copy_stage("c.csv", "d.csv"), ["c.csv"], ["d.csv"], ""),
+    ]
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "raw.csv").write_text("raw")
+    return tmp_path / "data"
+
+
+def test_up_to_date_stages_are_skipped(data_dir):
+    assert sorted(pipeline.run_pipeline(fake_stages())) == ["a", "b", "c", "d"]
+    assert (data_dir / "b.csv").read_text() == "rawab"
+
+    assert pipeline.run_pipeline(fake_stages()) == []
+
+
+def test_force_runs_the_stage(data_dir):
+    pipeline.run_pipeline(fake_stages())
+
+    # b does not change its output, so nothing downstream runs
+    assert pipeline.run_pipeline(fake_stages(), force=("b",)) == ["b"]
+    assert sorted(pipeline.run_pipeline(fake_stages(), force=("all",))) == ["a", "b", "c", "d"]
+
+
+def test_dry_run_only_plans(data_dir):
+    assert pipeline.run_pipeline(fake_stages(), dry_run=True) == ["a", "b", "c", "d"]
+    assert not (data_dir / "a.csv").exists()
+
+    pipeline.run_pipeline(fake_stages())
+    (data_dir / "raw.csv").write_text("new raw")
+    # downstream stages are planned to run as their inputs are not known yet
+    assert pipeline.run_pipeline(fake_stages(), dry_run=True) == ["a", "b", "c", "d"]
+    assert (data_dir / "a.csv").read_text() == "rawa"
+
+
+def test_changed_input_runs_the_stages_it_changes(data_dir):
+    pipeline.run_pipeline(fake_stages())
+    (data_dir / "raw.csv").write_text("new raw")
+
+    # c writes the same output again, so d is still up to date
+    assert sorted(pipeline.run_pipeline(fake_stages())) == ["a", "b", "c"]
+    assert (data_dir / "b.csv").read_text() == "new rawab"
+
+
+def test_signature_includes_imported_modules(tmp_path, monkeypatch):
+    package = tmp_path / "fakepkg"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    (package / "stage.py").write_text(
+        "def run(test=''):\n"
+        "    from fakepkg import helper\n"
+        "    return helper.value\n")
+    (package / "helper.py").write_text("value = 1\n")
+    (package / "unused.py").write_text("")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    from fakepkg import stage as module
+
+    assert pipeline.source_files(module.__file__) == \
+        [str(package / "helper.py"), str(package / "stage.py")]
+
+    stage = Stage("stage", module.run, [], [], "")
+    before = pipeline.stage_signature(stage, "", {})
+    (package / "helper.py").write_text("value = 22\n")
+    assert pipeline.stage_signature(stage, "", {}) != before
+
+
+def timed_stage(test="", inputs=(), output="", seconds=0.3, fail=False):
+    """
+    Stage function that waits and saves when it started and ended (at module
+    level, so process stages can pickle it).
+    """
+    start = time.time()
+    for name in inputs:
+        with open(test + "data/" + name, "r") as file:
+            assert float(file.read().split()[1]) <= start
+    time.sleep(seconds)
+    if fail:
+        raise ValueError(output + " failed")
+    with open(test + "data/" + output, "w") as file:
+        file.write(f"{start} {time.time()}")
+
+
+def timed(name, inputs, kind, fail=False):
+    output = name + ".txt"
+    return Stage(name, timed_stage, list(inputs), [output], "", kind=kind,
+                 params={"inputs": list(inputs), "output": output, "fail": fail})
+
+
+def intervals(data_dir, names):
+    return [tuple(map(float, (data_dir / f"{name}.txt").read_text().split()))
+            for name in names]
+
+
+def max_running(spans):
+    events = sorted([(start, 1) for start, _ in spans] + [(end, -1) for _, end in spans])
+    running, most = 0, 0
+    for _, change in events:
+        running += change
+        most = max(most, running)
+    return most
+
+
+def test_workers_limit_threads_and_processes_together(data_dir):
+    stages = [timed("io1", [], "io"), timed("io2", [], "io"),
+              timed("cpu1", [], "cpu"), timed("cpu2", [], "cpu"),
+              timed("after", ["io1.txt", "cpu1.txt"], "io")]
+
+    ran = pipeline.run_pipeline(stages, workers=2)
+
+    assert sorted(ran) == ["after", "cpu1", "cpu2", "io1", "io2"]
+    spans = intervals(data_dir, ["io1", "io2", "cpu1", "cpu2", "after"])
+    assert max_running(spans) == 2
+    # the dependent stage starts after both of its inputs ended
+    assert spans[4][0] >= max(spans[0][1], spans[2][1])
+
+
+def test_failed_stage_only_stops_its_downstream(data_dir, capsys):
+    stages = [timed("broken", [], "cpu", fail=True),
+              timed("after_broken", ["broken.txt"], "io"),
+              timed("last", ["after_broken.txt"], "cpu"),
+              timed("other", [], "io"),
+              timed("after_other", ["other.txt"], "cpu")]
+
+    with pytest.raises(ValueError, match="broken.txt failed"):
+        pipeline.run_pipeline(stages, workers=2)
+
+    assert (data_dir / "after_other.txt").exists()
+    assert not (data_dir / "after_broken.txt").exists()
+    assert not (data_dir / "last.txt").exists()
+    output = capsys.readouterr().out
+    assert "Stage broken failed" in output
+    assert "Skipping last (upstream after_broken failed)" in output
+
+    # the stages that finished are up to date on the next run
+    stages[0] = timed("broken", [], "cpu")
+    assert sorted(pipeline.run_pipeline(stages, workers=2)) == ["after_broken", "broken", "last"]
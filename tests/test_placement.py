@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+from analysis import placement
+from analysis.hav_distance import haversine_distance
+
+CENTER = (40.0, -89.0)
+
+
+def tracts(lat, lon, hdistance, weights=None):
+    return pd.DataFrame({"centroid_lat": lat, "centroid_lon": lon,
+                         "hdistance_min": hdistance, "distance_min_imp": hdistance,
+                         "weight": np.ones(len(lat)) if weights is None else weights})
+
+
+def square(half_km):
+    """
+    Four unserved tracts (100km from their closest center) at the corners of a
+    square around CENTER and well served tracts far from it.
+    """
+    y, x = np.array([[1, 1], [1, -1], [-1, 1], [-1, -1]]).T * half_km
+    lat, lon = placement.from_plane(x, y, CENTER)
+    far_lat, far_lon = np.full(20, 42.0), np.linspace(-91, -87, 20)
+    return tracts(np.concatenate([lat, far_lat]), np.concatenate([lon, far_lon]),
+                  np.concatenate([np.full(4, 100.0), np.full(20, 1.0)]))
+
+
+def test_best_site_is_the_median_of_the_unserved_tracts():
+    df = square(half_km=4)
+
+    lat, lon, impact = placement.best_site(df)
+
+    # the center of the square is not a tract centroid nor a grid cell center
+    expected = 400 - haversine_distance(df["centroid_lat"][:4], df["centroid_lon"][:4],
+                                        *CENTER).sum()
+    assert haversine_distance(lat, lon, *CENTER) < 0.05
+    assert np.isclose(impact, expected, rtol=1e-4)
+
+
+def test_best_site_is_deterministic():
+    df = square(half_km=7)
+
+    assert placement.best_site(df) == placement.best_site(df)
+
+
+def test_polish_site_moves_to_the_weighted_median():
+    heavy_x, heavy_y = 3.0, -2.0
+    lat, lon = placement.from_plane(np.array([heavy_x, -4.0, 5.0]),
+                                    np.array([heavy_y, 4.0, 3.0]), CENTER)
+    # a tract weighting more than all the others together is the median
+    df = tracts(lat, lon, np.full(3, 50.0), weights=[10.0, 1.0, 1.0])
+    search = placement.SiteSearch(df, "weight")
+    start = np.array([0.0, 0.0])
+    start_impact = search.impacts(*placement.from_plane(start[:1], start[1:], CENTER))[0]
+
+    site, impact = placement.polish_site(search, start, start_impact, CENTER)
+
+    assert np.hypot(site[0] - heavy_x, site[1] - heavy_y) < 0.01
+    assert impact > start_impact
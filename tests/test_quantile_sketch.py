@@ -0,0 +1,64 @@
+import numpy as np
+from analysis.quantile_sketch import KLLSketch
+
+QUANTILES = np.linspace(0.01, 0.99, 99)
+
+
+def rank_errors(sketch, values):
+    """
+    Returns (array): |true rank of the sketch quantile - q| for each quantile
+    """
+    values = np.sort(values)
+    estimates = [sketch.quantile(q) for q in QUANTILES]
+    ranks = np.searchsorted(values, estimates, side="right") / len(values)
+    return np.abs(ranks - QUANTILES)
+
+
+def test_rank_error_is_bounded():
+    values = np.random.default_rng(1).lognormal(2, 1, 200_000)
+    sketch = KLLSketch(k=400)
+    for chunk in np.array_split(values, 50):
+        sketch.update(chunk)
+
+    assert sketch.n == len(values)
+    assert rank_errors(sketch, values).max() < 0.01
+
+
+def test_memory_is_bounded():
+    sketch = KLLSketch(k=200)
+    for chunk in np.array_split(np.random.default_rng(2).random(500_000), 100):
+        sketch.update(chunk)
+
+    assert sketch.size() < 1_000
+
+
+def test_merge_matches_all_values():
+    values = np.random.default_rng(3).normal(size=100_000)
+    sketches = [KLLSketch(k=400, seed=i) for i in range(4)]
+    for sketch, chunk in zip(sketches, np.array_split(values, 4)):
+        sketch.update(chunk)
+    merged = sketches[0]
+    for sketch in sketches[1:]:
+        merged.merge(sketch)
+
+    assert merged.n == len(values)
+    assert rank_errors(merged, values).max() < 0.01
+
+
+def test_exact_while_nothing_is_compacted():
+    values = np.random.default_rng(4).permutation(100).astype(float)
+    sketch = KLLSketch(k=400)
+    sketch.update(values)
+
+    # retained values are ranked at the midpoint of their weight
+    for q in (0, 0.25, 0.5, 0.9, 1):
+        assert sketch.quantile(q) == np.quantile(values, q, method="hazen")
+
+
+def test_nan_is_ignored_and_empty_is_nan():
+    sketch = KLLSketch()
+    assert np.isnan(sketch.quantile(0.5))
+
+    sketch.update([1.0, np.nan, 3.0])
+    assert sketch.n == 2
+    assert sketch.quantile(0.5) == 2.0
@@ -0,0 +1,58 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import box
+from analysis import spatial_join
+
+
+def grid_tracts():
+    """
+    2 x 2 square census tracts: A (bottom left), B (bottom right), C (top left)
+    and D (top right).
+    """
+    return gpd.GeoDataFrame({"GEOID": ["A", "B", "C", "D"]}, geometry=[
+        box(0, 0, 1, 1), box(1, 0, 2, 1), box(0, 1, 1, 2), box(1, 1, 2, 2)],
+        crs="EPSG:4326")
+
+
+def centers(points):
+    return spatial_join.prepare_centers(pd.DataFrame(
+        [(lat, lon, capacity) for lon, lat, capacity in points],
+        columns=["latitude", "longitude", "population"]))
+
+
+def test_supply_rollups_match_a_hand_built_join():
+    ccc = centers([(0.5, 0.5, 10), (0.2, 0.8, 5), (1.5, 0.5, 7),
+                   (0.5, 1.5, np.nan), (1.2, 0.3, "12"), (5.0, 5.0, 100)])
+
+    supply = spatial_join.supply_rollups(grid_tracts(), ccc)
+
+    # the center outside every tract is not counted, missing capacity is 0
+    expected = pd.DataFrame({"GEOID": ["A", "B", "C", "D"],
+                             "ccc_count": [2, 2, 1, 0],
+                             "ccc_capacity": [15, 19, 0, 0]})
+    pd.testing.assert_frame_equal(supply, expected, check_dtype=False)
+
+
+def test_center_on_a_border_is_counted_once():
+    ccc = centers([(1.0, 0.5, 3), (1.0, 1.0, 4), (0.5, 0.5, 1)])
+
+    supply = spatial_join.supply_rollups(grid_tracts(), ccc)
+
+    assert supply["ccc_count"].sum() == 3
+    assert supply["ccc_capacity"].sum() == 8
+    assert supply.loc[supply["GEOID"] == "A", "ccc_count"].item() >= 1
+
+
+def test_supply_rollups_match_geopandas_sjoin():
+    rng = np.random.default_rng(0)
+    ccc = centers(zip(rng.uniform(-0.5, 2.5, 300), rng.uniform(-0.5, 2.5, 300),
+                      rng.integers(0, 50, 300)))
+
+    supply = spatial_join.supply_rollups(grid_tracts(), ccc)
+
+    joined = gpd.sjoin(ccc, grid_tracts(), predicate="within")
+    expected = joined.groupby("GEOID")["population"].agg(["count", "sum"])
+    expected = expected.reindex(["A", "B", "C", "D"], fill_value=0)
+    assert supply["ccc_count"].tolist() == expected["count"].tolist()
+    assert supply["ccc_capacity"].tolist() == expected["sum"].tolist()
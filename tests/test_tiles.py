@@ -0,0 +1,152 @@
+import struct
+import geopandas as gpd
+import numpy as np
+import shapely
+from analysis import tiles
+
+
+def read_varint(data, pos):
+    value, shift = 0, 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, pos
+
+
+def read_message(data):
+    """
+    Minimal protocol buffer reader: {field number: [values]}, with varints as
+    int, length-delimited fields as bytes and doubles as float.
+    """
+    fields, pos = {}, 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 2:
+            length, pos = read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        elif wire_type == 1:
+            value, pos = struct.unpack("<d", data[pos:pos + 8])[0], pos + 8
+        else:
+            raise ValueError(f"unexpected wire type {wire_type}")
+        fields.setdefault(number, []).append(value)
+    return fields
+
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def decode_geometry(data):
+    """
+    Returns (lst): rings of a polygon geometry as lists of (x, y)
+    """
+    commands, pos = [], 0
+    while pos < len(data):
+        value, pos = read_varint(data, pos)
+        commands.append(value)
+    rings, ring, cursor, i = [], [], [0, 0], 0
+    while i < len(commands):
+        command, count = commands[i] & 7, commands[i] >> 3
+        i += 1
+        if command == tiles.CLOSE_PATH:
+            rings.append(ring)
+            continue
+        for _ in range(count):
+            cursor = [cursor[0] + unzigzag(commands[i]), cursor[1] + unzigzag(commands[i + 1])]
+            i += 2
+            if command == tiles.MOVE_TO:
+                ring = []
+            ring.append(tuple(cursor))
+    return rings
+
+
+def decode_value(data):
+    fields = read_message(data)
+    if 1 in fields:
+        return fields[1][0].decode()
+    if 3 in fields:
+        return fields[3][0]
+    if 6 in fields:
+        return unzigzag(fields[6][0])
+    return bool(fields[7][0])
+
+
+def decode_tile(data):
+    """
+    Returns (dict): {layer name: {"extent", "version", "features": [(id,
+        attributes, rings)]}}
+    """
+    layers = {}
+    for layer_data in read_message(data).get(3, []):
+        layer = read_message(layer_data)
+        keys = [key.decode() for key in layer.get(3, [])]
+        values = [decode_value(value) for value in layer.get(4, [])]
+        features = []
+        for feature_data in layer.get(2, []):
+            feature = read_message(feature_data)
+            assert feature[3] == [tiles.POLYGON]
+            tags = []
+            if 2 in feature:
+                pos = 0
+                while pos < len(feature[2][0]):
+                    tag, pos = read_varint(feature[2][0], pos)
+                    tags.append(tag)
+            attributes = {keys[k]: values[v] for k, v in zip(tags[::2], tags[1::2])}
+            features.append((feature[1][0], attributes, decode_geometry(feature[4][0])))
+        layers[layer[1][0].decode()] = {
+            "extent": layer[5][0], "version": layer[15][0], "features": features}
+    return layers
+
+
+def test_varint_and_zigzag():
+    for value in (0, 1, 127, 128, 300, 2**35 + 7):
+        assert read_varint(tiles.encode_varint(value), 0) == (value, len(tiles.encode_varint(value)))
+    for value in (0, -1, 1, -2, 2, -4096, 4096):
+        assert unzigzag(tiles.zigzag(value)) == value
+    assert [tiles.zigzag(v) for v in (0, -1, 1, -2)] == [0, 1, 2, 3]
+
+
+def test_tile_round_trip():
+    # tract 0 with a hole, tract 1 without data for the color column
+    outer = shapely.Polygon([(-88, 41), (-87, 41), (-87, 42), (-88, 42)],
+                            holes=[[(-87.6, 41.4), (-87.4, 41.4), (-87.4, 41.6), (-87.6, 41.6)]])
+    gdf = gpd.GeoDataFrame(
+        {"GEOID": ["17031000100", "17031000200"], "minutes": [12.5, np.nan], "pop": [120, 35]},
+        geometry=[outer, shapely.box(-86.9, 41, -86.5, 41.5)], crs="EPSG:4326")
+    source = tiles.TileSource(gdf, ["minutes", "pop"], "minutes", [10, 20])
+
+    # zoom 0 holds the whole world
+    layers = decode_tile(source.tile(0, 0, 0))
+
+    assert set(layers) == {"tracts_1", "tracts_na"}
+    layer = layers["tracts_1"]
+    assert (layer["version"], layer["extent"]) == (2, tiles.EXTENT)
+    [(feature_id, attributes, rings)] = layer["features"]
+    assert feature_id == 0
+    assert attributes == {"GEOID": "17031000100", "minutes": 12.5, "pop": 120}
+    # missing values are left out
+    assert layers["tracts_na"]["features"][0][1] == {"GEOID": "17031000200", "pop": 35}
+
+
+def test_ring_winding_and_coordinates():
+    size = 2 * tiles.ORIGIN
+    square = shapely.Polygon([(0, 0), (size / 4, 0), (size / 4, size / 4), (0, size / 4)],
+                             holes=[[(size / 16, size / 16), (size / 8, size / 16),
+                                     (size / 8, size / 8), (size / 16, size / 8)]])
+    polygons = tiles.tile_rings(square, -tiles.ORIGIN, tiles.ORIGIN, size)
+    rings = decode_geometry(tiles.encode_geometry(polygons))
+
+    # exterior with positive area and hole with negative area (y down)
+    assert len(rings) == 2
+    assert tiles.signed_area(np.array(rings[0])) > 0
+    assert tiles.signed_area(np.array(rings[1])) < 0
+    # the square goes from the center of the world (2048, 2048) to 3072 in x
+    # and 1024 in y (north is up)
+    xs, ys = zip(*rings[0])
+    assert (min(xs), max(xs), min(ys), max(ys)) == (2048, 3072, 1024, 2048)
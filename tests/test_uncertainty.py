@@ -0,0 +1,61 @@
+import numpy as np
+from analysis import uncertainty
+from analysis.distance_cleaning import clean_pairs
+from benchmarks.synthetic import make_dataset
+
+
+def synthetic(seed=0):
+    data = make_dataset("illinois", scale=0.05, seed=seed)
+    tract_data = data["tract_data"]
+    pair_times = uncertainty.PairTimes(data["pairs"], tract_data["GEOID"].to_numpy())
+    baseline = tract_data["distance_min_imp"].to_numpy(dtype=float)
+    return data, pair_times, baseline
+
+
+def all_draws(pair_times, baseline, n_draws, **kwargs):
+    return np.concatenate(list(uncertainty.draw_travel_times(
+        pair_times, baseline, n_draws, **kwargs)))
+
+
+def test_draws_are_reproducible_with_a_seed(monkeypatch):
+    _, pair_times, baseline = synthetic()
+    # several batches
+    monkeypatch.setattr(uncertainty, "BATCH_VALUES", pair_times.minutes.size * 7)
+
+    first = all_draws(pair_times, baseline, 20, seed=5)
+    second = all_draws(pair_times, baseline, 20, seed=5)
+    other = all_draws(pair_times, baseline, 20, seed=6)
+
+    assert first.shape == (20, len(baseline))
+    np.testing.assert_array_equal(first, second)
+    assert not np.allclose(first, other, equal_nan=True)
+
+
+def test_no_perturbation_draws_the_imputed_minutes():
+    data, pair_times, baseline = synthetic()
+
+    draws = all_draws(pair_times, baseline, 3, sigma_api=0, sigma_imputed=0,
+                      quantile_range=(0.9, 0.9))
+
+    # same as the minimum imputed minutes of distance_cleaning
+    imputed = clean_pairs(data["pairs"]).groupby("GEOID")["distance_minutes_imp"].min()
+    expected = imputed.reindex(data["tract_data"]["GEOID"]).to_numpy()
+    for minutes in draws:
+        np.testing.assert_allclose(minutes, expected)
+
+
+def test_stability_is_one_without_perturbation():
+    data, pair_times, baseline = synthetic()
+    tract_data = data["tract_data"]
+    draws = all_draws(pair_times, baseline, 10, sigma_api=0, sigma_imputed=0,
+                      quantile_range=(0.9, 0.9))
+    baseline_sites = uncertainty.greedy_sites(tract_data, draws[:1], 3, True)[0]
+
+    sites = uncertainty.greedy_sites(tract_data, draws, 3, True)
+    stability = uncertainty.site_stability(sites, baseline_sites,
+                                           tract_data["GEOID"].to_numpy())
+
+    assert len(stability) == 3
+    assert (stability["share_at_step"] == 1.0).all()
+    assert (stability["share_anywhere"] == 1.0).all()
+    assert stability["baseline"].all()